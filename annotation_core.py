@@ -0,0 +1,987 @@
+import base64
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+
+from brush import stroke_mask
+from coco_rle import encode_rle
+from curve_drawing_tool import CurveDrawingTool
+from mask_contours import DEFAULT_POLYGON_TOLERANCE, trace_mask
+from mask_store import HANDS, create_mask_store, union_box
+from shape_index import ShapeIndex
+from undo_history import DEFAULT_MEMORY_BUDGET, PackedMask, UndoHistory, pack_snapshot
+
+FINGER_CATEGORIES = [
+    {"id": 1, "name": "thumb", "color": (255, 0, 0)},
+    {"id": 2, "name": "index", "color": (0, 255, 0)},
+    {"id": 3, "name": "middle", "color": (0, 0, 255)},
+    {"id": 4, "name": "ring", "color": (255, 255, 0)},
+    {"id": 5, "name": "pinky", "color": (255, 0, 255)},
+    {"id": 6, "name": "palm", "color": (0, 255, 255)},
+]
+
+HAND_CATEGORIES = [
+    {"id": 7, "name": "left_hand", "color": (255, 128, 0)},
+    {"id": 8, "name": "right_hand", "color": (0, 128, 255)},
+]
+
+FINGER_NAMES = [category["name"] for category in FINGER_CATEGORIES]
+
+# Saved sessions are "<image name>_session.json" files
+SESSION_SUFFIX = "_session.json"
+SESSION_VERSION = 1
+
+# How finger masks are written to COCO: polygon outlines or compressed RLE of the raster
+SEGMENTATION_FORMATS = ("polygon", "rle")
+
+# Action type -> the list of a finger's vector data that holds its shapes
+SHAPE_LISTS = {"polygon": "polygons", "curve": "curves", "stroke": "strokes", "fill": "fills"}
+
+
+def default_order(entry):
+    """Draw order of a finger saved without one: polygons, curves, fills, then brush strokes"""
+    return [[kind, index] for kind in ("polygon", "curve", "fill", "stroke")
+            for index in range(len(entry[SHAPE_LISTS[kind]]))]
+
+
+def _remove_from_order(order, kind, index):
+    """Drop shape index of kind from a draw order (later shapes of kind move down), returns its position"""
+    position = order.index([kind, index])
+    order[:] = [[k, i - 1 if k == kind and i > index else i] for k, i in order[:position] + order[position + 1:]]
+    return position
+
+
+def _insert_into_order(order, kind, index, position):
+    """Put shape index of kind back into a draw order at position (undoes _remove_from_order)"""
+    order[:] = [[k, i + 1 if k == kind and i >= index else i] for k, i in order]
+    order.insert(position, [kind, index])
+
+
+def session_path_for(image_path):
+    """Default session file path next to an image"""
+    return os.path.splitext(image_path)[0] + SESSION_SUFFIX
+
+
+def curve_tool(curve):
+    """CurveDrawingTool holding the control points and tension of a stored curve dict"""
+    tool = CurveDrawingTool()
+    tool.tension = curve.get("tension", 0.5)
+    for point in curve["control_points"]:
+        tool.add_control_point(tuple(point))
+    return tool
+
+
+def rasterize_curve(curve):
+    """Rasterize a stored curve dict into a bbox-cropped mask, returns (mask, offset, region)
+
+    mask is None when the curve has too few points to draw.
+    """
+    tool = curve_tool(curve)
+    if curve["closed"]:
+        mask, offset = tool.create_closed_mask_crop()
+        return mask, offset, tool.get_bounding_box()
+    mask, offset = tool.create_mask_crop(curve["width"])
+    return mask, offset, tool.get_bounding_box(curve["width"])
+
+
+def polygon_area(polygon):
+    """Area enclosed by a flat [x0, y0, x1, y1, ...] polygon (shoelace formula)"""
+    xs = np.asarray(polygon[0::2], dtype=np.float64)
+    ys = np.asarray(polygon[1::2], dtype=np.float64)
+    return float(abs(np.dot(xs, np.roll(ys, -1)) - np.dot(ys, np.roll(xs, -1))) / 2)
+
+
+def _encode_packed(packed):
+    if packed is None:
+        return None
+    return {"box": [int(v) for v in packed.box], "bits": base64.b64encode(packed.data).decode("ascii")}
+
+
+def _decode_packed(data):
+    if data is None:
+        return None
+    return PackedMask(tuple(data["box"]), base64.b64decode(data["bits"]))
+
+
+def encode_mask(box, crop):
+    """JSON-serializable form of a (box, bool crop) mask, as taken by AnnotationModel.add_fill"""
+    return _encode_packed(pack_snapshot((box, crop)))
+
+
+def encode_session(snapshot, packed=None):
+    """Turn an AnnotationModel.session_snapshot() into its to_session() form, packing the rasters in place
+
+    If packed is a dict it is filled with (revision, encoded mask) per
+    finger key, ready to be handed to the next session_snapshot().
+    """
+    for person_id, hands in snapshot["masks"].items():
+        for hand, fingers in hands.items():
+            for finger_name, data in fingers.items():
+                revision = data.pop("revision")
+                if isinstance(data["mask"], tuple):
+                    data["mask"] = _encode_packed(pack_snapshot(data["mask"]))
+                if packed is not None:
+                    packed[(person_id, hand, finger_name)] = (revision, data["mask"])
+    return snapshot
+
+
+def coco_header(now=None):
+    """The info, licenses and categories sections shared by every COCO file we write"""
+    now = now or datetime.now()
+    return {
+        "info": {
+            "description": "Hand segmentation dataset",
+            "url": "",
+            "version": "1.0",
+            "year": now.year,
+            "contributor": "",
+            "date_created": now.strftime("%Y-%m-%d %H:%M:%S")
+        },
+        "licenses": [
+            {
+                "id": 1,
+                "name": "Attribution-NonCommercial",
+                "url": "http://creativecommons.org/licenses/by-nc/2.0/"
+            }
+        ],
+        "categories": [
+            {"id": cat["id"], "name": cat["name"], "supercategory": "hand"}
+            for cat in FINGER_CATEGORIES + HAND_CATEGORIES
+        ]
+    }
+
+
+class AnnotationModel:
+    """Annotation state for one image, independent of any GUI toolkit
+
+    Holds the per-finger vector data (polygons and curves), the pixel masks
+    in a mask store, the hand bounding boxes and the undo/redo history.
+    Every editing method records an undoable action; undo() and redo()
+    return the action they applied so a front end can refresh what changed.
+    Edits are also passed to journal (a SessionJournal) when one is attached.
+
+    Brush strokes can be painted in one call (paint_stroke) or as they are
+    drawn (begin_stroke, extend_stroke, end_stroke); either way a stroke is
+    a single undoable action. Region fills (add_fill) keep their raster as
+    vector data, since it came from a segmentation rather than a shape.
+
+    Committed polygons, curves and hand boxes can be picked with hit_test()
+    and changed with update_shape() or delete_shape(). The hit tests use a
+    grid index over the shapes that is brought up to date lazily, one
+    finger (or hand box) at a time.
+    """
+
+    def __init__(self, mask_store="tile", undo_memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.mask_store_kind = mask_store
+        self.mask_store = None
+        self.image_path = None
+        self.image_size = None
+        self.person_list = ['1']
+        self.masks = {}
+        self.hand_bboxes = {}
+        self.action_history = UndoHistory(undo_memory_budget)
+        self.journal = None
+        self.active_stroke = None
+        self.shape_index = ShapeIndex()
+        # Owners whose index entries are out of date: (person, hand, finger), or
+        # (person, hand, None) for a hand box; None means all of them
+        self.stale_shapes = None
+        self.init_masks()
+        self.init_hand_bboxes()
+
+    def init_masks(self):
+        """Initialize the vector data for all persons, hands, and fingers"""
+        self.masks = {}
+        for person_id in self.person_list:
+            self._add_person_masks(person_id)
+
+    def _add_person_masks(self, person_id):
+        self.masks[person_id] = {}
+        for hand in HANDS:
+            self.masks[person_id][hand] = {}
+            for category in FINGER_CATEGORIES:
+                self.masks[person_id][hand][category["name"]] = {
+                    "polygons": [],
+                    "curves": [],
+                    "strokes": [],
+                    "fills": [],
+                    # [kind, index] of every shape above, in the order they were drawn
+                    "order": [],
+                    "color": category["color"]
+                }
+
+    def init_hand_bboxes(self):
+        """Initialize the hand bounding boxes for all persons"""
+        self.hand_bboxes = {}
+        for person_id in self.person_list:
+            self.hand_bboxes[person_id] = {'left': None, 'right': None}
+
+    def set_image(self, image_path, image_size):
+        """Start annotating a new image: empty masks sized to image_size and a fresh history
+
+        An attached journal belongs to the previous image and is closed.
+        """
+        if self.journal is not None:
+            self.journal.close()
+        self.image_path = image_path
+        self.image_size = tuple(image_size)
+        self.mask_store = create_mask_store(self.mask_store_kind, self.image_size, FINGER_NAMES)
+        for person_id in self.person_list:
+            self.mask_store.add_person(person_id)
+        for hands in self.masks.values():
+            for fingers in hands.values():
+                for finger in fingers.values():
+                    finger["polygons"] = []
+                    finger["curves"] = []
+                    finger["strokes"] = []
+                    finger["fills"] = []
+                    finger["order"] = []
+        self.active_stroke = None
+        self.stale_shapes = None
+        self.action_history.clear()
+
+    def add_person(self):
+        """Add a new person instance and return its id"""
+        new_id = str(int(self.person_list[-1]) + 1) if self.person_list else '1'
+        self.person_list.append(new_id)
+        self._add_person_masks(new_id)
+        if self.mask_store:
+            self.mask_store.add_person(new_id)
+        self.hand_bboxes[new_id] = {'left': None, 'right': None}
+        self._record("person")
+        return new_id
+
+    def add_polygon(self, person, hand, finger, points):
+        """Fill a closed polygon into a finger mask, returns the changed region"""
+        points = [tuple(point) for point in points]
+        if points[0] != points[-1]:
+            points.append(points[0])
+        key = (person, hand, finger)
+        xs = [point[0] for point in points]
+        ys = [point[1] for point in points]
+        region = (min(xs), min(ys), max(xs) + 1, max(ys) + 1)
+        # Keep what the polygon overwrites so undo is a single region restore
+        before = pack_snapshot(self.mask_store.snapshot_region(key, region))
+        self.mask_store.draw_polygon(key, points)
+        self._append_shape(self.masks[person][hand][finger], "polygon", [coord for point in points for coord in point])
+        self.action_history.append({
+            "type": "polygon",
+            "person": person,
+            "hand": hand,
+            "finger": finger,
+            "points": points,
+            "region": region,
+            "before": before
+        })
+        self._shapes_changed(person, hand, finger)
+        self._record("polygon", person=person, hand=hand, finger=finger, points=points)
+        return region
+
+    def add_curve(self, person, hand, finger, control_points, closed=True, width=5, tension=0.5):
+        """Rasterize a curve into a finger mask, returns the changed region or None if nothing was drawn"""
+        curve = {
+            "control_points": [list(point) for point in control_points],
+            "closed": closed,
+            "width": width,
+            "tension": tension
+        }
+        mask, offset, region = rasterize_curve(curve)
+        if mask is None:
+            return None
+        key = (person, hand, finger)
+        before = pack_snapshot(self.mask_store.snapshot_region(key, region))
+        self.mask_store.paint(key, mask, offset)
+        self._append_shape(self.masks[person][hand][finger], "curve", curve)
+        self.action_history.append({
+            "type": "curve",
+            "person": person,
+            "hand": hand,
+            "finger": finger,
+            "control_points": [tuple(point) for point in control_points],
+            "closed": closed,
+            "width": width,
+            "tension": tension,
+            "region": region,
+            "before": before
+        })
+        self._shapes_changed(person, hand, finger)
+        self._record("curve", person=person, hand=hand, finger=finger, control_points=curve["control_points"],
+                     closed=closed, width=width, tension=tension)
+        return region
+
+    def begin_stroke(self, person, hand, finger, radius, erase=False):
+        """Start a brush (or, with erase, eraser) stroke of radius pixels on a finger"""
+        if self.active_stroke is not None:
+            self.end_stroke()
+        self.active_stroke = {
+            "key": (person, hand, finger),
+            "points": [],
+            "radius": radius,
+            "erase": erase,
+            "region": None,
+            "pieces": []
+        }
+
+    def extend_stroke(self, points):
+        """Stamp the active stroke on to points, returns the changed region or None"""
+        stroke = self.active_stroke
+        points = [tuple(point) for point in points]
+        if not points:
+            return None
+        # Continue from where the previous piece ended, so the path has no gaps
+        path = stroke["points"][-1:] + points
+        stroke["points"].extend(points)
+        stamped = stroke_mask(path, stroke["radius"], self.image_size)
+        if stamped is None:
+            return None
+        box = stamped[0]
+        stroke["pieces"].append(self._stamp(stroke["key"], stamped, stroke["erase"]))
+        stroke["region"] = union_box(stroke["region"], box)
+        return box
+
+    def _stamp(self, key, stamped, erase):
+        """Paint or erase a (box, bool crop) into a finger mask, returns the (box, pixels) it overwrote"""
+        box, crop = stamped
+        _, current = self.mask_store.snapshot_region(key, box)
+        self.mask_store.restore_region(key, (box, current & ~crop if erase else current | crop))
+        return box, current
+
+    def end_stroke(self):
+        """Finish the active stroke as one undoable action, returns its region or None if it missed the image"""
+        stroke, self.active_stroke = self.active_stroke, None
+        if stroke is None or stroke["region"] is None:
+            return None
+        person, hand, finger = key = stroke["key"]
+        region = stroke["region"]
+        # Rebuild what the whole stroke covered from the pieces it overwrote, latest first
+        box, before = self.mask_store.snapshot_region(key, region)
+        for (x0, y0, x1, y1), crop in reversed(stroke["pieces"]):
+            before[y0 - box[1]:y1 - box[1], x0 - box[0]:x1 - box[0]] = crop
+        points = [list(point) for point in stroke["points"]]
+        self._append_shape(self.masks[person][hand][finger], "stroke",
+                           {"points": points, "radius": stroke["radius"], "erase": stroke["erase"]})
+        self.action_history.append({
+            "type": "stroke",
+            "person": person,
+            "hand": hand,
+            "finger": finger,
+            "points": points,
+            "radius": stroke["radius"],
+            "erase": stroke["erase"],
+            "region": region,
+            "before": pack_snapshot((box, before))
+        })
+        self._record("stroke", person=person, hand=hand, finger=finger, points=points,
+                     radius=stroke["radius"], erase=stroke["erase"])
+        return region
+
+    def paint_stroke(self, person, hand, finger, points, radius, erase=False):
+        """Paint (or erase) a whole brush stroke along points, returns the changed region or None"""
+        self.begin_stroke(person, hand, finger, radius, erase)
+        self.extend_stroke(points)
+        return self.end_stroke()
+
+    def add_fill(self, person, hand, finger, fill):
+        """Set the pixels of a filled region (an encode_mask() dict) in a finger mask, returns the changed region"""
+        box, crop = self.action_history.unpack(_decode_packed(fill))
+        key = (person, hand, finger)
+        _, before = self._stamp(key, (box, crop), erase=False)
+        self._append_shape(self.masks[person][hand][finger], "fill", fill)
+        self.action_history.append({
+            "type": "fill",
+            "person": person,
+            "hand": hand,
+            "finger": finger,
+            "fill": fill,
+            "region": box,
+            "before": pack_snapshot((box, before))
+        })
+        self._record("fill", person=person, hand=hand, finger=finger, fill=fill)
+        return box
+
+    def clear_finger(self, person, hand, finger):
+        key = (person, hand, finger)
+        entry = self.masks[person][hand][finger]
+        self.action_history.append({
+            "type": "clear",
+            "person": person,
+            "hand": hand,
+            "finger": finger,
+            "mask": pack_snapshot(self.mask_store.snapshot(key)),
+            "polygons": entry["polygons"].copy(),
+            "curves": entry["curves"].copy(),
+            "strokes": entry["strokes"].copy(),
+            "fills": entry["fills"].copy(),
+            "order": entry["order"].copy()
+        })
+        self.mask_store.clear(key)
+        entry["polygons"] = []
+        entry["curves"] = []
+        entry["strokes"] = []
+        entry["fills"] = []
+        entry["order"] = []
+        self._shapes_changed(person, hand, finger)
+        self._record("clear", person=person, hand=hand, finger=finger)
+
+    def clear_all(self):
+        saved_masks = {}
+        for person_id in self.person_list:
+            saved_masks[person_id] = {}
+            for hand in HANDS:
+                saved_masks[person_id][hand] = {}
+                for finger_name, entry in self.masks[person_id][hand].items():
+                    saved_masks[person_id][hand][finger_name] = {
+                        "mask": pack_snapshot(self.mask_store.snapshot((person_id, hand, finger_name))),
+                        "polygons": entry["polygons"].copy(),
+                        "curves": entry["curves"].copy(),
+                        "strokes": entry["strokes"].copy(),
+                        "fills": entry["fills"].copy(),
+                        "order": entry["order"].copy()
+                    }
+        self.action_history.append({
+            "type": "clear_all",
+            "masks": saved_masks
+        })
+        for person_id in self.person_list:
+            for hand in HANDS:
+                for finger_name, entry in self.masks[person_id][hand].items():
+                    self.mask_store.clear((person_id, hand, finger_name))
+                    entry["polygons"] = []
+                    entry["curves"] = []
+                    entry["strokes"] = []
+                    entry["fills"] = []
+                    entry["order"] = []
+        self.stale_shapes = None
+        self._record("clear_all")
+
+    def set_hand_bbox(self, person, hand, bbox):
+        # Save action for undo, including the box it replaces
+        self.action_history.append({
+            "type": "bbox",
+            "person": person,
+            "hand": hand,
+            "bbox": bbox,
+            "previous": self.hand_bboxes[person][hand]
+        })
+        self.hand_bboxes[person][hand] = bbox
+        self._shapes_changed(person, hand, None)
+        self._record("bbox", person=person, hand=hand, bbox=bbox)
+
+    def update_shape(self, person, hand, finger, kind, index, shape):
+        """Replace a committed polygon or curve and re-rasterize its finger, returns the changed region
+
+        kind is "polygon" or "curve" and shape is in the form that finger
+        list stores it (a flat, closed [x0, y0, ...] polygon or a curve dict).
+        The shape keeps its place in the draw order, so strokes drawn after it
+        still apply on top.
+        """
+        region = self._edit_shape(person, hand, finger, kind, index, shape)
+        self._record("edit_shape", person=person, hand=hand, finger=finger, kind=kind, index=index, shape=shape)
+        return region
+
+    def delete_shape(self, person, hand, finger, kind, index):
+        """Remove a committed polygon or curve and re-rasterize its finger, returns the changed region
+
+        The finger is replayed in draw order without the shape, so what was
+        drawn or erased after it is kept.
+        """
+        region = self._edit_shape(person, hand, finger, kind, index, None)
+        self._record("delete_shape", person=person, hand=hand, finger=finger, kind=kind, index=index)
+        return region
+
+    def _edit_shape(self, person, hand, finger, kind, index, shape):
+        key = (person, hand, finger)
+        entry = self.masks[person][hand][finger]
+        shapes = entry[SHAPE_LISTS[kind]]
+        previous = shapes[index]
+        before = self.mask_store.snapshot(key)
+        position = None
+        if shape is None:
+            del shapes[index]
+            position = _remove_from_order(entry["order"], kind, index)
+        else:
+            shapes[index] = shape
+        self.rasterize_finger(key)
+        region = union_box(None if before is None else before[0], self.mask_store.bounds(key))
+        self.action_history.append({
+            "type": "edit",
+            "person": person,
+            "hand": hand,
+            "finger": finger,
+            "kind": kind,
+            "index": index,
+            "shape": shape,
+            "previous": previous,
+            "position": position,
+            "region": region,
+            "mask": pack_snapshot(before)
+        })
+        self._shapes_changed(person, hand, finger)
+        return region
+
+    def undo(self):
+        """Undo the most recent action and return it, or None if there is nothing to undo
+
+        The cost does not depend on the history length.
+        """
+        if self.active_stroke is not None:
+            self.end_stroke()
+        if not self.action_history:
+            return None
+        action = self.action_history.pop()
+
+        if action["type"] in SHAPE_LISTS:
+            person = action["person"]
+            hand = action["hand"]
+            finger = action["finger"]
+            key = (person, hand, finger)
+            entry = self.masks[person][hand][finger]
+            shapes = entry[SHAPE_LISTS[action["type"]]]
+            if shapes:
+                shapes.pop()
+                _remove_from_order(entry["order"], action["type"], len(shapes))
+            # Swap the shape's raster for what was underneath it, keeping the raster for redo
+            action["after"] = pack_snapshot(self.mask_store.snapshot_region(key, action["region"]))
+            self.mask_store.restore_region(key, self.action_history.unpack(action["before"]))
+
+        elif action["type"] == "edit":
+            key = (action["person"], action["hand"], action["finger"])
+            entry = self.masks[action["person"]][action["hand"]][action["finger"]]
+            shapes = entry[SHAPE_LISTS[action["kind"]]]
+            if action["shape"] is None:
+                shapes.insert(action["index"], action["previous"])
+                _insert_into_order(entry["order"], action["kind"], action["index"], action["position"])
+            else:
+                shapes[action["index"]] = action["previous"]
+            action["after"] = pack_snapshot(self.mask_store.snapshot(key))
+            self.mask_store.restore(key, self.action_history.unpack(action["mask"]))
+
+        elif action["type"] == "clear":
+            person = action["person"]
+            hand = action["hand"]
+            finger = action["finger"]
+            self.mask_store.restore((person, hand, finger), self.action_history.unpack(action["mask"]))
+            self.masks[person][hand][finger]["polygons"] = action["polygons"]
+            self.masks[person][hand][finger]["curves"] = action["curves"]
+            self.masks[person][hand][finger]["strokes"] = action.get("strokes", [])
+            self.masks[person][hand][finger]["fills"] = action.get("fills", [])
+            self.masks[person][hand][finger]["order"] = action["order"]
+
+        elif action["type"] == "clear_all":
+            for person_id, hands in action["masks"].items():
+                for hand, fingers in hands.items():
+                    for finger_name, mask_data in fingers.items():
+                        self.mask_store.restore((person_id, hand, finger_name), self.action_history.unpack(mask_data["mask"]))
+                        self.masks[person_id][hand][finger_name]["polygons"] = mask_data["polygons"]
+                        self.masks[person_id][hand][finger_name]["curves"] = mask_data["curves"]
+                        self.masks[person_id][hand][finger_name]["strokes"] = mask_data.get("strokes", [])
+                        self.masks[person_id][hand][finger_name]["fills"] = mask_data.get("fills", [])
+                        self.masks[person_id][hand][finger_name]["order"] = mask_data["order"]
+
+        elif action["type"] == "bbox":
+            # Put back the box this one replaced
+            self.hand_bboxes[action["person"]][action["hand"]] = action.get("previous")
+
+        self._action_changed_shapes(action)
+        self.action_history.push_redo(action)
+        self._record("undo")
+        return action
+
+    def redo(self):
+        """Re-apply the most recently undone action and return it, or None if there is nothing to redo"""
+        if self.active_stroke is not None:
+            self.end_stroke()
+        if not self.action_history.can_redo:
+            return None
+        action = self.action_history.pop_redo()
+
+        if action["type"] in SHAPE_LISTS:
+            person = action["person"]
+            hand = action["hand"]
+            finger = action["finger"]
+            entry = self.masks[person][hand][finger]
+            if action["type"] == "polygon":
+                shape = [coord for point in action["points"] for coord in point]
+            elif action["type"] == "stroke":
+                shape = {"points": action["points"], "radius": action["radius"], "erase": action["erase"]}
+            elif action["type"] == "fill":
+                shape = action["fill"]
+            else:
+                shape = {
+                    "control_points": [list(point) for point in action["control_points"]],
+                    "closed": action["closed"],
+                    "width": action["width"],
+                    "tension": action["tension"]
+                }
+            self._append_shape(entry, action["type"], shape)
+            self.mask_store.restore_region((person, hand, finger), self.action_history.take(action, "after"))
+
+        elif action["type"] == "edit":
+            entry = self.masks[action["person"]][action["hand"]][action["finger"]]
+            shapes = entry[SHAPE_LISTS[action["kind"]]]
+            if action["shape"] is None:
+                del shapes[action["index"]]
+                _remove_from_order(entry["order"], action["kind"], action["index"])
+            else:
+                shapes[action["index"]] = action["shape"]
+            self.mask_store.restore((action["person"], action["hand"], action["finger"]),
+                                    self.action_history.take(action, "after"))
+
+        elif action["type"] == "clear":
+            person = action["person"]
+            hand = action["hand"]
+            finger = action["finger"]
+            self.mask_store.clear((person, hand, finger))
+            self.masks[person][hand][finger]["polygons"] = []
+            self.masks[person][hand][finger]["curves"] = []
+            self.masks[person][hand][finger]["strokes"] = []
+            self.masks[person][hand][finger]["fills"] = []
+            self.masks[person][hand][finger]["order"] = []
+
+        elif action["type"] == "clear_all":
+            for person_id, hands in action["masks"].items():
+                for hand, fingers in hands.items():
+                    for finger_name in fingers:
+                        self.mask_store.clear((person_id, hand, finger_name))
+                        self.masks[person_id][hand][finger_name]["polygons"] = []
+                        self.masks[person_id][hand][finger_name]["curves"] = []
+                        self.masks[person_id][hand][finger_name]["strokes"] = []
+                        self.masks[person_id][hand][finger_name]["fills"] = []
+                        self.masks[person_id][hand][finger_name]["order"] = []
+
+        elif action["type"] == "bbox":
+            self.hand_bboxes[action["person"]][action["hand"]] = action["bbox"]
+
+        self._action_changed_shapes(action)
+        self.action_history.push(action)
+        self._record("redo")
+        return action
+
+    def _record(self, op, **fields):
+        if self.journal is not None:
+            self.journal.record(op, **fields)
+
+    def rasterize(self):
+        """Rebuild every finger mask from its vector data (see rasterize_finger)"""
+        for person_id in self.person_list:
+            for hand in HANDS:
+                for finger_name in self.masks[person_id][hand]:
+                    self.rasterize_finger((person_id, hand, finger_name))
+
+    def rasterize_finger(self, key):
+        """Rebuild one finger mask by replaying its shapes in the order they were drawn
+
+        The order matters once eraser strokes are involved: a shape drawn
+        after an erase covers what the eraser removed.
+        """
+        person_id, hand, finger_name = key
+        entry = self.masks[person_id][hand][finger_name]
+        self.mask_store.clear(key)
+        for kind, index in entry["order"]:
+            shape = entry[SHAPE_LISTS[kind]][index]
+            if kind == "polygon":
+                self.mask_store.draw_polygon(key, list(zip(shape[0::2], shape[1::2])))
+            elif kind == "curve":
+                mask, offset, _ = rasterize_curve(shape)
+                if mask is not None:
+                    self.mask_store.paint(key, mask, offset)
+            elif kind == "fill":
+                self._stamp(key, self.action_history.unpack(_decode_packed(shape)), erase=False)
+            else:
+                stamped = stroke_mask(shape["points"], shape["radius"], self.image_size)
+                if stamped is not None:
+                    self._stamp(key, stamped, shape["erase"])
+
+    def _append_shape(self, entry, kind, shape):
+        """Add a shape to the end of a finger's vector data and of its draw order"""
+        shapes = entry[SHAPE_LISTS[kind]]
+        shapes.append(shape)
+        entry["order"].append([kind, len(shapes) - 1])
+
+    def _shapes_changed(self, person, hand, finger):
+        """Mark the index entries of a finger (or, with finger None, a hand box) as out of date"""
+        if self.stale_shapes is not None:
+            self.stale_shapes.add((person, hand, finger))
+
+    def _action_changed_shapes(self, action):
+        if action["type"] == "clear_all":
+            self.stale_shapes = None
+        elif "finger" in action:
+            self._shapes_changed(action["person"], action["hand"], action["finger"])
+        elif action["type"] == "bbox":
+            self._shapes_changed(action["person"], action["hand"], None)
+
+    def _index_owner(self, owner):
+        person, hand, finger = owner
+        self.shape_index.remove(owner)
+        if finger is None:
+            bbox = self.hand_bboxes.get(person, {}).get(hand)
+            if bbox:
+                box = tuple(bbox)
+                self.shape_index.add(owner, {"type": "bbox", "person": person, "hand": hand}, box, ("box", box))
+            return
+        entry = self.masks[person][hand][finger]
+        for index, polygon in enumerate(entry["polygons"]):
+            points = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+            box = (*points.min(axis=0).tolist(), *(points.max(axis=0) + 1).tolist())
+            target = {"type": "polygon", "person": person, "hand": hand, "finger": finger, "index": index}
+            self.shape_index.add(owner, target, box, ("polygon", points))
+        for index, curve in enumerate(entry["curves"]):
+            tool = curve_tool(curve)
+            if len(tool.curve_array) < (3 if curve["closed"] else 2):
+                continue
+            points = tool.curve_array.astype(np.float64)
+            target = {"type": "curve", "person": person, "hand": hand, "finger": finger, "index": index}
+            if curve["closed"]:
+                self.shape_index.add(owner, target, tool.get_bounding_box(), ("polygon", points))
+            else:
+                self.shape_index.add(owner, target, tool.get_bounding_box(curve["width"]),
+                                     ("polyline", points, curve["width"]))
+
+    def refresh_shape_index(self):
+        """Re-index the fingers and hand boxes changed since the last hit test"""
+        if self.stale_shapes is None:
+            self.shape_index.clear()
+            owners = [(person_id, hand, finger) for person_id in self.person_list for hand in HANDS
+                      for finger in FINGER_NAMES + [None]]
+        else:
+            owners = self.stale_shapes
+        for owner in owners:
+            self._index_owner(owner)
+        self.stale_shapes = set()
+
+    def hit_test(self, x, y, tolerance=0):
+        """The committed shape at original image point (x, y), or None
+
+        The result is a dict with "type" ("polygon", "curve" or "bbox"),
+        "person" and "hand", plus "finger" and "index" for polygons and
+        curves. Where shapes overlap the smallest one wins, so a finger is
+        picked before the hand box around it. tolerance (in image pixels)
+        also accepts points that close to an outline.
+        """
+        self.refresh_shape_index()
+        hits = self.shape_index.hits(x, y, tolerance)
+        return hits[0] if hits else None
+
+    def image_entry(self, image_id=1, now=None):
+        """COCO "images" entry for the annotated image"""
+        now = now or datetime.now()
+        return {
+            "id": image_id,
+            "license": 1,
+            "file_name": os.path.basename(self.image_path),
+            "height": self.image_size[1],
+            "width": self.image_size[0],
+            "date_captured": now.strftime("%Y-%m-%d %H:%M:%S")
+        }
+
+    def iter_annotations(self, segmentation="polygon", polygon_tolerance=DEFAULT_POLYGON_TOLERANCE,
+                         image_id=1, first_id=1):
+        """Yield the COCO annotations of the image, numbered from first_id
+
+        segmentation selects how finger masks are written: "polygon" outlines,
+        or "rle" for one compressed RLE per finger taken straight from the
+        mask raster, with the area counted in pixels. Fingers containing
+        curves, strokes or fills are traced from their mask and simplified to
+        polygon_tolerance pixels; a traced mask with holes (an erased
+        interior, say) is written as RLE instead, since polygons would fill
+        the holes in.
+        """
+        if segmentation not in SEGMENTATION_FORMATS:
+            raise ValueError(f"Unknown segmentation format: {segmentation}")
+        # Add annotations for each person, hand, and finger
+        annotation_id = first_id
+        for person_id in self.person_list:
+            for hand in HANDS:
+                for category in FINGER_CATEGORIES:
+                    finger_name = category["name"]
+                    category_id = category["id"]
+                    entry = self.masks[person_id][hand][finger_name]
+                    polygons = entry["polygons"]
+                    crop = None
+                    has_holes = False
+                    # Curves, strokes, fills (or a mask without vector data) are traced from the raster instead
+                    if segmentation == "polygon" and (entry["curves"] or entry["strokes"] or entry["fills"]
+                                                      or not polygons):
+                        crop = self.mask_store.get_crop((person_id, hand, finger_name))
+                        polygons, has_holes = ([], False) if crop is None else trace_mask(
+                            crop[1], crop[0], polygon_tolerance)
+                    if segmentation == "rle" or has_holes:
+                        if crop is None:
+                            crop = self.mask_store.get_crop((person_id, hand, finger_name))
+                        if crop is None:
+                            continue
+                        box, mask = crop
+                        annotation = {
+                            "id": annotation_id,
+                            "image_id": image_id,
+                            "category_id": category_id,
+                            "segmentation": encode_rle(mask, box, self.image_size),
+                            "area": float(np.count_nonzero(mask)),
+                            "bbox": [float(box[0]), float(box[1]), float(box[2] - box[0]), float(box[3] - box[1])],
+                            "iscrowd": 0,
+                            "person_id": int(person_id),
+                            "hand": hand
+                        }
+                        yield annotation
+                        annotation_id += 1
+                        continue
+                    for polygon in polygons:
+                        xs = polygon[0::2]
+                        ys = polygon[1::2]
+                        x_min = min(xs)
+                        y_min = min(ys)
+                        width = max(xs) - x_min
+                        height = max(ys) - y_min
+                        annotation = {
+                            "id": annotation_id,
+                            "image_id": image_id,
+                            "category_id": category_id,
+                            "segmentation": [polygon],
+                            "area": polygon_area(polygon),
+                            "bbox": [float(x_min), float(y_min), float(width), float(height)],
+                            "iscrowd": 0,
+                            "person_id": int(person_id),
+                            "hand": hand
+                        }
+                        yield annotation
+                        annotation_id += 1
+
+            # Add hand bounding boxes to annotations
+            for hand_type in HANDS:
+                bbox = self.hand_bboxes.get(person_id, {}).get(hand_type)
+                if bbox:
+                    # Get the category ID for this hand type
+                    hand_category_id = None
+                    for cat in HAND_CATEGORIES:
+                        if cat["name"] == f"{hand_type}_hand":
+                            hand_category_id = cat["id"]
+                            break
+
+                    if hand_category_id:
+                        x1, y1, x2, y2 = bbox
+                        width = x2 - x1
+                        height = y2 - y1
+                        area = width * height
+
+                        # Add bounding box annotation
+                        annotation = {
+                            "id": annotation_id,
+                            "image_id": image_id,
+                            "category_id": hand_category_id,
+                            "segmentation": [],  # No segmentation for bbox
+                            "area": float(area),
+                            "bbox": [float(x1), float(y1), float(width), float(height)],
+                            "iscrowd": 0,
+                            "person_id": int(person_id),
+                            "hand": hand_type
+                        }
+                        yield annotation
+                        annotation_id += 1
+
+    def build_coco(self, segmentation="polygon", polygon_tolerance=DEFAULT_POLYGON_TOLERANCE):
+        """COCO format data structure for the current image (see iter_annotations)"""
+        now = datetime.now()
+        coco_data = coco_header(now)
+        coco_data["images"] = [self.image_entry(1, now)]
+        coco_data["annotations"] = list(self.iter_annotations(segmentation, polygon_tolerance))
+        return coco_data
+
+    def export_coco(self, file_path, segmentation="polygon"):
+        with open(file_path, 'w') as f:
+            json.dump(self.build_coco(segmentation), f, indent=2)
+
+    def to_session(self):
+        """JSON-serializable snapshot of the annotations (history is not saved)
+
+        Each finger keeps its polygons, curves, brush strokes and region
+        fills, the order they were drawn in, plus its raster as a bit-packed,
+        deflated bbox crop, so a session can be re-exported without
+        rasterizing or re-rasterized from the vector data.
+        """
+        return encode_session(self.session_snapshot())
+
+    def session_snapshot(self, packed=None):
+        """to_session() with each raster left as a raw (box, bool crop) copy
+
+        Taking it only copies lists and mask crops; the costly packing is
+        left to encode_session, which can run on another thread while the
+        model keeps changing. Masks whose store revision still matches the
+        one in packed (as filled by encode_session) reuse that encoding and
+        are not copied at all.
+        """
+        masks = {}
+        for person_id in self.person_list:
+            masks[person_id] = {}
+            for hand in HANDS:
+                masks[person_id][hand] = {}
+                for finger_name, entry in self.masks[person_id][hand].items():
+                    key = (person_id, hand, finger_name)
+                    revision = self.mask_store.revision(key)
+                    cached = packed.get(key) if packed else None
+                    if cached is not None and cached[0] == revision:
+                        mask = cached[1]
+                    else:
+                        mask = self.mask_store.snapshot(key)
+                    masks[person_id][hand][finger_name] = {
+                        "polygons": list(entry["polygons"]),
+                        "curves": list(entry["curves"]),
+                        "strokes": list(entry["strokes"]),
+                        "fills": list(entry["fills"]),
+                        "order": list(entry["order"]),
+                        "mask": mask,
+                        "revision": revision
+                    }
+        return {
+            "version": SESSION_VERSION,
+            "image_path": self.image_path,
+            "image_size": list(self.image_size),
+            "person_list": list(self.person_list),
+            "hand_bboxes": {person_id: dict(hands) for person_id, hands in self.hand_bboxes.items()},
+            "masks": masks
+        }
+
+    def save_session(self, file_path):
+        with open(file_path, 'w') as f:
+            json.dump(self.to_session(), f, separators=(",", ":"))
+
+    def restore_session(self, session, rasterize=False):
+        """Replace the current annotations with a to_session() snapshot
+
+        With rasterize the masks are rebuilt from the vector data instead of
+        being decoded from the stored rasters.
+        """
+        if session.get("version") != SESSION_VERSION:
+            raise ValueError(f"Unsupported session version: {session.get('version')}")
+        self.person_list = list(session["person_list"])
+        self.init_masks()
+        self.set_image(session["image_path"], session["image_size"])
+        self.hand_bboxes = {
+            person_id: {hand: session["hand_bboxes"].get(person_id, {}).get(hand) for hand in HANDS}
+            for person_id in self.person_list
+        }
+        for person_id, hands in session["masks"].items():
+            for hand, fingers in hands.items():
+                for finger_name, data in fingers.items():
+                    entry = self.masks[person_id][hand][finger_name]
+                    entry["polygons"] = data["polygons"]
+                    entry["curves"] = data["curves"]
+                    entry["strokes"] = data.get("strokes", [])
+                    entry["fills"] = data.get("fills", [])
+                    # Sessions saved before the draw order was kept replay in the old fixed order
+                    entry["order"] = data["order"] if "order" in data else default_order(entry)
+                    if not rasterize:
+                        packed = _decode_packed(data["mask"])
+                        self.mask_store.restore((person_id, hand, finger_name), self.action_history.unpack(packed))
+        if rasterize:
+            self.rasterize()
+
+    @classmethod
+    def load_session(cls, file_path, mask_store="tile", rasterize=False):
+        with open(file_path) as f:
+            session = json.load(f)
+        model = cls(mask_store=mask_store)
+        model.restore_session(session, rasterize=rasterize)
+        return model
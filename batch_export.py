@@ -0,0 +1,114 @@
+import argparse
+import glob
+import os
+import sys
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from annotation_core import SEGMENTATION_FORMATS, SESSION_SUFFIX, AnnotationModel
+from coco_writer import CocoDatasetWriter
+from mask_store import MASK_STORES
+
+
+def export_session(session_path, output_dir, rasterize=False, save_session=False, mask_store="tile",
+                   segmentation="polygon"):
+    """Export one saved session to COCO JSON, returns the output path"""
+    model = AnnotationModel.load_session(session_path, mask_store=mask_store, rasterize=rasterize)
+    name = os.path.basename(session_path)[:-len(SESSION_SUFFIX)]
+    output_path = os.path.join(output_dir, f"{name}_annotations.json")
+    model.export_coco(output_path, segmentation)
+    if save_session:
+        model.save_session(session_path)
+    return output_path
+
+
+def collect_session(session_path, rasterize=False, save_session=False, mask_store="tile",
+                    segmentation="polygon"):
+    """Load one saved session and return its COCO (image entry, annotation list)"""
+    model = AnnotationModel.load_session(session_path, mask_store=mask_store, rasterize=rasterize)
+    if save_session:
+        model.save_session(session_path)
+    return model.image_entry(), list(model.iter_annotations(segmentation))
+
+
+def write_dataset(executor, session_paths, dataset_path, window, *options):
+    """Stream every session into one COCO dataset file, in session order
+
+    At most window sessions are in flight, so memory does not grow with the
+    number of sessions. Returns the number of sessions that failed.
+    """
+    failed = 0
+    pending = deque()
+    paths = iter(session_paths)
+    with CocoDatasetWriter(dataset_path) as writer:
+        while True:
+            while len(pending) < window:
+                path = next(paths, None)
+                if path is None:
+                    break
+                pending.append((path, executor.submit(collect_session, path, *options)))
+            if not pending:
+                break
+            path, future = pending.popleft()
+            try:
+                writer.add_image(*future.result())
+            except Exception:
+                failed += 1
+                print(f"Error in {path}:", file=sys.stderr)
+                traceback.print_exc()
+        print(f"Wrote {writer.image_count} images and {writer.annotation_count} annotations to {dataset_path}")
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Re-export or re-rasterize a directory of saved annotation sessions in parallel"
+    )
+    parser.add_argument("session_dir", help=f"directory containing *{SESSION_SUFFIX} files")
+    parser.add_argument("-o", "--output-dir", help="where to write the COCO files (default: session_dir)")
+    parser.add_argument("--dataset", metavar="PATH",
+                        help="stream all sessions into this one COCO file instead of one file per session")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="number of worker processes (default: all CPU cores)")
+    parser.add_argument("--rasterize", action="store_true",
+                        help="rebuild the masks from the stored polygons and curves before exporting")
+    parser.add_argument("--save-sessions", action="store_true",
+                        help="write the (re-rasterized) sessions back to disk")
+    parser.add_argument("--mask-store", choices=sorted(MASK_STORES), default="tile")
+    parser.add_argument("--segmentation", choices=SEGMENTATION_FORMATS, default="polygon",
+                        help="write finger masks as polygons or as compressed RLE with pixel areas")
+    args = parser.parse_args(argv)
+
+    session_paths = sorted(glob.glob(os.path.join(args.session_dir, f"*{SESSION_SUFFIX}")))
+    if not session_paths:
+        print(f"No *{SESSION_SUFFIX} files in {args.session_dir}")
+        return 1
+    output_dir = args.output_dir or args.session_dir
+    os.makedirs(output_dir, exist_ok=True)
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        if args.dataset:
+            failed = write_dataset(executor, session_paths, os.path.join(output_dir, args.dataset), 4 * args.workers,
+                                   args.rasterize, args.save_sessions, args.mask_store, args.segmentation)
+            return 1 if failed else 0
+        futures = {
+            executor.submit(export_session, path, output_dir, args.rasterize, args.save_sessions,
+                            args.mask_store, args.segmentation): path
+            for path in session_paths
+        }
+        for future in as_completed(futures):
+            try:
+                print(f"Exported {future.result()}")
+            except Exception:
+                failed += 1
+                print(f"Error in {futures[future]}:", file=sys.stderr)
+                traceback.print_exc()
+
+    print(f"{len(session_paths) - failed}/{len(session_paths)} sessions exported")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
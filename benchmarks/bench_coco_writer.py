@@ -0,0 +1,101 @@
+"""Benchmark streaming a 10k-image COCO dataset against building it in memory
+
+Run from the repository root:
+
+    python benchmarks/bench_coco_writer.py [--images 10000] [--baseline] [--memory] [--verify]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from annotation_core import FINGER_CATEGORIES, coco_header  # noqa: E402
+from coco_writer import CocoDatasetWriter  # noqa: E402
+
+
+def synthetic_images(count, fingers=12, points=60, seed=0):
+    """Yield (image entry, annotations) pairs shaped like real exports"""
+    rng = np.random.default_rng(seed)
+    angles = np.linspace(0, 2 * np.pi, points, endpoint=False)
+    for index in range(count):
+        image = {"id": 1, "license": 1, "file_name": f"image_{index:06d}.jpg",
+                 "height": 3000, "width": 4000, "date_captured": "2024-01-01 00:00:00"}
+        annotations = []
+        for finger in range(fingers):
+            cx, cy = rng.uniform(200, 3800), rng.uniform(200, 2800)
+            radius = rng.uniform(20, 150)
+            polygon = np.round(np.stack((cx + radius * np.cos(angles), cy + radius * np.sin(angles)), axis=1), 1)
+            annotations.append({
+                "id": finger + 1, "image_id": 1,
+                "category_id": FINGER_CATEGORIES[finger % len(FINGER_CATEGORIES)]["id"],
+                "segmentation": [polygon.ravel().tolist()],
+                "area": float(np.pi * radius * radius),
+                "bbox": [cx - radius, cy - radius, 2 * radius, 2 * radius],
+                "iscrowd": 0, "person_id": 1, "hand": "left" if finger < 6 else "right"
+            })
+        yield image, annotations
+
+
+def run_streaming(path, count):
+    with CocoDatasetWriter(path) as writer:
+        for image, annotations in synthetic_images(count):
+            writer.add_image(image, annotations)
+
+
+def run_in_memory(path, count):
+    """The old way: one dict for the whole dataset, dumped with indent=2"""
+    data = coco_header()
+    data["images"], data["annotations"] = [], []
+    for image, annotations in synthetic_images(count):
+        image_id = len(data["images"]) + 1
+        data["images"].append(dict(image, id=image_id))
+        for annotation in annotations:
+            data["annotations"].append(dict(annotation, id=len(data["annotations"]) + 1, image_id=image_id))
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def measure(name, function, path, count, trace_memory=False):
+    """Time one export; with trace_memory also report its peak Python heap (tracing is slow)"""
+    start = time.perf_counter()
+    function(path, count)
+    elapsed = time.perf_counter() - start
+    line = f"{name:10s} {elapsed:8.2f} s  file {os.path.getsize(path) / 2 ** 20:8.1f} MiB"
+    if trace_memory:
+        tracemalloc.start()
+        function(path, count)
+        line += f"  peak {tracemalloc.get_traced_memory()[1] / 2 ** 20:8.1f} MiB"
+        tracemalloc.stop()
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=10000)
+    parser.add_argument("--baseline", action="store_true", help="also run the in-memory indent=2 export")
+    parser.add_argument("--memory", action="store_true", help="also measure peak memory (slow)")
+    parser.add_argument("--verify", action="store_true", help="load the streamed file back and check its ids")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        streamed = os.path.join(directory, "streamed.json")
+        measure("streaming", run_streaming, streamed, args.images, args.memory)
+        if args.verify:
+            with open(streamed) as f:
+                data = json.load(f)
+            assert [image["id"] for image in data["images"]] == list(range(1, args.images + 1))
+            assert [a["id"] for a in data["annotations"]] == list(range(1, len(data["annotations"]) + 1))
+            print(f"verified {len(data['images'])} images, {len(data['annotations'])} annotations")
+        if args.baseline:
+            measure("in-memory", run_in_memory, os.path.join(directory, "in_memory.json"), args.images, args.memory)
+
+
+if __name__ == "__main__":
+    main()
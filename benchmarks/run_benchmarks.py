@@ -0,0 +1,497 @@
+"""Benchmark the interactive hot paths on synthetic images and record the results as JSON
+
+Run from the repository root:
+
+    python benchmarks/run_benchmarks.py [--sizes 2mp,12mp,50mp] [--persons 1,10] [--repeat 20]
+                                        [--output results.json] [--thresholds benchmarks/thresholds.json]
+                                        [--baseline old_results.json --tolerance 0.25]
+
+The model benchmarks drive the Tk-free AnnotationModel. The gui.* benchmarks
+drive HandSegmentationTool and need a display; without one they are
+recorded as skipped (use xvfb-run on a headless machine). Every result is
+named "<benchmark>/<size>/<persons>p". The exit status is 1 if a result is
+over its threshold or slower than the baseline by more than the tolerance.
+"""
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime
+
+import numpy as np
+import PIL
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from annotation_core import FINGER_NAMES, AnnotationModel, encode_mask  # noqa: E402
+from curve_drawing_tool import CurveDrawingTool  # noqa: E402
+from image_prefetcher import fit_size  # noqa: E402
+from superpixels import WORK_PIXELS, SuperpixelIndex  # noqa: E402
+
+# Synthetic image sizes, roughly 2, 12 and 50 megapixels at 4:3
+SIZES = {
+    "2mp": (1632, 1224),
+    "12mp": (4000, 3000),
+    "50mp": (8160, 6120),
+}
+
+# Undo latency is measured over this many consecutive undos
+UNDO_DEPTH = 500
+
+# Hit tests run against the model's shapes plus this many small polygons spread over the image
+HIT_TEST_SHAPES = 2000
+
+DEFAULT_THRESHOLDS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "thresholds.json")
+
+
+def finger_polygon(rng, cx, cy, length, width, points=16):
+    """A finger-shaped ellipse at a random angle, as a list of (x, y) points"""
+    angle = rng.uniform(0, np.pi)
+    t = np.linspace(0, 2 * np.pi, points, endpoint=False)
+    xs = length / 2 * np.cos(t)
+    ys = width / 2 * np.sin(t)
+    rotated_x = cx + xs * np.cos(angle) - ys * np.sin(angle)
+    rotated_y = cy + xs * np.sin(angle) + ys * np.cos(angle)
+    return [(int(x), int(y)) for x, y in zip(rotated_x, rotated_y)]
+
+
+def person_centres(size, persons):
+    """Spread persons over a grid covering the image"""
+    columns = int(np.ceil(np.sqrt(persons)))
+    rows = int(np.ceil(persons / columns))
+    return [
+        (int((index % columns + 0.5) * size[0] / columns), int((index // columns + 0.5) * size[1] / rows))
+        for index in range(persons)
+    ]
+
+
+def build_model(size, persons, seed=0):
+    """A model with every finger of every person annotated by a polygon, plus one curve per hand"""
+    rng = np.random.default_rng(seed)
+    model = AnnotationModel()
+    model.set_image("synthetic.jpg", size)
+    while len(model.person_list) < persons:
+        model.add_person()
+    scale = size[0] / 4000
+    length, width = 300 * scale, 70 * scale
+    for person_id, (cx, cy) in zip(model.person_list, person_centres(size, persons)):
+        for hand_index, hand in enumerate(("left", "right")):
+            hand_x = cx + (hand_index * 2 - 1) * 5 * length / 4
+            for finger_index, finger in enumerate(FINGER_NAMES):
+                x = hand_x + (finger_index - 2.5) * width
+                polygon = finger_polygon(rng, x, cy, length, width)
+                model.add_polygon(person_id, hand, finger, polygon)
+            arc = [(int(hand_x - length + step * length / 2), int(cy + length * (0.8 + 0.2 * (step % 2))))
+                   for step in range(5)]
+            model.add_curve(person_id, hand, "palm", arc, closed=False, width=5)
+    return model
+
+
+def write_image(path, size, seed=0):
+    """A smooth gradient with noise, saved as JPEG"""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (size[1] // 64 + 1, size[0] // 64 + 1, 3), dtype=np.uint8)
+    image = Image.fromarray(small).resize(size, Image.BILINEAR)
+    image.save(path, quality=90)
+
+
+def summarize(times):
+    """Timing statistics in milliseconds"""
+    times = np.asarray(times) * 1000
+    return {
+        "runs": int(len(times)),
+        "median_ms": round(float(np.median(times)), 3),
+        "p95_ms": round(float(np.percentile(times, 95)), 3),
+        "max_ms": round(float(times.max()), 3),
+    }
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def bench_add_polygon(model, rng, repeat):
+    times = []
+    person = model.person_list[0]
+    for _ in range(repeat):
+        polygon = finger_polygon(rng, model.image_size[0] / 2, model.image_size[1] / 2,
+                                 model.image_size[0] / 12, model.image_size[0] / 50)
+        times.append(timed(model.add_polygon, person, "left", "index", polygon))
+        model.undo()
+    return times
+
+
+def bench_add_curve(model, rng, repeat):
+    times = []
+    person = model.person_list[0]
+    width, height = model.image_size
+    for _ in range(repeat):
+        points = [(int(x), int(y)) for x, y in zip(rng.uniform(0.3, 0.7, 6) * width, rng.uniform(0.3, 0.7, 6) * height)]
+        times.append(timed(model.add_curve, person, "right", "middle", points, closed=True))
+        model.undo()
+    return times
+
+
+def stroke_frames(rng, width, height, count):
+    """Point batches of a wavy brush stroke across the image, one batch per display frame"""
+    x = np.linspace(0.1, 0.9, count * 4) * width
+    y = (0.5 + 0.2 * np.sin(x / width * 12)) * height + rng.normal(0, 2, len(x))
+    points = list(zip(x.astype(int).tolist(), y.astype(int).tolist()))
+    return [points[index:index + 4] for index in range(0, len(points), 4)]
+
+
+def bench_extend_stroke(model, rng, repeat):
+    """One display frame of brush painting (4 motion points, radius 1/100 of the width)"""
+    width, height = model.image_size
+    model.begin_stroke(model.person_list[0], "left", "ring", max(1, width // 100))
+    times = [timed(model.extend_stroke, points) for points in stroke_frames(rng, width, height, repeat * 4)]
+    model.end_stroke()
+    return times
+
+
+def grid_superpixels(size, cell=20):
+    """A SuperpixelIndex of square cells on the usual working resolution, with random colours"""
+    scale = min(1.0, np.sqrt(WORK_PIXELS / (size[0] * size[1])))
+    width, height = int(size[0] * scale), int(size[1] * scale)
+    columns = -(-width // cell)
+    labels = (np.arange(height)[:, None] // cell) * columns + np.arange(width)[None, :] // cell
+    colors = np.random.default_rng(0).uniform(0, 10, (int(labels.max()) + 1, 3)).astype(np.float32)
+    return SuperpixelIndex(labels.astype(np.int32), colors, size)
+
+
+def bench_add_fill(model, rng, repeat):
+    """One region-fill click: grow similar superpixels, build the mask and add it"""
+    index = grid_superpixels(model.image_size)
+    width, height = model.image_size
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        label = index.region_at(rng.uniform(0, width), rng.uniform(0, height))
+        box, crop = index.region_mask(index.similar_regions(label, 4.0))
+        model.add_fill(model.person_list[0], "right", "ring", encode_mask(box, crop))
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def bench_hit_test(model, rng, repeat):
+    """Select-mode hit tests at random points among HIT_TEST_SHAPES extra polygons, timed 10 * repeat times"""
+    width, height = model.image_size
+    for index in range(HIT_TEST_SHAPES):
+        polygon = finger_polygon(rng, rng.uniform(0, width), rng.uniform(0, height), width / 60, width / 200)
+        model.add_polygon(model.person_list[index % len(model.person_list)], "right", FINGER_NAMES[index % 6], polygon)
+    model.refresh_shape_index()
+    return [timed(model.hit_test, rng.uniform(0, width), rng.uniform(0, height), 4) for _ in range(repeat * 10)]
+
+
+def bench_update_shape(model, rng, repeat):
+    """Moving one finger polygon by a few pixels, which re-rasterizes just that finger"""
+    times = []
+    person = model.person_list[0]
+    for _ in range(repeat):
+        polygon = model.masks[person]["left"]["index"]["polygons"][0]
+        offset = int(rng.integers(-5, 6))
+        times.append(timed(model.update_shape, person, "left", "index", "polygon", 0,
+                           [coord + offset for coord in polygon]))
+    return times
+
+
+def bench_undo(model, rng, repeat):
+    """Latency of each of UNDO_DEPTH consecutive undos (repeat is ignored)"""
+    person = model.person_list[-1]
+    width, height = model.image_size
+    for index in range(UNDO_DEPTH):
+        polygon = finger_polygon(rng, rng.uniform(0.1, 0.9) * width, rng.uniform(0.1, 0.9) * height,
+                                 width / 16, width / 60)
+        model.add_polygon(person, "left", FINGER_NAMES[index % len(FINGER_NAMES)], polygon)
+    times = [timed(model.undo) for _ in range(UNDO_DEPTH)]
+    return times
+
+
+def bench_update_curve(model, rng, repeat):
+    """Full re-tessellation of a 40-point curve, timed 10 * repeat times since it is fast"""
+    width, height = model.image_size
+    tool = CurveDrawingTool()
+    for x, y in zip(rng.uniform(0, width, 40), rng.uniform(0, height, 40)):
+        tool.add_control_point((int(x), int(y)))
+    times = []
+    for _ in range(repeat * 10):
+        tool.tension = rng.uniform(0.3, 0.7)
+        times.append(timed(tool._update_curve))
+    return times
+
+
+def bench_export(segmentation):
+    def bench(model, rng, repeat):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "annotations.json")
+            return [timed(model.export_coco, path, segmentation) for _ in range(max(1, repeat // 5))]
+    return bench
+
+
+MODEL_BENCHMARKS = {
+    "model.add_polygon": bench_add_polygon,
+    "model.add_curve": bench_add_curve,
+    "model.extend_stroke": bench_extend_stroke,
+    "model.add_fill": bench_add_fill,
+    "model.hit_test": bench_hit_test,
+    "model.update_shape": bench_update_shape,
+    "model.undo": bench_undo,
+    "curve._update_curve": bench_update_curve,
+    "model.export_coco.polygon": bench_export("polygon"),
+    "model.export_coco.rle": bench_export("rle"),
+}
+
+
+def open_tool():
+    """A HandSegmentationTool on a real Tk root, or None if no display is available"""
+    import tkinter as tk
+
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        return None
+    from hand_segmentation_tool_new import HandSegmentationTool
+
+    root.geometry("1280x900")
+    tool = HandSegmentationTool(root)
+    root.update()
+    return tool
+
+
+def load_scenario(tool, image_path, model):
+    """Show image_path in the tool with model's annotations, bypassing the file dialogs"""
+    tool.open_image(image_path)
+    model.image_path = image_path
+    tool.model = model
+    tool.refresh_person_list()
+    tool.update_canvas()
+    tool.root.update()
+
+
+def bench_gui_update_canvas(tool, rng, repeat):
+    """Full redraw from the cached per-finger overlay layers"""
+    times = []
+    for _ in range(repeat):
+        tool.display_array = None
+        times.append(timed(tool.update_canvas))
+    return times
+
+
+def bench_gui_update_canvas_cold(tool, rng, repeat):
+    """Full redraw after every overlay layer was invalidated"""
+    times = []
+    for _ in range(repeat):
+        tool.invalidate_overlay_layers()
+        times.append(timed(tool.update_canvas))
+    return times
+
+
+def bench_gui_complete_polygon(tool, rng, repeat):
+    times = []
+    width, height = tool.original_size
+    for _ in range(repeat):
+        tool.current_polygon_points = finger_polygon(rng, width / 2, height / 2, width / 12, width / 50)
+        times.append(timed(tool.complete_polygon))
+        tool.undo_last_action()
+    return times
+
+
+def bench_gui_complete_curve(tool, rng, repeat):
+    times = []
+    width, height = tool.original_size
+    tool.closed_curve.set(True)
+    for _ in range(repeat):
+        for x, y in zip(rng.uniform(0.3, 0.7, 6) * width, rng.uniform(0.3, 0.7, 6) * height):
+            tool.curve_tool.add_control_point((int(x), int(y)))
+        times.append(timed(tool.complete_curve))
+        tool.undo_last_action()
+    return times
+
+
+def bench_gui_undo(tool, rng, repeat):
+    times = []
+    width, height = tool.original_size
+    for _ in range(repeat):
+        tool.current_polygon_points = finger_polygon(rng, width / 2, height / 2, width / 12, width / 50)
+        tool.complete_polygon()
+        times.append(timed(tool.undo_last_action))
+    return times
+
+
+def bench_gui_brush_frame(tool, rng, repeat):
+    """One coalesced brush frame: stamp the batched points and redraw their rectangle"""
+    width, height = tool.original_size
+    tool.model.begin_stroke(tool.person_list[0], "left", "ring", tool.brush_radius())
+    times = []
+    for points in stroke_frames(rng, width, height, repeat * 4):
+        tool.pending_stroke_points = points
+        times.append(timed(tool.flush_stroke))
+        tool.root.update()
+    tool.model.end_stroke()
+    return times
+
+
+def bench_gui_resize(tool, rng, repeat):
+    """One <Configure> of a window drag: a new size each time, so nothing is cached"""
+    times = []
+    for index in range(repeat):
+        event = types.SimpleNamespace(width=1000 + 7 * index, height=760 + 5 * index)
+        times.append(timed(tool.on_canvas_resize, event))
+        tool.root.update()
+    if tool.resize_job is not None:
+        tool.root.after_cancel(tool.resize_job)
+    tool.settle_resize()
+    wait_for_display(tool)
+    return times
+
+
+def wait_for_display(tool):
+    """Run the Tk loop until the display matches the pending canvas size"""
+    size = fit_size(tool.original_size, tool.pending_canvas_size)
+    while tool.image.size != size or tool.display_array is None:
+        tool.root.update()
+        time.sleep(0.001)
+
+
+def bench_gui_settle_resize(tool, rng, repeat):
+    """Full-quality re-render once a drag has stopped at a size that is not cached"""
+    times = []
+    for index in range(repeat):
+        tool.on_canvas_resize(types.SimpleNamespace(width=1100 - 9 * index, height=820 - 6 * index))
+        if tool.resize_job is not None:
+            tool.root.after_cancel(tool.resize_job)
+        start = time.perf_counter()
+        tool.settle_resize()
+        wait_for_display(tool)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+GUI_BENCHMARKS = {
+    "gui.update_canvas": bench_gui_update_canvas,
+    "gui.update_canvas.cold": bench_gui_update_canvas_cold,
+    "gui.complete_polygon": bench_gui_complete_polygon,
+    "gui.complete_curve": bench_gui_complete_curve,
+    "gui.undo_last_action": bench_gui_undo,
+    "gui.brush_frame": bench_gui_brush_frame,
+    "gui.on_canvas_resize": bench_gui_resize,
+    "gui.settle_resize": bench_gui_settle_resize,
+}
+
+
+def run(sizes, persons_list, repeat, gui=True):
+    results = {}
+    tool = open_tool() if gui else None
+    with tempfile.TemporaryDirectory() as directory:
+        for size_name in sizes:
+            size = SIZES[size_name]
+            image_path = os.path.join(directory, f"synthetic_{size_name}.jpg")
+            if tool is not None:
+                write_image(image_path, size)
+            for persons in persons_list:
+                suffix = f"/{size_name}/{persons}p"
+                for name, bench in MODEL_BENCHMARKS.items():
+                    # A fresh model per benchmark so earlier ones cannot change its state
+                    model = build_model(size, persons)
+                    results[name + suffix] = summarize(bench(model, np.random.default_rng(1), repeat))
+                    print(f"{name + suffix:45s} {results[name + suffix]['median_ms']:10.3f} ms", flush=True)
+                for name, bench in GUI_BENCHMARKS.items():
+                    if tool is None:
+                        results[name + suffix] = {"skipped": "no display"}
+                        continue
+                    load_scenario(tool, image_path, build_model(size, persons))
+                    results[name + suffix] = summarize(bench(tool, np.random.default_rng(1), repeat))
+                    print(f"{name + suffix:45s} {results[name + suffix]['median_ms']:10.3f} ms", flush=True)
+    if tool is not None:
+        tool.root.destroy()
+    return results
+
+
+def check_thresholds(results, thresholds):
+    """Failures against {"pattern": {"median_ms": limit, ...}}; the first matching pattern applies"""
+    failures = []
+    for name, result in results.items():
+        if "skipped" in result:
+            continue
+        for pattern, limits in thresholds.items():
+            if fnmatch.fnmatchcase(name, pattern):
+                for stat, limit in limits.items():
+                    if result[stat] > limit:
+                        failures.append(f"{name}: {stat} {result[stat]:.3f} ms > threshold {limit} ms")
+                break
+    return failures
+
+
+def check_baseline(results, baseline, tolerance):
+    """Failures where a median got slower than the baseline run by more than tolerance"""
+    failures = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if "skipped" in result or previous is None or "skipped" in previous:
+            continue
+        if result["median_ms"] > previous["median_ms"] * (1 + tolerance):
+            failures.append(f"{name}: median {result['median_ms']:.3f} ms vs baseline {previous['median_ms']:.3f} ms")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="2mp,12mp,50mp", help=f"comma-separated, from {', '.join(SIZES)}")
+    parser.add_argument("--persons", default="1,10", help="comma-separated person counts")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per benchmark")
+    parser.add_argument("--no-gui", action="store_true", help="only run the Tk-free model benchmarks")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--thresholds", default=DEFAULT_THRESHOLDS,
+                        help="JSON of per-benchmark limits (default: benchmarks/thresholds.json)")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare medians against")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown against the baseline (default: 0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes.split(",")
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        parser.error(f"unknown sizes: {', '.join(unknown)}")
+    persons_list = [int(persons) for persons in args.persons.split(",")]
+
+    results = run(sizes, persons_list, args.repeat, gui=not args.no_gui)
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "machine": {
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pillow": PIL.__version__,
+        },
+        "options": {"sizes": sizes, "persons": persons_list, "repeat": args.repeat},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+
+    failures = []
+    if args.thresholds and os.path.exists(args.thresholds):
+        with open(args.thresholds) as f:
+            failures += check_thresholds(results, json.load(f))
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures += check_baseline(results, json.load(f)["results"], args.tolerance)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+import numpy as np
+
+# Pixel offsets (dy, dx) of the disk kernel, one pair of arrays per radius
+_KERNEL_CACHE = {}
+
+
+def disk_offsets(radius):
+    """(dy, dx) int arrays of the pixels inside a disk of radius around (0, 0)"""
+    offsets = _KERNEL_CACHE.get(radius)
+    if offsets is None:
+        reach = int(np.ceil(radius))
+        dy, dx = np.mgrid[-reach:reach + 1, -reach:reach + 1]
+        inside = dx * dx + dy * dy <= radius * radius
+        offsets = _KERNEL_CACHE[radius] = (dy[inside], dx[inside])
+    return offsets
+
+
+def stamp_centers(points, radius):
+    """Integer disk centres along a polyline, at most radius / 2 apart on each segment
+
+    Every segment is sampled on its own from its first to its last point, so
+    a stroke stamped piece by piece gets the same centres as in one go.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(points) == 1:
+        return np.round(points).astype(np.int64)
+    starts = points[:-1]
+    deltas = points[1:] - starts
+    steps = np.maximum(1, np.ceil(np.hypot(deltas[:, 0], deltas[:, 1]) / max(radius / 2, 0.5))).astype(np.int64)
+    counts = steps + 1
+    segment = np.repeat(np.arange(len(starts)), counts)
+    position = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    t = (position / steps[segment])[:, None]
+    return np.unique(np.round(starts[segment] + deltas[segment] * t).astype(np.int64), axis=0)
+
+
+def stroke_mask(points, radius, size):
+    """Rasterize a brush stroke by stamping the disk kernel along points
+
+    Returns (box, bool crop) clipped to an image of size, or None if the
+    stroke misses the image. All stamps are written in one scatter.
+    """
+    centers = stamp_centers(points, radius)
+    dy, dx = disk_offsets(radius)
+    reach = int(np.ceil(radius))
+    x0, y0 = max(0, int(centers[:, 0].min()) - reach), max(0, int(centers[:, 1].min()) - reach)
+    x1 = min(size[0], int(centers[:, 0].max()) + reach + 1)
+    y1 = min(size[1], int(centers[:, 1].max()) + reach + 1)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    xs = (centers[:, 0, None] + dx).ravel() - x0
+    ys = (centers[:, 1, None] + dy).ravel() - y0
+    inside = (xs >= 0) & (xs < x1 - x0) & (ys >= 0) & (ys < y1 - y0)
+    crop = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+    crop[ys[inside], xs[inside]] = True
+    return (x0, y0, x1, y1), crop
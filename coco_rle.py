@@ -0,0 +1,73 @@
+import numpy as np
+
+# Bits per character of the compressed COCO RLE string, the top one is the continuation flag
+_CHUNK_BITS = 5
+_MAX_CHUNKS = 12  # enough for any count below 2 ** 59, keeps every shift under 64 bits
+
+
+def rle_counts(crop, box, size):
+    """Uncompressed COCO run lengths of a mask given as a bbox crop
+
+    crop is a boolean (or 0/255) array placed at box (x0, y0, x1, y1) inside an
+    image of size (width, height). Runs follow COCO's column-major order and
+    start with a (possibly empty) run of zeros. Only the crop is scanned.
+    """
+    width, height = size
+    x0, y0 = box[0], box[1]
+    crop = np.asarray(crop) > 0
+    if not crop.any():
+        return np.array([width * height], dtype=np.int64)
+
+    # Pad each column with a zero above and below so runs cannot leak between columns
+    padded = np.zeros((crop.shape[1], crop.shape[0] + 2), dtype=np.int8)
+    padded[:, 1:-1] = crop.T
+    changes = np.diff(padded, axis=1)
+    columns, rows = np.nonzero(changes == 1)
+    starts = (x0 + columns) * height + y0 + rows
+    columns, rows = np.nonzero(changes == -1)
+    ends = (x0 + columns) * height + y0 + rows
+
+    # A run that reaches the bottom of a column continues at the top of the next one
+    joined = ends[:-1] == starts[1:]
+    starts = starts[np.concatenate(([True], ~joined))]
+    ends = ends[np.concatenate((~joined, [True]))]
+
+    boundaries = np.empty(len(starts) * 2 + 2, dtype=np.int64)
+    boundaries[0] = 0
+    boundaries[1:-1:2] = starts
+    boundaries[2:-1:2] = ends
+    boundaries[-1] = width * height
+    counts = np.diff(boundaries)
+    if counts[-1] == 0:
+        counts = counts[:-1]
+    return counts
+
+
+def compress_counts(counts):
+    """Encode run lengths as a COCO compressed RLE string (pycocotools' rleToString)
+
+    Every count from the fourth on is stored as the difference to the count
+    two places before it, then written as little-endian 5-bit chunks offset by 48
+    with 0x20 marking that more chunks follow.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    values = counts.copy()
+    values[3:] -= counts[1:-2]
+
+    shifts = np.arange(_MAX_CHUNKS, dtype=np.int64) * _CHUNK_BITS
+    chunks = (values[:, None] >> shifts) & 0x1f
+    # A value needs chunk j + 1 while what is left after chunk j is not pure sign extension
+    rest = values[:, None] >> (shifts + _CHUNK_BITS)
+    more = np.where((chunks & 0x10) > 0, rest != -1, rest != 0)
+    # Chunk j is written if every earlier chunk asked for more
+    written = np.concatenate((np.ones((len(values), 1), dtype=bool), np.cumprod(more, axis=1)[:, :-1] > 0), axis=1)
+    chars = chunks + np.where(more, 0x20, 0) + 48
+    return chars[written].astype(np.uint8).tobytes().decode("ascii")
+
+
+def encode_rle(crop, box, size):
+    """pycocotools-compatible compressed RLE dict ({"size": [h, w], "counts": str}) of a bbox crop"""
+    return {
+        "size": [int(size[1]), int(size[0])],
+        "counts": compress_counts(rle_counts(crop, box, size))
+    }
@@ -0,0 +1,65 @@
+import json
+import shutil
+import tempfile
+
+from annotation_core import coco_header
+
+_ENCODER = json.JSONEncoder(separators=(",", ":"))
+
+
+class CocoDatasetWriter:
+    """Stream a multi-image COCO dataset to disk
+
+    Images are written to the output file as they are added; annotations go
+    to a temporary spool file and are copied after the "images" array on
+    close(), so memory use does not grow with the dataset. Image and
+    annotation ids are assigned here and are unique across the whole file.
+    Output is compact JSON.
+
+        with CocoDatasetWriter("dataset.json") as writer:
+            for model in models:
+                writer.add_model(model)
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.file = open(file_path, "w")
+        self.spool = tempfile.TemporaryFile("w+", prefix="hand_seg_coco_")
+        self.image_count = 0
+        self.annotation_count = 0
+        header = _ENCODER.encode(coco_header())
+        self.file.write(header[:-1] + ',"images":[')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def add_image(self, image, annotations):
+        """Append an image entry and its annotations, renumbering their ids; returns the image id"""
+        self.image_count += 1
+        image_id = self.image_count
+        if image_id > 1:
+            self.file.write(",")
+        self.file.write(_ENCODER.encode(dict(image, id=image_id)))
+        for annotation in annotations:
+            self.annotation_count += 1
+            if self.annotation_count > 1:
+                self.spool.write(",")
+            self.spool.write(_ENCODER.encode(dict(annotation, id=self.annotation_count, image_id=image_id)))
+        return image_id
+
+    def add_model(self, model, segmentation="polygon", **kwargs):
+        """Append the image and annotations of an AnnotationModel"""
+        return self.add_image(model.image_entry(), model.iter_annotations(segmentation, **kwargs))
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.write('],"annotations":[')
+        self.spool.seek(0)
+        shutil.copyfileobj(self.spool, self.file)
+        self.file.write("]}")
+        self.spool.close()
+        self.file.close()
@@ -2,35 +2,51 @@ import numpy as np
 from PIL import Image, ImageDraw
 import math
 
+# Hermite basis matrices, one (steps + 1, 4) array per step count
+_BASIS_CACHE = {}
+
 class CurveDrawingTool:
     def __init__(self):
         self.control_points = []
-        self.curve_points = []
+        # Tessellated points per Hermite segment; segment i runs from control point i to i + 1
+        self.segments = []
+        # Indices of the segments recomputed by the last edit
+        self.changed_segments = []
+        self._curve_points = None
+        self._curve_array = None
         self.tension = 0.5
         self.steps = 30
 
     def add_control_point(self, point):
         self.control_points.append(point)
-        self._update_curve()
-        return len(self.control_points) - 1
+        index = len(self.control_points) - 1
+        if index >= 1:
+            self.segments.append(None)
+        self._retessellate(index - 2, index)
+        return index
 
     def update_control_point(self, index, point):
         if 0 <= index < len(self.control_points):
             self.control_points[index] = point
-            self._update_curve()
+            self._retessellate(index - 2, index + 1)
             return True
         return False
 
     def remove_control_point(self, index):
         if 0 <= index < len(self.control_points):
             self.control_points.pop(index)
-            self._update_curve()
+            if self.segments:
+                self.segments.pop(min(index, len(self.segments) - 1))
+            self._retessellate(index - 2, index)
             return True
         return False
 
     def clear_control_points(self):
         self.control_points = []
-        self.curve_points = []
+        self.segments = []
+        self.changed_segments = []
+        self._curve_points = None
+        self._curve_array = None
 
     def set_tension(self, tension):
         self.tension = max(0.0, min(1.0, tension))
@@ -40,39 +56,82 @@ class CurveDrawingTool:
         self.steps = max(5, steps)
         self._update_curve()
 
-    def _update_curve(self):
-        self.curve_points = []
-        if len(self.control_points) < 2:
-            self.curve_points = self.control_points.copy()
+    @staticmethod
+    def _hermite_basis(steps):
+        basis = _BASIS_CACHE.get(steps)
+        if basis is None:
+            # Python floats on purpose: NumPy's vectorized power can round t**3 differently, and
+            # the points must match the original per-point evaluation exactly
+            basis = np.array([(2*t**3 - 3*t**2 + 1, -2*t**3 + 3*t**2, t**3 - 2*t**2 + t, t**3 - t**2)
+                              for t in (step / steps for step in range(steps + 1))])
+            _BASIS_CACHE[steps] = basis
+        return basis
+
+    def _evaluate_segments(self, first, last):
+        # Only the control points these segments depend on are gathered
+        lo = max(0, first - 1)
+        points = np.asarray(self.control_points[lo:last + 3], dtype=np.float64)
+        count = len(self.control_points)
+        index = np.arange(first, last + 1)
+        p0 = points[index - lo]
+        p1 = points[index + 1 - lo]
+        # Missing neighbours at both ends are mirrored through the end point
+        p_prev = np.where((index > 0)[:, None], points[np.maximum(index - 1, 0) - lo], 2 * p0 - p1)
+        p_next = np.where((index < count - 2)[:, None], points[np.minimum(index + 2, count - 1) - lo], 2 * p1 - p0)
+        t0 = (p1 - p_prev) * self.tension
+        t1 = (p_next - p0) * self.tension
+        # (segments, 1, 2) geometry against the (steps + 1, 1) basis columns; the terms are
+        # summed in a fixed order so a segment's points never depend on how many are batched
+        basis = self._hermite_basis(self.steps)[:, :, None]
+        curve = (basis[:, 0] * p0[:, None] + basis[:, 1] * p1[:, None]
+                 + basis[:, 2] * t0[:, None] + basis[:, 3] * t1[:, None])
+        return np.trunc(curve).astype(np.int64)
+
+    def _retessellate(self, first, last):
+        first = max(0, first)
+        last = min(len(self.segments) - 1, last)
+        self._curve_points = None
+        self._curve_array = None
+        if first > last:
+            self.changed_segments = []
             return
-        for i in range(len(self.control_points) - 1):
-            p0 = self.control_points[i]
-            p1 = self.control_points[i + 1]
-            if i > 0:
-                p_prev = self.control_points[i - 1]
-            else:
-                p_prev = (p0[0] - (p1[0] - p0[0]), p0[1] - (p1[1] - p0[1]))
-            if i < len(self.control_points) - 2:
-                p_next = self.control_points[i + 2]
+        for offset, segment in enumerate(self._evaluate_segments(first, last)):
+            self.segments[first + offset] = segment
+        self.changed_segments = list(range(first, last + 1))
+
+    def _update_curve(self):
+        self.segments = [None] * max(0, len(self.control_points) - 1)
+        self._retessellate(0, len(self.segments) - 1)
+
+    @property
+    def curve_array(self):
+        if self._curve_array is None:
+            if self.segments:
+                self._curve_array = np.concatenate(self.segments)
             else:
-                p_next = (p1[0] + (p1[0] - p0[0]), p1[1] + (p1[1] - p0[1]))
-            t0 = (p1[0] - p_prev[0], p1[1] - p_prev[1])
-            t1 = (p_next[0] - p0[0], p_next[1] - p0[1])
-            t0 = (t0[0] * self.tension, t0[1] * self.tension)
-            t1 = (t1[0] * self.tension, t1[1] * self.tension)
-            for step in range(self.steps + 1):
-                t = step / self.steps
-                h1 = 2*t**3 - 3*t**2 + 1
-                h2 = -2*t**3 + 3*t**2
-                h3 = t**3 - 2*t**2 + t
-                h4 = t**3 - t**2
-                x = h1 * p0[0] + h2 * p1[0] + h3 * t0[0] + h4 * t1[0]
-                y = h1 * p0[1] + h2 * p1[1] + h3 * t0[1] + h4 * t1[1]
-                self.curve_points.append((int(x), int(y)))
+                self._curve_array = np.array(self.control_points, dtype=np.int64).reshape(-1, 2)
+        return self._curve_array
+
+    @property
+    def curve_points(self):
+        if self._curve_points is None:
+            self._curve_points = list(map(tuple, self.curve_array.tolist()))
+        return self._curve_points
+
+    def get_segments(self):
+        return self.segments
 
     def get_curve_points(self):
         return self.curve_points
 
+    def get_bounding_box(self, line_width=0):
+        if not len(self.curve_array):
+            return None
+        x0, y0 = self.curve_array.min(axis=0).tolist()
+        x1, y1 = self.curve_array.max(axis=0).tolist()
+        pad = line_width // 2 + 1 if line_width else 0
+        return x0 - pad, y0 - pad, x1 + 1 + pad, y1 + 1 + pad
+
     def draw_curve_on_image(self, image, color=(255, 0, 0), width=2):
         if not self.curve_points or len(self.curve_points) < 2:
             return image
@@ -85,22 +144,38 @@ class CurveDrawingTool:
                          fill=(0, 0, 255), outline=(255, 255, 255))
         return result
 
-    def create_mask(self, image_size, line_width=5):
+    def create_mask_crop(self, line_width=5):
         if not self.curve_points or len(self.curve_points) < 2:
-            return Image.new('L', image_size, 0)
-        mask = Image.new('L', image_size, 0)
+            return None, None
+        x0, y0, x1, y1 = self.get_bounding_box(line_width)
+        mask = Image.new('L', (x1 - x0, y1 - y0), 0)
+        points = (self.curve_array - (x0, y0)).tolist()
         draw = ImageDraw.Draw(mask)
-        for i in range(len(self.curve_points) - 1):
-            draw.line([self.curve_points[i], self.curve_points[i + 1]], fill=255, width=line_width)
-        return mask
+        for i in range(len(points) - 1):
+            draw.line([tuple(points[i]), tuple(points[i + 1])], fill=255, width=line_width)
+        return mask, (x0, y0)
 
-    def create_closed_mask(self, image_size, fill=255):
+    def create_closed_mask_crop(self, fill=255):
         if len(self.curve_points) < 3:
-            return Image.new('L', image_size, 0)
-        mask = Image.new('L', image_size, 0)
-        draw = ImageDraw.Draw(mask)
-        closed_curve = self.curve_points.copy()
+            return None, None
+        x0, y0, x1, y1 = self.get_bounding_box()
+        mask = Image.new('L', (x1 - x0, y1 - y0), 0)
+        closed_curve = list(map(tuple, (self.curve_array - (x0, y0)).tolist()))
         if closed_curve[0] != closed_curve[-1]:
             closed_curve.append(closed_curve[0])
-        draw.polygon(closed_curve, fill=fill, outline=fill)
+        ImageDraw.Draw(mask).polygon(closed_curve, fill=fill, outline=fill)
+        return mask, (x0, y0)
+
+    def create_mask(self, image_size, line_width=5):
+        mask = Image.new('L', image_size, 0)
+        crop, offset = self.create_mask_crop(line_width)
+        if crop is not None:
+            mask.paste(crop, offset)
+        return mask
+
+    def create_closed_mask(self, image_size, fill=255):
+        mask = Image.new('L', image_size, 0)
+        crop, offset = self.create_closed_mask_crop(fill)
+        if crop is not None:
+            mask.paste(crop, offset)
         return mask
@@ -1,33 +1,63 @@
 import tkinter as tk
 from tkinter import filedialog, ttk, colorchooser
-from PIL import Image, ImageTk, ImageDraw
+from PIL import Image, ImageTk
 import numpy as np
 import json
+import math
 import os
-from datetime import datetime
+import time
 import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from annotation_core import (FINGER_CATEGORIES, HAND_CATEGORIES, SHAPE_LISTS, AnnotationModel, curve_tool,
+                             encode_mask, session_path_for)
 from curve_drawing_tool import CurveDrawingTool
+from image_prefetcher import (IMAGE_EXTENSIONS, ImagePrefetcher, fit_size, load_display_image, load_full_image,
+                             scale_display_image)
+from image_pyramid import ImagePyramid
+from mask_store import union_box
+from overlay_renderer import build_palette_lut, paint_layer, render_overlay
+from profiling import PROFILER, span, trace_path, traced
+from session_journal import SessionJournal, journal_path_for
+from superpixels import load_superpixels
+from undo_history import DEFAULT_MEMORY_BUDGET
 
-FINGER_CATEGORIES = [
-    {"id": 1, "name": "thumb", "color": (255, 0, 0)},
-    {"id": 2, "name": "index", "color": (0, 255, 0)},
-    {"id": 3, "name": "middle", "color": (0, 0, 255)},
-    {"id": 4, "name": "ring", "color": (255, 255, 0)},
-    {"id": 5, "name": "pinky", "color": (255, 0, 255)},
-    {"id": 6, "name": "palm", "color": (0, 255, 255)},
-]
+# Images decoded ahead of (and kept behind) the current one in project mode
+PREFETCH_AHEAD = 2
+PREFETCH_BEHIND = 1
 
+# How often pending journal records are fsynced while the tool is idle, in ms
+JOURNAL_SYNC_MS = 2000
 
-HAND_CATEGORIES = [
-    {"id": 7, "name": "left_hand", "color": (255, 128, 0)},
-    {"id": 8, "name": "right_hand", "color": (0, 128, 255)},
-]
+# Window resizes are coalesced: the display is rendered at full quality once no
+# <Configure> has arrived for this long (ms); until then the last frame is stretched
+RESIZE_SETTLE_MS = 150
+# Display sizes whose scaled image and overlay layers are kept, so going back to one is instant
+DISPLAY_CACHE_SIZE = 3
+
+# Largest zoom factor of the tiled viewport (original pixels are shown 16x)
+MAX_ZOOM = 16.0
+
+# Brush motion is painted at most once per display frame (ms); the points in between are batched
+BRUSH_FRAME_MS = 16
+# Brush radius in screen pixels, whatever the zoom
+DEFAULT_BRUSH_SIZE = 10
+
+# In select mode a click this close (screen pixels) to a shape outline or handle picks it
+SELECT_TOLERANCE = 6
+
+# RGBA lookup table for the overlay renderer, indexed by PALETTE_INDEX[category name]
+PALETTE_LUT = build_palette_lut(FINGER_CATEGORIES + HAND_CATEGORIES)
+PALETTE_INDEX = {cat["name"]: i + 1 for i, cat in enumerate(FINGER_CATEGORIES + HAND_CATEGORIES)}
 
 class HandSegmentationTool:
-    def __init__(self, root):
+    def __init__(self, root, mask_store="tile", undo_memory_budget=DEFAULT_MEMORY_BUDGET):
         self.root = root
         self.root.title("Hand and Finger Mask Segmentation Tool")
         
+        # Masks, hand boxes and undo history live in the toolkit-independent model
+        self.model = AnnotationModel(mask_store, undo_memory_budget)
+        
         self.main_frame = tk.Frame(root)
         self.main_frame.pack(fill=tk.BOTH, expand=True)
         
@@ -40,10 +70,10 @@ class HandSegmentationTool:
         self.canvas = tk.Canvas(self.canvas_frame, width=800, height=600, bg='gray')
         self.canvas.pack(fill=tk.BOTH, expand=True)
 
-        self.h_scrollbar = tk.Scrollbar(self.canvas_frame, orient=tk.HORIZONTAL, command=self.canvas.xview)
+        self.h_scrollbar = tk.Scrollbar(self.canvas_frame, orient=tk.HORIZONTAL, command=self.on_scroll_x)
         self.h_scrollbar.pack(side=tk.BOTTOM, fill=tk.X)
         
-        self.v_scrollbar = tk.Scrollbar(self.canvas_frame, orient=tk.VERTICAL, command=self.canvas.yview)
+        self.v_scrollbar = tk.Scrollbar(self.canvas_frame, orient=tk.VERTICAL, command=self.on_scroll_y)
         self.v_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
         self.canvas.config(xscrollcommand=self.h_scrollbar.set, yscrollcommand=self.v_scrollbar.set)
@@ -54,18 +84,37 @@ class HandSegmentationTool:
         self.load_btn = tk.Button(self.file_frame, text="Load Image", command=self.load_image)
         self.load_btn.pack(fill=tk.X, padx=5, pady=2)
         
+        self.open_folder_btn = tk.Button(self.file_frame, text="Open Folder", command=self.open_folder)
+        self.open_folder_btn.pack(fill=tk.X, padx=5, pady=2)
+        
+        self.nav_frame = tk.Frame(self.file_frame)
+        self.nav_frame.pack(fill=tk.X, padx=5, pady=2)
+        self.prev_btn = tk.Button(self.nav_frame, text="< Prev", command=self.previous_image)
+        self.prev_btn.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.next_btn = tk.Button(self.nav_frame, text="Next >", command=self.next_image)
+        self.next_btn.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        
         self.export_btn = tk.Button(self.file_frame, text="Export COCO JSON", command=self.export_coco)
         self.export_btn.pack(fill=tk.X, padx=5, pady=2)
+        
+        # Export finger masks as compressed RLE (true pixel areas) instead of polygons
+        self.export_rle = tk.BooleanVar()
+        self.export_rle.set(False)
+        tk.Checkbutton(self.file_frame, text="Export masks as RLE", variable=self.export_rle).pack(anchor=tk.W, padx=5, pady=2)
+        
+        self.save_session_btn = tk.Button(self.file_frame, text="Save Session", command=self.save_session)
+        self.save_session_btn.pack(fill=tk.X, padx=5, pady=2)
+        
+        self.load_session_btn = tk.Button(self.file_frame, text="Load Session", command=self.load_session)
+        self.load_session_btn.pack(fill=tk.X, padx=5, pady=2)
 
         self.person_frame = tk.LabelFrame(self.left_panel, text="Person Instances")
         self.person_frame.pack(fill=tk.X, padx=5, pady=5)
-        self.person_list = []  
         self.selected_person = tk.StringVar()
         self.selected_person.set('1')  
         self.person_listbox = tk.Listbox(self.person_frame, height=3)
         self.person_listbox.pack(fill=tk.X, padx=5, pady=2)
         self.person_listbox.insert(tk.END, 'Person 1')
-        self.person_list = ['1']
         self.person_listbox.selection_set(0)
         self.person_listbox.bind('<<ListboxSelect>>', self.on_person_select)
         self.add_person_btn = tk.Button(self.person_frame, text="Add Person", command=self.add_person)
@@ -103,6 +152,27 @@ class HandSegmentationTool:
                       value="curve").pack(anchor=tk.W, padx=5, pady=2)
         tk.Radiobutton(self.tools_frame, text="Bounding Box", variable=self.drawing_mode, 
                       value="bbox").pack(anchor=tk.W, padx=5, pady=2)
+        tk.Radiobutton(self.tools_frame, text="Brush", variable=self.drawing_mode,
+                      value="brush").pack(anchor=tk.W, padx=5, pady=2)
+        tk.Radiobutton(self.tools_frame, text="Eraser", variable=self.drawing_mode,
+                      value="eraser").pack(anchor=tk.W, padx=5, pady=2)
+        tk.Radiobutton(self.tools_frame, text="Region Fill", variable=self.drawing_mode,
+                      value="region", command=self.request_superpixels).pack(anchor=tk.W, padx=5, pady=2)
+        tk.Radiobutton(self.tools_frame, text="Select / Edit", variable=self.drawing_mode,
+                      value="select").pack(anchor=tk.W, padx=5, pady=2)
+        
+        tk.Label(self.tools_frame, text="Brush Size:").pack(anchor=tk.W, padx=5, pady=2)
+        self.brush_size = tk.IntVar()
+        self.brush_size.set(DEFAULT_BRUSH_SIZE)
+        tk.Scale(self.tools_frame, from_=1, to=60, orient=tk.HORIZONTAL,
+                 variable=self.brush_size).pack(fill=tk.X, padx=5, pady=2)
+        
+        # Region fill grows the clicked superpixel over neighbours this close in colour (0: just the one)
+        tk.Label(self.tools_frame, text="Fill Similarity:").pack(anchor=tk.W, padx=5, pady=2)
+        self.fill_tolerance = tk.IntVar()
+        self.fill_tolerance.set(0)
+        tk.Scale(self.tools_frame, from_=0, to=30, orient=tk.HORIZONTAL,
+                 variable=self.fill_tolerance).pack(fill=tk.X, padx=5, pady=2)
     
         self.curve_frame = tk.LabelFrame(self.left_panel, text="Curve Settings")
         self.curve_frame.pack(fill=tk.X, padx=5, pady=5)
@@ -121,6 +191,21 @@ class HandSegmentationTool:
                                          command=self.complete_curve)
         self.complete_curve_btn.pack(fill=tk.X, padx=5, pady=2)
 
+        self.view_frame = tk.LabelFrame(self.left_panel, text="View")
+        self.view_frame.pack(fill=tk.X, padx=5, pady=5)
+        
+        self.zoom_in_btn = tk.Button(self.view_frame, text="Zoom In", command=lambda: self.zoom_by(2.0))
+        self.zoom_in_btn.pack(fill=tk.X, padx=5, pady=2)
+        
+        self.zoom_out_btn = tk.Button(self.view_frame, text="Zoom Out", command=lambda: self.zoom_by(0.5))
+        self.zoom_out_btn.pack(fill=tk.X, padx=5, pady=2)
+        
+        self.zoom_actual_btn = tk.Button(self.view_frame, text="Actual Size (1:1)", command=lambda: self.set_zoom(1.0))
+        self.zoom_actual_btn.pack(fill=tk.X, padx=5, pady=2)
+        
+        self.zoom_fit_btn = tk.Button(self.view_frame, text="Fit to Window", command=lambda: self.set_zoom(None))
+        self.zoom_fit_btn.pack(fill=tk.X, padx=5, pady=2)
+
         self.action_frame = tk.LabelFrame(self.left_panel, text="Actions")
         self.action_frame.pack(fill=tk.X, padx=5, pady=5)
         
@@ -132,48 +217,138 @@ class HandSegmentationTool:
         
         self.undo_btn = tk.Button(self.action_frame, text="Undo Last Action", command=self.undo_last_action)
         self.undo_btn.pack(fill=tk.X, padx=5, pady=2)
+        
+        self.redo_btn = tk.Button(self.action_frame, text="Redo", command=self.redo_last_action)
+        self.redo_btn.pack(fill=tk.X, padx=5, pady=2)
 
         self.status_var = tk.StringVar()
         self.status_var.set("Ready")
         self.status_bar = tk.Label(root, textvariable=self.status_var, bd=1, relief=tk.SUNKEN, anchor=tk.W)
         self.status_bar.pack(side=tk.BOTTOM, fill=tk.X)
+        if PROFILER is not None:
+            # Profiling is on (HAND_SEG_PROFILE): show how long each event kept Tk busy
+            self.frame_time_var = tk.StringVar()
+            tk.Label(self.status_bar, textvariable=self.frame_time_var, anchor=tk.E).pack(side=tk.RIGHT)
+            PROFILER.frame_listener = self.show_frame_time
 
         self.image = None
         self.photo = None
         self.image_path = None
+        # Size of the full-resolution image; its pixels are only decoded (on a worker) when needed
+        self.original_size = None
+        self.full_image = None
+        self.full_image_future = None
+        self.full_image_callbacks = []
+        self.load_generation = 0
+        self.status_task = None
+        # Superpixel index of the current image for region fill, built on a worker once region fill is used
+        self.superpixels = None
+        self.superpixel_future = None
+        # SLIC takes seconds, so it gets its own worker instead of holding up image decodes on the shared pool
+        self.superpixel_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="superpixels")
+        
+        # Project mode: the images of an opened folder, navigated with prev/next
+        self.project_images = []
+        self.project_index = None
+        self.prefetcher = ImagePrefetcher(cache_size=PREFETCH_AHEAD + PREFETCH_BEHIND + 1)
+        self.root.after(JOURNAL_SYNC_MS, self.sync_journal)
+        
+        # Zoom factor relative to the original image, None means "fit to canvas"
+        self.zoom = None
+        self.pyramid = None
+        self.viewport_job = None
    
-        self.masks = {}  
-        self.init_masks()
+        # Display-resolution mask coverage per (person, hand, finger); a missing key means dirty.
+        # These are the layers of the current display size, one entry of display_cache
+        self.overlay_layers = {}
+        self.dirty_regions = {}
+        # Display size -> {"image": scaled image, "layers": ..., "dirty": ...}, most recently used last
+        self.display_cache = OrderedDict()
+        self.resize_job = None
+        self.pending_canvas_size = None
+        # Size of the stretched frame shown while a resize settles (None once it is rendered for real)
+        # and the composite it was stretched from
+        self.preview_size = None
+        self.preview_frame = None
+        self.display_array = None
+        self.base_array = None
+        self.base_array_image = None
         self.current_polygon_points = []
-        self.polygon_line_ids = []
-        self.action_history = []
+        self.polygon_line_id = None
    
         self.curve_tool = CurveDrawingTool()
         self.current_control_point_id = None
         self.control_point_ids = []
-        self.curve_line_ids = []
+        self.curve_line_id = None
 
         self.current_bbox_start = None
         self.current_bbox_rect_id = None
-        self.hand_bboxes = {}  # {person_id: {hand: [x1, y1, x2, y2]}}
-        self.init_hand_bboxes()
+        
+        # Brush points received since the last painted frame
+        self.pending_stroke_points = []
+        self.stroke_job = None
+        
+        # Select mode: the picked shape (a model hit_test() dict), its editable points
+        # in original image coordinates and the drag in progress
+        self.selection = None
+        self.selection_points = []
+        self.selection_drag = None
         
      
         self.canvas.bind("<ButtonPress-1>", self.start_drawing)
         self.canvas.bind("<B1-Motion>", self.draw)
         self.canvas.bind("<ButtonRelease-1>", self.stop_drawing)
+        self.canvas.bind("<Control-MouseWheel>", self.on_zoom_wheel)
+        self.canvas.bind("<Control-Button-4>", self.on_zoom_wheel)
+        self.canvas.bind("<Control-Button-5>", self.on_zoom_wheel)
+        self.canvas.bind("<ButtonPress-2>", self.start_pan)
+        self.canvas.bind("<B2-Motion>", self.pan)
        
         self.root.bind("<Control-z>", lambda event: self.undo_last_action())
+        self.root.bind("<Control-y>", lambda event: self.redo_last_action())
+        self.root.bind("<Control-Z>", lambda event: self.redo_last_action())
         self.root.bind("<Escape>", lambda event: self.cancel_current_drawing())        
         self.root.bind("<Return>", lambda event: self.complete_current_drawing())
+        self.root.bind("<Delete>", lambda event: self.delete_selection())
+        self.root.bind("<Next>", lambda event: self.next_image())
+        self.root.bind("<Prior>", lambda event: self.previous_image())
         
         self.canvas_frame.bind("<Configure>", self.on_canvas_resize)
+        if PROFILER is not None:
+            self.root.bind("<F12>", lambda event: self.export_trace())
+    
+    @property
+    def mask_store(self):
+        return self.model.mask_store
+    
+    @property
+    def masks(self):
+        return self.model.masks
+    
+    @property
+    def hand_bboxes(self):
+        return self.model.hand_bboxes
+    
+    @property
+    def person_list(self):
+        return self.model.person_list
+    
+    @property
+    def action_history(self):
+        return self.model.action_history
+    
+    def shown_size(self):
+        """Size the fit-to-canvas image is on screen at: the resize preview's while one is up"""
+        return self.preview_size if self.preview_size is not None else self.image.size
     
     def canvas_to_original_coords(self, canvas_x, canvas_y):
         """Convert canvas coordinates to original image coordinates"""
-        if hasattr(self, 'original_image') and self.image.size != self.original_image.size:
-            scale_x = self.original_image.width / self.image.width
-            scale_y = self.original_image.height / self.image.height
+        if self.zoom is not None:
+            return int(canvas_x / self.zoom), int(canvas_y / self.zoom)
+        shown = self.shown_size() if self.original_size is not None else None
+        if self.original_size is not None and shown != self.original_size:
+            scale_x = self.original_size[0] / shown[0]
+            scale_y = self.original_size[1] / shown[1]
             original_x = int(canvas_x * scale_x)
             original_y = int(canvas_y * scale_y)
             return original_x, original_y
@@ -182,98 +357,504 @@ class HandSegmentationTool:
     
     def original_to_canvas_coords(self, original_x, original_y):
         """Convert original image coordinates to canvas coordinates"""
-        if hasattr(self, 'original_image') and self.image.size != self.original_image.size:
-            scale_x = self.image.width / self.original_image.width
-            scale_y = self.image.height / self.original_image.height
+        if self.zoom is not None:
+            return int(original_x * self.zoom), int(original_y * self.zoom)
+        shown = self.shown_size() if self.original_size is not None else None
+        if self.original_size is not None and shown != self.original_size:
+            scale_x = shown[0] / self.original_size[0]
+            scale_y = shown[1] / self.original_size[1]
             canvas_x = int(original_x * scale_x)
             canvas_y = int(original_y * scale_y)
             return canvas_x, canvas_y
         else:
             return original_x, original_y
+    
+    def original_to_canvas_array(self, points):
+        """Convert a sequence of original image points to a flat [x0, y0, x1, y1, ...] canvas coordinate list"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if self.zoom is not None:
+            scale = (self.zoom, self.zoom)
+        elif self.original_size is not None and self.shown_size() != self.original_size:
+            shown = self.shown_size()
+            scale = (shown[0] / self.original_size[0], shown[1] / self.original_size[1])
+        else:
+            return points.astype(np.int64).ravel().tolist()
+        return np.trunc(points * scale).astype(np.int64).ravel().tolist()
         
-    def init_masks(self):
-        """Initialize the masks data structure for all persons, hands, and fingers"""
-        self.masks = {}
-        for person_id in self.person_list:
-            self.masks[person_id] = {}
-            for hand in ['left', 'right']:
-                self.masks[person_id][hand] = {}
-                for category in FINGER_CATEGORIES:
-           
-                    mask = None
-                    draw = None
-                    if hasattr(self, 'original_image') and self.original_image:
-                        mask = Image.new('L', self.original_image.size, 0)
-                        draw = ImageDraw.Draw(mask)
-                    
-                    self.masks[person_id][hand][category["name"]] = {
-                        "mask": mask,
-                        "draw": draw,
-                        "polygons": [],
-                        "color": category["color"]
-                    }
-    
-    def init_hand_bboxes(self):
-        """Initialize the hand bounding boxes data structure for all persons"""
-        self.hand_bboxes = {}
-        for person_id in self.person_list:
-            self.hand_bboxes[person_id] = {
-                'left': None,  # Will be [x1, y1, x2, y2] when defined
-                'right': None  # Will be [x1, y1, x2, y2] when defined
-            }
+    def mark_layer_dirty(self, person_id, hand, finger_name, region=None):
+        """Mark the cached overlay layer of one finger as stale
+
+        With region (x0, y0, x1, y1) in original image coordinates only that
+        part of the layer is resampled on the next redraw; otherwise the
+        whole layer is rebuilt.
+        """
+        key = (person_id, hand, finger_name)
+        for entry in self.display_cache.values():
+            layers, dirty = entry["layers"], entry["dirty"]
+            if region is None or key not in layers:
+                layers.pop(key, None)
+                dirty.pop(key, None)
+            else:
+                dirty[key] = union_box(dirty.get(key), tuple(region))
+    
+    def invalidate_overlay_layers(self):
+        """Drop every cached overlay layer, at every cached display size (after clear all)"""
+        for entry in self.display_cache.values():
+            entry["layers"].clear()
+            entry["dirty"].clear()
+        self.display_array = None
+    
+    def use_display_size(self, size, image=None):
+        """Switch to the scaled image and overlay layers cached for a display size
+
+        A size that is not cached yet is added with image (already scaled to
+        size) and no layers; the least recently used size beyond
+        DISPLAY_CACHE_SIZE is dropped.
+        """
+        entry = self.display_cache.get(size)
+        if entry is None:
+            entry = {"image": image, "layers": {}, "dirty": {}}
+            self.display_cache[size] = entry
+            while len(self.display_cache) > DISPLAY_CACHE_SIZE:
+                self.display_cache.popitem(last=False)
+        self.display_cache.move_to_end(size)
+        self.image = entry["image"]
+        self.overlay_layers = entry["layers"]
+        self.dirty_regions = entry["dirty"]
+        self.display_array = None
+        self.preview_size = None
+        self.preview_frame = None
+    
+    def original_to_display_box(self, box, margin=0):
+        """Map an (x0, y0, x1, y1) box in original image coordinates to a display box
+
+        The result is grown by margin display pixels and clipped to the
+        displayed image; returns None if nothing is left.
+        """
+        scale_x = self.image.width / self.original_size[0]
+        scale_y = self.image.height / self.original_size[1]
+        x0 = max(0, int(box[0] * scale_x) - margin)
+        y0 = max(0, int(box[1] * scale_y) - margin)
+        x1 = min(self.image.width, math.ceil(box[2] * scale_x) + margin)
+        y1 = min(self.image.height, math.ceil(box[3] * scale_y) + margin)
+        if x0 >= x1 or y0 >= y1:
+            return None
+        return x0, y0, x1, y1
+    
+    def resample_mask_region(self, key, display_box):
+        """Coverage of one finger mask over display_box, resampled from full resolution
+
+        The source region is padded by the LANCZOS support so the result is
+        identical to the same window of a full-frame resize.
+        """
+        if self.image.size == self.original_size:
+            return self.mask_store.get_region(key, display_box)
+        
+        width, height = self.original_size
+        scale_x = self.image.width / width
+        scale_y = self.image.height / height
+        dx0, dy0, dx1, dy1 = display_box
+        sx0, sy0 = dx0 / scale_x, dy0 / scale_y
+        sx1, sy1 = min(width, dx1 / scale_x), min(height, dy1 / scale_y)
+        support_x, support_y = 3 / scale_x + 1, 3 / scale_y + 1
+        px0, py0 = max(0, int(sx0 - support_x)), max(0, int(sy0 - support_y))
+        px1, py1 = min(width, math.ceil(sx1 + support_x)), min(height, math.ceil(sy1 + support_y))
+        source = self.mask_store.get_region(key, (px0, py0, px1, py1))
+        resized = Image.fromarray(source).resize(
+            (dx1 - dx0, dy1 - dy0), Image.LANCZOS,
+            box=(sx0 - px0, sy0 - py0, sx1 - px0, sy1 - py0)
+        )
+        return np.asarray(resized)
+    
+    def build_overlay_layer(self, key):
+        """Downscale one finger mask to display resolution
+
+        Returns (display box, uint8 coverage crop), or None if the mask is empty.
+        Only the mask's bounding box is resampled.
+        """
+        bbox = self.mask_store.getbbox(key)
+        if bbox is None:
+            return None
+        display_box = self.original_to_display_box(bbox, margin=3)
+        if display_box is None:
+            return None
+        return display_box, self.resample_mask_region(key, display_box)
+    
+    @traced
+    def refresh_dirty_layers(self):
+        """Resample only the dirty regions of cached overlay layers"""
+        for key, region in self.dirty_regions.items():
+            display_box = self.original_to_display_box(region, margin=3)
+            if display_box is None:
+                continue
+            patch = self.resample_mask_region(key, display_box)
+            layer = self.overlay_layers.get(key)
+            if layer is None:
+                if patch.any():
+                    self.overlay_layers[key] = (display_box, patch)
+                continue
+            
+            old_box, old_coverage = layer
+            box = union_box(old_box, display_box)
+            coverage = np.zeros((box[3] - box[1], box[2] - box[0]), dtype=np.uint8)
+            coverage[old_box[1] - box[1]:old_box[3] - box[1], old_box[0] - box[0]:old_box[2] - box[0]] = old_coverage
+            coverage[display_box[1] - box[1]:display_box[3] - box[1], display_box[0] - box[0]:display_box[2] - box[0]] = patch
+            self.overlay_layers[key] = (box, coverage)
+        self.dirty_regions.clear()
     
+    @traced
     def load_image(self):
         file_path = filedialog.askopenfilename(filetypes=[('Image files', '*.jpg *.jpeg *.png')])
         if file_path:
-            self.image_path = file_path
-            original_image = Image.open(file_path).convert('RGB')
-            
-   
-            canvas_width = self.canvas.winfo_width()
-            canvas_height = self.canvas.winfo_height()
-            
-     
-            if canvas_width < 50 or canvas_height < 50:
-                canvas_width = 800
-                canvas_height = 600
+            self.save_project_session()
+            self.project_images = []
+            self.project_index = None
             
-            img_width, img_height = original_image.size
-            width_ratio = canvas_width / img_width
-            height_ratio = canvas_height / img_height
-            scale_factor = min(width_ratio, height_ratio)
-  
-            if scale_factor < 1: 
-                new_width = int(img_width * scale_factor)
-                new_height = int(img_height * scale_factor)
-                self.image = original_image.resize((new_width, new_height), Image.LANCZOS)
-                self.original_image = original_image  
-       
-                self.canvas.config(scrollregion=(0, 0, new_width, new_height))
-            else:  
-                self.image = original_image
-                self.original_image = original_image
+            def opened():
+                note = self.restore_annotations(file_path)
+                self.refresh_person_list()
+                self.update_canvas()
+                self.status_var.set(f'Loaded image: {os.path.basename(file_path)}{note}')
+            self.load_and_open_image(file_path, opened)
+    
+    @traced
+    def open_image(self, file_path, loaded=None):
+        """Show an image on the canvas and drop all per-image display state
 
-                self.canvas.config(scrollregion=(0, 0, img_width, img_height))
+        loaded is an already decoded LoadedImage (from the prefetcher);
+        without it the image is decoded here.
+        """
+        self.image_path = file_path
+        self.zoom = None
+        self.pyramid = None
+        self.full_image = None
+        self.full_image_future = None
+        self.full_image_callbacks = []
+        canvas_size = self.get_canvas_size()
+        if loaded is None or loaded.canvas_size != canvas_size:
+            self.status_var.set(f"Loading {os.path.basename(file_path)}...")
+            self.root.update_idletasks()
+            loaded = load_display_image(file_path, canvas_size)
+        self.original_size = loaded.original_size
+        self.display_cache = OrderedDict()
+        self.use_display_size(loaded.display.size, loaded.display)
+        self.canvas.config(scrollregion=(0, 0, self.image.width, self.image.height))
+        self.canvas.xview_moveto(0)
+        self.canvas.yview_moveto(0)
             
-            self.photo = ImageTk.PhotoImage(self.image)
-            self.canvas.delete('all')
-            self.canvas.create_image(0, 0, anchor=tk.NW, image=self.photo, tags='image')
+        self.photo = ImageTk.PhotoImage(self.image)
+        self.canvas.delete('all')
+        self.canvas.create_image(0, 0, anchor=tk.NW, image=self.photo, tags='image')
             
-            for person_id in self.person_list:
-                for hand in ['left', 'right']:
-                    for finger_name in self.masks[person_id][hand]:
-                        self.masks[person_id][hand][finger_name]['mask'] = Image.new('L', self.original_image.size, 0)
-                        self.masks[person_id][hand][finger_name]['draw'] = ImageDraw.Draw(self.masks[person_id][hand][finger_name]['mask'])
-                        self.masks[person_id][hand][finger_name]['polygons'] = []
-            
-            self.current_polygon_points = []
-            self.polygon_line_ids = []
-            self.action_history = []
+        self.current_polygon_points = []
+        self.polygon_line_id = None
 
-            self.curve_tool.clear_control_points()
-            self.clear_curve_display()
-            
-            self.status_var.set(f'Loaded image: {os.path.basename(file_path)}')
+        self.curve_tool.clear_control_points()
+        self.clear_curve_display()
+        self.clear_selection()
+        if self.superpixel_future is not None:
+            self.superpixel_future.cancel()
+        self.superpixels = None
+        self.superpixel_future = None
+        if self.drawing_mode.get() == "region":
+            self.request_superpixels()
+    
+    def request_superpixels(self):
+        """Compute (or read from the disk cache) the superpixels of the opened image on a worker thread
+
+        Only region fill needs them, so they are requested when it is
+        selected (or first clicked), not for every image opened.
+        """
+        if self.image_path is None or self.superpixels is not None:
+            return
+        if self.superpixel_future is not None and not self.superpixel_future.done():
+            return
+        path = self.image_path
+        self.superpixel_future = self.run_in_background(
+            self.load_current_superpixels, (path,), lambda index: self.superpixels_ready(path, index), None,
+            executor=self.superpixel_executor
+        )
+    
+    def load_current_superpixels(self, path):
+        """load_superpixels on the worker, skipped (None) if another image was opened while it was queued"""
+        if path != self.image_path:
+            return None
+        return load_superpixels(path)
+    
+    def superpixels_ready(self, path, index):
+        if path != self.image_path or index is None:
+            return  # Another image was opened meanwhile
+        self.superpixels = index
+        self.superpixel_future = None
+        if self.drawing_mode.get() == "region":
+            self.status_var.set(f"Region fill ready ({len(index)} superpixels)")
+    
+    def get_canvas_size(self):
+        """Current canvas size, or the initial 800x600 before the window is mapped"""
+        canvas_width = self.canvas.winfo_width()
+        canvas_height = self.canvas.winfo_height()
+        if canvas_width < 50 or canvas_height < 50:
+            return 800, 600
+        return canvas_width, canvas_height
+    
+    def run_in_background(self, function, args, on_done, message, executor=None):
+        """Run function(*args) on the worker pool (or executor) and on_done(result) back on the Tk thread
+
+        The Tk loop keeps running meanwhile and the status bar shows message
+        with the elapsed time, until a newer task takes it over; without a
+        message the task runs silently. on_done is never called before this
+        returns.
+        """
+        future = (executor or self.prefetcher.executor).submit(function, *args)
+        started = time.perf_counter()
+        if message:
+            self.status_task = future
+            self.status_var.set(f"{message}...")
+        
+        def poll():
+            if not future.done():
+                if self.status_task is future:
+                    self.status_var.set(f"{message}... {time.perf_counter() - started:.1f} s")
+                self.root.after(30, poll)
+                return
+            if future.cancelled():
+                return
+            try:
+                result = future.result()
+            except Exception as e:
+                self.status_var.set(f"{message or 'Background task'} failed: {e}")
+                return
+            on_done(result)
+        
+        self.root.after(10, poll)
+        return future
+    
+    def load_and_open_image(self, file_path, on_opened):
+        """Show an image once its display copy is decoded, then call on_opened()
+
+        A copy already in the prefetch cache is shown at once; otherwise it
+        is decoded in the background. Only the most recent request opens.
+        """
+        self.load_generation += 1
+        generation = self.load_generation
+        
+        def opened(loaded):
+            if generation != self.load_generation:
+                return  # Superseded by a later load
+            self.open_image(file_path, loaded)
+            on_opened()
+        
+        canvas_size = self.get_canvas_size()
+        loaded = self.prefetcher.peek(file_path, canvas_size)
+        if loaded is not None:
+            self.status_task = None  # Stop older loads from reporting progress
+            opened(loaded)
+        else:
+            self.run_in_background(self.prefetcher.get, (file_path, canvas_size), opened,
+                                   f"Loading {os.path.basename(file_path)}")
+    
+    def with_full_image(self, callback):
+        """Run callback once the full-resolution image is decoded
+
+        Only zooming in needs the full-resolution pixels, so they are decoded
+        on first use; callback runs on the Tk thread.
+        """
+        if self.full_image is not None:
+            callback()
+            return
+        self.full_image_callbacks.append(callback)
+        if self.full_image_future is None or self.full_image_future.done():
+            path = self.image_path
+            self.full_image_future = self.run_in_background(
+                load_full_image, (path,), lambda image: self.full_image_loaded(path, image),
+                "Decoding full-resolution image"
+            )
+    
+    @traced
+    def full_image_loaded(self, path, image):
+        if path != self.image_path or self.full_image is not None:
+            return  # Another image was opened meanwhile
+        self.full_image = image
+        self.full_image_future = None
+        # The coarser levels are reduced on a worker, before zooming out needs them
+        self.pyramid = ImagePyramid(image)
+        self.run_in_background(self.pyramid.build_levels, (), lambda result: None, None)
+        self.status_var.set(f"Decoded {os.path.basename(self.image_path)} at full resolution")
+        callbacks, self.full_image_callbacks = self.full_image_callbacks, []
+        for callback in callbacks:
+            callback()
+    
+    @traced
+    def open_folder(self):
+        """Start project mode on every image in a folder"""
+        folder = filedialog.askdirectory()
+        if not folder:
+            return
+        
+        images = sorted(
+            os.path.join(folder, name) for name in os.listdir(folder)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not images:
+            self.status_var.set(f"No images in {folder}")
+            return
+        
+        self.save_project_session()
+        self.project_images = images
+        self.project_index = None
+        self.go_to_image(0)
+    
+    @traced
+    def next_image(self):
+        if self.project_index is not None and self.project_index + 1 < len(self.project_images):
+            self.go_to_image(self.project_index + 1)
+    
+    @traced
+    def previous_image(self):
+        if self.project_index is not None and self.project_index > 0:
+            self.go_to_image(self.project_index - 1)
+    
+    @traced
+    def go_to_image(self, index):
+        """Switch to a project image, saving the current session and resuming the next one's"""
+        self.save_project_session()
+        
+        path = self.project_images[index]
+        canvas_size = self.get_canvas_size()
+        self.project_index = index
+        
+        def opened():
+            note = self.restore_annotations(path, session_path_for(path))
+            self.refresh_person_list()
+            self.update_canvas()
+            self.status_var.set(f"Image {index + 1}/{len(self.project_images)}: {os.path.basename(path)}{note}")
+        self.load_and_open_image(path, opened)
+        
+        # Decode the images the annotator is likely to open next while they work on this one
+        upcoming = self.project_images[index + 1:index + 1 + PREFETCH_AHEAD]
+        previous = self.project_images[max(0, index - PREFETCH_BEHIND):index]
+        self.prefetcher.prefetch(upcoming + previous[::-1], canvas_size)
+    
+    def restore_annotations(self, image_path, session_path=None):
+        """Set up the model for a newly opened image and journal its edits from now on
+
+        The image's journal is replayed if there is one (unless session_path
+        was saved after it), else session_path is loaded if it exists, else
+        the annotations start empty. Returns a note for the status bar.
+        """
+        journal_path = journal_path_for(image_path)
+        has_session = session_path is not None and os.path.exists(session_path)
+        note = ""
+        if os.path.exists(journal_path) and not (
+                has_session and os.path.getmtime(session_path) > os.path.getmtime(journal_path)):
+            try:
+                SessionJournal.resume(journal_path, self.model)
+                self.model.image_path = image_path
+                return " (resumed from journal)"
+            except (OSError, ValueError, KeyError) as e:
+                # Keep the damaged journal for inspection rather than overwriting it
+                os.replace(journal_path, journal_path + ".damaged")
+                note = f" (journal could not be replayed: {e})"
+        
+        if has_session:
+            with open(session_path) as f:
+                self.model.restore_session(json.load(f))
+            self.model.image_path = image_path
+        else:
+            self.model.set_image(image_path, self.original_size)
+        return note + self.start_journal(image_path)
+    
+    def start_journal(self, image_path):
+        """Journal the model's edits next to the image, returns a status note if that is not possible"""
+        try:
+            SessionJournal.start(journal_path_for(image_path), self.model)
+        except OSError as e:
+            return f" (edits are not journaled: {e})"
+        return ""
+    
+    def sync_journal(self):
+        """Periodically fsync journal records that are still only in the OS cache"""
+        if self.model.journal is not None:
+            self.model.journal.sync()
+        self.root.after(JOURNAL_SYNC_MS, self.sync_journal)
+    
+    def save_project_session(self):
+        """In project mode, save the current image's annotations next to it before moving on"""
+        if self.project_index is None or not self.image_path:
+            return
+        session_path = session_path_for(self.image_path)
+        if self.action_history or os.path.exists(session_path):
+            self.model.save_session(session_path)
+    
+    def refresh_person_list(self):
+        """Rebuild the person list box from the model and select the first person"""
+        self.person_listbox.delete(0, tk.END)
+        for person_id in self.person_list:
+            self.person_listbox.insert(tk.END, f'Person {person_id}')
+        self.person_listbox.selection_set(0)
+        self.selected_person.set(self.person_list[0])
+    
+    @traced
+    def save_session(self):
+        """Save masks, shapes and hand boxes so the session can be resumed or batch exported"""
+        if not self.image or not self.image_path:
+            self.status_var.set("No image loaded")
+            return
+        
+        session_path = session_path_for(self.image_path)
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("Session files", "*.json")],
+            initialdir=os.path.dirname(session_path),
+            initialfile=os.path.basename(session_path)
+        )
+        if not file_path:
+            return
+        
+        self.model.save_session(file_path)
+        self.status_var.set(f"Saved session to {os.path.basename(file_path)}")
+    
+    @traced
+    def load_session(self):
+        """Load a saved session together with its image"""
+        file_path = filedialog.askopenfilename(filetypes=[("Session files", "*.json")])
+        if not file_path:
+            return
+        
+        with open(file_path) as f:
+            session = json.load(f)
+        image_path = session["image_path"]
+        if not os.path.exists(image_path):
+            # Fall back to an image stored next to the session file
+            image_path = os.path.join(os.path.dirname(file_path), os.path.basename(image_path))
+        if not os.path.exists(image_path):
+            self.status_var.set(f"Image not found: {session['image_path']}")
+            return
+        
+        self.save_project_session()
+        self.project_images = []
+        self.project_index = None
+        
+        def opened():
+            self.model.restore_session(session)
+            self.model.image_path = image_path
+            note = self.start_journal(image_path)
+            self.refresh_person_list()
+            self.update_canvas()
+            self.status_var.set(f"Loaded session: {os.path.basename(file_path)}{note}")
+        self.load_and_open_image(image_path, opened)
+    
+    def show_frame_time(self, name, milliseconds):
+        average, longest = PROFILER.frame_stats()
+        self.frame_time_var.set(
+            f"{name.rsplit('.', 1)[-1]} {milliseconds:.1f} ms | avg {average:.1f} ms, max {longest:.1f} ms"
+        )
+    
+    def export_trace(self):
+        """Write the spans recorded so far as a Chrome trace (also done on exit)"""
+        path = trace_path()
+        PROFILER.export_chrome_trace(path)
+        self.status_var.set(f"Wrote {len(PROFILER.events)} spans to {path} (open in chrome://tracing)")
     
     def get_current_finger(self):
         return self.selected_finger.get()
@@ -298,6 +879,7 @@ class HandSegmentationTool:
                 return "#{:02x}{:02x}{:02x}".format(*color_rgb)
         return "#ffffff"  
     
+    @traced
     def start_drawing(self, event):
         if not self.image:
             return
@@ -324,17 +906,8 @@ class HandSegmentationTool:
                 fill="red", outline="white", tags="polygon_point"
             )
             
-            # Draw line if we have at least 2 points
-            if len(self.current_polygon_points) > 1:
-                # Get the previous point in original coordinates
-                prev_original_x, prev_original_y = self.current_polygon_points[-2]
-                
-                # Convert back to canvas coordinates for display
-                prev_canvas_x, prev_canvas_y = self.original_to_canvas_coords(prev_original_x, prev_original_y)
-                
-                line_id = self.canvas.create_line(prev_canvas_x, prev_canvas_y, canvas_x, canvas_y, 
-                                                fill="yellow", width=2, tags="polygon_line")
-                self.polygon_line_ids.append(line_id)
+            # Extend the outline preview once we have at least 2 points
+            self.update_polygon_display()
             
             # If we have at least 3 points, check if clicked near the first point to close polygon
             if len(self.current_polygon_points) > 2:
@@ -365,7 +938,17 @@ class HandSegmentationTool:
         elif self.drawing_mode.get() == "bbox":
             # Start drawing a bounding box
             self.start_bounding_box(canvas_x, canvas_y, original_x, original_y)
+        
+        elif self.drawing_mode.get() in ("brush", "eraser"):
+            self.start_stroke(original_x, original_y)
+        
+        elif self.drawing_mode.get() == "region":
+            self.fill_region(original_x, original_y)
+        
+        elif self.drawing_mode.get() == "select":
+            self.start_selection(canvas_x, canvas_y, original_x, original_y)
     
+    @traced
     def draw(self, event):
         if not self.image:
             return
@@ -380,7 +963,12 @@ class HandSegmentationTool:
         if self.drawing_mode.get() == "bbox" and self.current_bbox_start:
             # Update the bounding box as the mouse is dragged
             self.update_bounding_box(canvas_x, canvas_y, original_x, original_y)
+        elif self.model.active_stroke is not None:
+            self.queue_stroke_point(original_x, original_y)
+        elif self.selection_drag is not None:
+            self.drag_selection(original_x, original_y)
     
+    @traced
     def stop_drawing(self, event):
         canvas_x = self.canvas.canvasx(event.x)
         canvas_y = self.canvas.canvasy(event.y)
@@ -391,7 +979,13 @@ class HandSegmentationTool:
         if self.drawing_mode.get() == "bbox" and self.current_bbox_start:
             # Complete the bounding box when mouse is released
             self.complete_bounding_box(canvas_x, canvas_y, original_x, original_y)
+        elif self.model.active_stroke is not None:
+            self.queue_stroke_point(original_x, original_y)
+            self.finish_stroke()
+        elif self.selection_drag is not None:
+            self.finish_selection_drag(original_x, original_y)
     
+    @traced
     def complete_polygon(self, event=None):
         if len(self.current_polygon_points) < 3:
             self.status_var.set("Need at least 3 points to create a polygon")
@@ -401,82 +995,284 @@ class HandSegmentationTool:
         current_person = self.get_current_person()
         current_hand = self.get_current_hand()
         
-        # Close the polygon by connecting last point to first point
-        if self.current_polygon_points[0] != self.current_polygon_points[-1]:
-            self.current_polygon_points.append(self.current_polygon_points[0])
-        
-        self.masks[current_person][current_hand][current_finger]["draw"].polygon(
-            self.current_polygon_points,
-            fill=255,
-            outline=255
-        )
-  
-        self.masks[current_person][current_hand][current_finger]["polygons"].append(
-            [coord for point in self.current_polygon_points for coord in point]
-        )
-        
-        self.action_history.append({
-            "type": "polygon",
-            "person": current_person,
-            "hand": current_hand,
-            "finger": current_finger,
-            "points": self.current_polygon_points.copy()
-        })
+        region = self.model.add_polygon(current_person, current_hand, current_finger, self.current_polygon_points)
         
         self.canvas.delete("polygon_point")
         self.canvas.delete("polygon_line")
         self.current_polygon_points = []
-        self.polygon_line_ids = []
+        self.polygon_line_id = None
         
-        self.update_canvas()
+        self.mark_layer_dirty(current_person, current_hand, current_finger, region)
+        self.update_canvas(region)
         self.status_var.set(f"Added polygon to {current_finger} ({current_hand} hand, person {current_person})")
     
+    def brush_radius(self):
+        """Brush radius in original image pixels for the brush size set in screen pixels"""
+        scale = self.zoom if self.zoom is not None else self.shown_size()[0] / self.original_size[0]
+        return max(1, round(self.brush_size.get() / scale))
+    
+    @traced
+    def start_stroke(self, original_x, original_y):
+        """Begin a brush or eraser stroke on the current finger, painting its first dab at once"""
+        self.model.begin_stroke(
+            self.get_current_person(), self.get_current_hand(), self.get_current_finger(),
+            self.brush_radius(), erase=self.drawing_mode.get() == "eraser"
+        )
+        self.pending_stroke_points = [(original_x, original_y)]
+        self.flush_stroke()
+    
+    def queue_stroke_point(self, original_x, original_y):
+        """Collect a brush motion point; the points are painted together once per display frame"""
+        self.pending_stroke_points.append((original_x, original_y))
+        if self.stroke_job is None:
+            self.stroke_job = self.root.after(BRUSH_FRAME_MS, self.flush_stroke)
+    
+    @traced
+    def flush_stroke(self):
+        """Stamp the brush points collected since the last frame and redraw just their rectangle"""
+        self.stroke_job = None
+        points, self.pending_stroke_points = self.pending_stroke_points, []
+        if self.model.active_stroke is None:
+            return  # Ended meanwhile, e.g. by an undo
+        region = self.model.extend_stroke(points)
+        if region is not None:
+            self.mark_layer_dirty(*self.model.active_stroke["key"], region)
+            self.update_canvas(region)
+    
+    @traced
+    def finish_stroke(self):
+        """Paint the last batched points and record the stroke as one undoable action"""
+        if self.stroke_job is not None:
+            self.root.after_cancel(self.stroke_job)
+        self.flush_stroke()
+        stroke = self.model.active_stroke
+        if stroke is None or self.model.end_stroke() is None:
+            return
+        person, hand, finger = stroke["key"]
+        verb = "Erased from" if stroke["erase"] else "Painted"
+        self.status_var.set(f"{verb} {finger} ({hand} hand, person {person})")
+    
+    @traced
+    def fill_region(self, original_x, original_y):
+        """Add the superpixel under the cursor, grown over similar neighbours, to the current finger
+
+        The pixels come from the precomputed index, so a click costs the
+        size of the filled region, not a flood fill over the image.
+        """
+        if self.superpixels is None:
+            self.request_superpixels()
+            self.status_var.set("Superpixels are still being computed for this image")
+            return
+        label = self.superpixels.region_at(original_x, original_y)
+        if label is None:
+            return
+        regions = self.superpixels.similar_regions(label, self.fill_tolerance.get())
+        box, crop = self.superpixels.region_mask(regions)
+        
+        current_finger = self.get_current_finger()
+        current_person = self.get_current_person()
+        current_hand = self.get_current_hand()
+        region = self.model.add_fill(current_person, current_hand, current_finger, encode_mask(box, crop))
+        self.mark_layer_dirty(current_person, current_hand, current_finger, region)
+        self.update_canvas(region)
+        self.status_var.set(f"Filled {len(regions)} superpixel(s) into {current_finger} "
+                            f"({current_hand} hand, person {current_person})")
+    
+    def select_tolerance(self):
+        """SELECT_TOLERANCE in original image pixels at the current zoom"""
+        scale = self.zoom if self.zoom is not None else self.shown_size()[0] / self.original_size[0]
+        return SELECT_TOLERANCE / scale
+    
+    def selection_geometry(self, selection):
+        """Editable points of a picked shape: polygon vertices, curve control points or box corners"""
+        if selection["type"] == "bbox":
+            x0, y0, x1, y1 = self.hand_bboxes[selection["person"]][selection["hand"]]
+            return [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+        entry = self.masks[selection["person"]][selection["hand"]][selection["finger"]]
+        if selection["type"] == "curve":
+            return [tuple(point) for point in entry["curves"][selection["index"]]["control_points"]]
+        polygon = entry["polygons"][selection["index"]]
+        points = list(zip(polygon[0::2], polygon[1::2]))
+        # Polygons are stored closed; the repeated first point is not a vertex of its own
+        return points[:-1] if len(points) > 1 and points[0] == points[-1] else points
+    
+    def selection_handle_at(self, canvas_x, canvas_y):
+        """Index of the selected shape's point under a canvas position, or None"""
+        for index, point in enumerate(self.selection_points):
+            handle_x, handle_y = self.original_to_canvas_coords(*point)
+            if abs(canvas_x - handle_x) <= SELECT_TOLERANCE and abs(canvas_y - handle_y) <= SELECT_TOLERANCE:
+                return index
+        return None
+    
+    @traced
+    def start_selection(self, canvas_x, canvas_y, original_x, original_y):
+        """Pick the shape under the cursor, or a handle of the picked one, and start dragging it
+
+        Dragging a handle moves that point (a box corner keeps the opposite
+        corner in place); dragging anywhere else on the shape moves all of it.
+        """
+        handle = self.selection_handle_at(canvas_x, canvas_y) if self.selection is not None else None
+        if handle is None:
+            self.selection = self.model.hit_test(original_x, original_y, self.select_tolerance())
+            self.selection_points = [] if self.selection is None else self.selection_geometry(self.selection)
+        self.selection_drag = None
+        if self.selection is not None:
+            self.selection_drag = {"handle": handle, "start": (original_x, original_y),
+                                   "points": list(self.selection_points)}
+        self.draw_selection()
+        self.status_var.set(self.describe_selection() if self.selection is not None else "Nothing selected")
+    
+    def describe_selection(self):
+        selection = self.selection
+        if selection["type"] == "bbox":
+            return f"Selected {selection['hand']} hand box (person {selection['person']}), Delete removes it"
+        return (f"Selected {selection['type']} of {selection['finger']} ({selection['hand']} hand, "
+                f"person {selection['person']}), Delete removes it")
+    
+    def drag_selection(self, original_x, original_y):
+        """Move the dragged point, or the whole shape, in the selection preview only"""
+        drag = self.selection_drag
+        points = drag["points"]
+        handle = drag["handle"]
+        if handle is None:
+            dx, dy = original_x - drag["start"][0], original_y - drag["start"][1]
+            self.selection_points = [(x + dx, y + dy) for x, y in points]
+        elif self.selection["type"] == "bbox":
+            fixed_x, fixed_y = points[(handle + 2) % 4]
+            x0, x1 = sorted((fixed_x, original_x))
+            y0, y1 = sorted((fixed_y, original_y))
+            self.selection_points = [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+        else:
+            self.selection_points = points[:handle] + [(original_x, original_y)] + points[handle + 1:]
+        self.draw_selection()
+    
+    @traced
+    def finish_selection_drag(self, original_x, original_y):
+        """Commit a drag of the selected shape to the model; only its finger is re-rasterized"""
+        self.drag_selection(original_x, original_y)
+        drag, self.selection_drag = self.selection_drag, None
+        if self.selection_points == drag["points"]:
+            return  # A click without a drag only selects
+        selection = self.selection
+        person, hand = selection["person"], selection["hand"]
+        if selection["type"] == "bbox":
+            (x0, y0), _, (x1, y1), _ = self.selection_points
+            self.model.set_hand_bbox(person, hand, [x0, y0, x1, y1])
+            self.redraw_hand_bboxes()
+            self.draw_selection()
+            self.status_var.set(f"Edited {hand} hand box (person {person})")
+            return
+        
+        finger = selection["finger"]
+        if selection["type"] == "polygon":
+            points = self.selection_points + self.selection_points[:1]
+            shape = [coord for point in points for coord in point]
+        else:
+            shape = dict(self.masks[person][hand][finger]["curves"][selection["index"]],
+                         control_points=[list(point) for point in self.selection_points])
+        region = self.model.update_shape(person, hand, finger, selection["type"], selection["index"], shape)
+        self.mark_layer_dirty(person, hand, finger, region)
+        self.update_canvas(region)
+        self.draw_selection()
+        self.status_var.set(f"Edited {selection['type']} of {finger} ({hand} hand, person {person})")
+    
+    @traced
+    def delete_selection(self):
+        """Delete the selected shape (Delete key); everything drawn after it stays"""
+        selection = self.selection
+        if selection is None or self.drawing_mode.get() != "select":
+            return
+        person, hand = selection["person"], selection["hand"]
+        self.clear_selection()
+        if selection["type"] == "bbox":
+            self.model.set_hand_bbox(person, hand, None)
+            self.redraw_hand_bboxes()
+            self.status_var.set(f"Deleted {hand} hand box (person {person})")
+            return
+        finger = selection["finger"]
+        region = self.model.delete_shape(person, hand, finger, selection["type"], selection["index"])
+        self.mark_layer_dirty(person, hand, finger, region)
+        self.update_canvas(region)
+        self.status_var.set(f"Deleted {selection['type']} of {finger} ({hand} hand, person {person})")
+    
+    def clear_selection(self):
+        self.selection = None
+        self.selection_points = []
+        self.selection_drag = None
+        self.canvas.delete("selection")
+    
+    def draw_selection(self):
+        """Draw the outline and point handles of the selected shape as it is being edited"""
+        self.canvas.delete("selection")
+        if self.selection is None:
+            return
+        points = self.selection_points
+        if self.selection["type"] == "curve":
+            stored = self.masks[self.selection["person"]][self.selection["hand"]][self.selection["finger"]]
+            curve = stored["curves"][self.selection["index"]]
+            outline = curve_tool(dict(curve, control_points=points)).curve_array
+            if curve["closed"] and len(outline):
+                outline = np.concatenate([outline, outline[:1]])
+        else:
+            outline = points + points[:1]
+        if len(outline) >= 2:
+            self.canvas.create_line(self.original_to_canvas_array(outline), fill="white", width=2,
+                                    dash=(4, 2), tags="selection")
+        size = SELECT_TOLERANCE // 2
+        for point in points:
+            canvas_x, canvas_y = self.original_to_canvas_coords(*point)
+            self.canvas.create_rectangle(canvas_x - size, canvas_y - size, canvas_x + size, canvas_y + size,
+                                         fill="white", outline="black", tags="selection")
+    
     def cancel_polygon(self, event=None):
         self.canvas.delete("polygon_point")
         self.canvas.delete("polygon_line")
         self.current_polygon_points = []
-        self.polygon_line_ids = []
+        self.polygon_line_id = None
         self.status_var.set("Polygon drawing canceled")
     
+    @traced
     def update_curve_tension(self, value=None):
         """Update the tension parameter of the curve tool"""
         if hasattr(self, 'curve_tool'):
             self.curve_tool.set_tension(self.curve_tension.get())
             self.update_curve_display()
     
+    def set_preview_line(self, item_id, points, tag, color):
+        """Create or move the single polyline item of an in-progress preview, returns its id"""
+        if len(points) < 2:
+            if item_id is not None:
+                self.canvas.delete(item_id)
+            return None
+        coords = self.original_to_canvas_array(points)
+        if item_id is None:
+            return self.canvas.create_line(coords, fill=color, width=2, tags=tag)
+        self.canvas.coords(item_id, coords)
+        return item_id
+    
+    def update_polygon_display(self):
+        """Update the outline of the polygon being drawn"""
+        self.polygon_line_id = self.set_preview_line(
+            self.polygon_line_id, self.current_polygon_points, "polygon_line", "yellow"
+        )
+    
     def update_curve_display(self):
         """Update the display of the curve on the canvas"""
-        for line_id in self.curve_line_ids:
-            self.canvas.delete(line_id)
-        self.curve_line_ids = []
-        
-        curve_points = self.curve_tool.get_curve_points()
-        if len(curve_points) < 2:
-            return
-
-        canvas_curve_points = []
-        for x, y in curve_points:
-            canvas_x, canvas_y = self.original_to_canvas_coords(x, y)
-            canvas_curve_points.append((canvas_x, canvas_y))
-
-        for i in range(len(canvas_curve_points) - 1):
-            line_id = self.canvas.create_line(
-                canvas_curve_points[i][0], canvas_curve_points[i][1],
-                canvas_curve_points[i+1][0], canvas_curve_points[i+1][1],
-                fill="cyan", width=2, tags="curve_line"
-            )
-            self.curve_line_ids.append(line_id)
+        self.curve_line_id = self.set_preview_line(
+            self.curve_line_id, self.curve_tool.curve_array, "curve_line", "cyan"
+        )
     
     def clear_curve_display(self):
         """Clear the curve display from the canvas"""
         self.canvas.delete("curve_point")
         self.canvas.delete("curve_line")
         self.control_point_ids = []
-        self.curve_line_ids = []
+        self.curve_line_id = None
 
+    @traced
     def complete_curve(self, event=None):
         """Complete the curve and add it to the current finger mask"""
-        if not hasattr(self, 'original_image') or not self.original_image:
+        if not self.original_size:
             self.status_var.set("Please load an image first")
             return
             
@@ -488,33 +1284,17 @@ class HandSegmentationTool:
         current_person = self.get_current_person()
         current_hand = self.get_current_hand()
   
-        if self.masks[current_person][current_hand][current_finger]["mask"] is None:
-            self.masks[current_person][current_hand][current_finger]["mask"] = Image.new('L', self.original_image.size, 0)
-            self.masks[current_person][current_hand][current_finger]["draw"] = ImageDraw.Draw(self.masks[current_person][current_hand][current_finger]["mask"])
-        
-        if self.closed_curve.get():
-            curve_mask = self.curve_tool.create_closed_mask(self.original_image.size)
-        else:
-            curve_mask = self.curve_tool.create_mask(self.original_image.size, 5)
-        
-        self.masks[current_person][current_hand][current_finger]["mask"] = Image.composite(
-            Image.new('L', self.original_image.size, 255),
-            self.masks[current_person][current_hand][current_finger]["mask"],
-            curve_mask
+        region = self.model.add_curve(
+            current_person, current_hand, current_finger, self.curve_tool.control_points,
+            closed=self.closed_curve.get(), width=5, tension=self.curve_tool.tension
         )
-        self.masks[current_person][current_hand][current_finger]["draw"] = ImageDraw.Draw(self.masks[current_person][current_hand][current_finger]["mask"])
-        self.action_history.append({
-            "type": "curve",
-            "person": current_person,
-            "hand": current_hand,
-            "finger": current_finger,
-            "control_points": self.curve_tool.control_points.copy(),
-            "closed": self.closed_curve.get(),
-            "width": 5 
-        })
+        if region is None:
+            self.status_var.set("Need at least 3 control points to create a closed curve")
+            return
         self.clear_curve_display()
         self.curve_tool.clear_control_points()
-        self.update_canvas()
+        self.mark_layer_dirty(current_person, current_hand, current_finger, region)
+        self.update_canvas(region)
         self.status_var.set(f"Added curve to {current_finger} ({current_hand} hand, person {current_person})")
     
     def cancel_curve(self, event=None):
@@ -531,6 +1311,8 @@ class HandSegmentationTool:
             self.cancel_curve()
         elif self.drawing_mode.get() == "bbox":
             self.cancel_bounding_box()
+        elif self.drawing_mode.get() == "select":
+            self.clear_selection()
     
     def complete_current_drawing(self, event=None):
         """Complete the current drawing operation based on the drawing mode"""
@@ -539,206 +1321,148 @@ class HandSegmentationTool:
         elif self.drawing_mode.get() == "curve":
             self.complete_curve()
     
+    @traced
     def clear_current_mask(self):
         current_finger = self.get_current_finger()
         current_person = self.get_current_person()
         current_hand = self.get_current_hand()
         
-        if self.image and self.masks[current_person][current_hand][current_finger]["mask"]:
-            self.action_history.append({
-                "type": "clear",
-                "person": current_person,
-                "hand": current_hand,
-                "finger": current_finger,
-                "mask": self.masks[current_person][current_hand][current_finger]["mask"].copy(),
-                "polygons": self.masks[current_person][current_hand][current_finger]["polygons"].copy()
-            })
-            
-            self.masks[current_person][current_hand][current_finger]["mask"] = Image.new("L", self.original_image.size, 0)
-            self.masks[current_person][current_hand][current_finger]["draw"] = ImageDraw.Draw(self.masks[current_person][current_hand][current_finger]["mask"])
-            self.masks[current_person][current_hand][current_finger]["polygons"] = []
-            
+        if self.image and self.mask_store:
+            self.clear_selection()
+            self.model.clear_finger(current_person, current_hand, current_finger)
+            self.mark_layer_dirty(current_person, current_hand, current_finger)
             self.update_canvas()
             self.status_var.set(f"Cleared {current_finger} mask ({current_hand} hand, person {current_person})")
     
+    @traced
     def clear_all_masks(self):
         if self.image:
-            saved_masks = {}
-            for person_id in self.person_list:
-                saved_masks[person_id] = {}
-                for hand in ['left', 'right']:
-                    saved_masks[person_id][hand] = {}
-                    for finger_name in self.masks[person_id][hand]:
-                        saved_masks[person_id][hand][finger_name] = {
-                            "mask": self.masks[person_id][hand][finger_name]["mask"].copy() if self.masks[person_id][hand][finger_name]["mask"] else None,
-                            "polygons": self.masks[person_id][hand][finger_name]["polygons"].copy()
-                        }
-            
-            self.action_history.append({
-                "type": "clear_all",
-                "masks": saved_masks
-            })
-
-            for person_id in self.person_list:
-                for hand in ['left', 'right']:
-                    for finger_name in self.masks[person_id][hand]:
-                        self.masks[person_id][hand][finger_name]["mask"] = Image.new("L", self.original_image.size, 0)
-                        self.masks[person_id][hand][finger_name]["draw"] = ImageDraw.Draw(self.masks[person_id][hand][finger_name]["mask"])
-                        self.masks[person_id][hand][finger_name]["polygons"] = []
-            
+            self.clear_selection()
+            self.model.clear_all()
+            self.invalidate_overlay_layers()
             self.update_canvas()
             self.status_var.set("Cleared all masks")
     
+    @traced
     def undo_last_action(self):
-        if not self.action_history:
+        """Undo the most recent action; its cost does not depend on the history length"""
+        self.clear_selection()
+        action = self.model.undo()
+        if action is None:
             self.status_var.set("Nothing to undo")
             return
         
-        action = self.action_history.pop()
-        
-        if action["type"] == "polygon":
-            person = action["person"]
-            hand = action["hand"]
-            finger = action["finger"]
-
-            if self.masks[person][hand][finger]["polygons"]:
-                self.masks[person][hand][finger]["polygons"].pop()
+        self.update_canvas(self.mark_action_dirty(action))
+        self.status_var.set("Undid last action")
     
-            self.masks[person][hand][finger]["mask"] = Image.new("L", self.original_image.size, 0)
-            self.masks[person][hand][finger]["draw"] = ImageDraw.Draw(self.masks[person][hand][finger]["mask"])
-   
-            for hist_action in self.action_history:
-                if (hist_action["type"] == "polygon" and hist_action["finger"] == finger 
-                        and hist_action["person"] == person and hist_action["hand"] == hand):
-                    self.masks[person][hand][finger]["draw"].polygon(
-                        hist_action["points"],
-                        fill=255,
-                        outline=255
-                    )
-                elif (hist_action["type"] == "curve" and hist_action["finger"] == finger 
-                        and hist_action["person"] == person and hist_action["hand"] == hand):
-                    temp_curve_tool = CurveDrawingTool()
-                    for point in hist_action["control_points"]:
-                        temp_curve_tool.add_control_point(point)
-  
-                    if hist_action["closed"]:
-                        curve_mask = temp_curve_tool.create_closed_mask(self.original_image.size)
-                    else:
-                        curve_mask = temp_curve_tool.create_mask(self.original_image.size, hist_action["width"])
-   
-                    self.masks[person][hand][finger]["mask"] = Image.composite(
-                        Image.new('L', self.original_image.size, 255),
-                        self.masks[person][hand][finger]["mask"],
-                        curve_mask
-                    )
-                    self.masks[person][hand][finger]["draw"] = ImageDraw.Draw(self.masks[person][hand][finger]["mask"])
-        
-        elif action["type"] == "curve":
-            person = action["person"]
-            hand = action["hand"]
-            finger = action["finger"]
-            # Redraw mask without this curve
-            self.masks[person][hand][finger]["mask"] = Image.new("L", self.original_image.size, 0)
-            self.masks[person][hand][finger]["draw"] = ImageDraw.Draw(self.masks[person][hand][finger]["mask"])
-            
-            # Redraw all remaining actions for this finger
-            for hist_action in self.action_history:
-                if (hist_action["type"] == "polygon" and hist_action["finger"] == finger 
-                        and hist_action["person"] == person and hist_action["hand"] == hand):
-                    self.masks[person][hand][finger]["draw"].polygon(
-                        hist_action["points"],
-                        fill=255,
-                        outline=255
-                    )
-                elif (hist_action["type"] == "curve" and hist_action["finger"] == finger 
-                        and hist_action["person"] == person and hist_action["hand"] == hand):
-                    # Recreate the curve tool temporarily
-                    temp_curve_tool = CurveDrawingTool()
-                    for point in hist_action["control_points"]:
-                        temp_curve_tool.add_control_point(point)
-                    
-                    # Create mask from curve
-                    if hist_action["closed"]:
-                        curve_mask = temp_curve_tool.create_closed_mask(self.original_image.size)
-                    else:
-                        curve_mask = temp_curve_tool.create_mask(self.original_image.size, hist_action["width"])
-                    
-                    # Composite the curve mask onto the finger mask
-                    self.masks[person][hand][finger]["mask"] = Image.composite(
-                        Image.new('L', self.original_image.size, 255),
-                        self.masks[person][hand][finger]["mask"],
-                        curve_mask
-                    )
-                    self.masks[person][hand][finger]["draw"] = ImageDraw.Draw(self.masks[person][hand][finger]["mask"])
-        
-        elif action["type"] == "clear":
-            person = action["person"]
-            hand = action["hand"]
-            finger = action["finger"]
-            self.masks[person][hand][finger]["mask"] = action["mask"]
-            self.masks[person][hand][finger]["draw"] = ImageDraw.Draw(self.masks[person][hand][finger]["mask"])
-            self.masks[person][hand][finger]["polygons"] = action["polygons"]
+    @traced
+    def redo_last_action(self):
+        """Re-apply the most recently undone action"""
+        self.clear_selection()
+        action = self.model.redo()
+        if action is None:
+            self.status_var.set("Nothing to redo")
+            return
         
+        self.update_canvas(self.mark_action_dirty(action))
+        self.status_var.set("Redid last action")
+    
+    def mark_action_dirty(self, action):
+        """Mark the overlay layers an undone or redone action touched, returns its region if it has one"""
+        if action["type"] in SHAPE_LISTS or action["type"] == "edit":
+            self.mark_layer_dirty(action["person"], action["hand"], action["finger"], action["region"])
+            return action["region"]
+        if action["type"] == "clear":
+            self.mark_layer_dirty(action["person"], action["hand"], action["finger"])
         elif action["type"] == "clear_all":
-            for person_id, hands in action["masks"].items():
-                for hand, fingers in hands.items():
-                    for finger_name, mask_data in fingers.items():
-                        self.masks[person_id][hand][finger_name]["mask"] = mask_data["mask"]
-                        self.masks[person_id][hand][finger_name]["draw"] = ImageDraw.Draw(self.masks[person_id][hand][finger_name]["mask"])
-                        self.masks[person_id][hand][finger_name]["polygons"] = mask_data["polygons"]
-        
-        elif action["type"] == "bbox":
-            person = action["person"]
-            hand = action["hand"]
-            # Remove bounding box
-            self.hand_bboxes[person][hand] = None
-        
-        self.update_canvas()
-        self.status_var.set("Undid last action")
+            self.invalidate_overlay_layers()
+        return None
     
-    def update_canvas(self):
+    @traced
+    def update_canvas(self, region=None):
+        """Redraw the annotated image
+
+        With region (x0, y0, x1, y1) in original image coordinates only that
+        rectangle of the display is recomposited and copied into the existing
+        PhotoImage; otherwise the whole frame is rebuilt.
+        """
         if not self.image:
             return
         
-        composite = self.image.copy().convert("RGBA")
-        
-        overlay = Image.new("RGBA", self.image.size, (0, 0, 0, 0))
+        if self.zoom is not None:
+            self.render_viewport()
+            self.redraw_hand_bboxes()
+            return
+        if self.preview_size is not None:
+            # A resize preview is on screen; settle_resize composites the edits at the new size
+            self.redraw_hand_bboxes()
+            return
         
-        # Add each finger mask with its color for all persons and hands
-        for person_id in self.person_list:
-            for hand in ['left', 'right']:
-                for finger_name, finger_data in self.masks[person_id][hand].items():
-                    # Use get() with None default to avoid KeyError
-                    if finger_data.get("mask") is not None:
-                        # Get color for this finger
-                        r, g, b = finger_data["color"]
-                        
-                        # Create colored mask
-                        colored_mask = Image.new("RGBA", self.original_image.size, (r, g, b, 128))
-                        
-                        # Apply mask
-                        masked_overlay = Image.composite(
-                            colored_mask, 
-                            Image.new("RGBA", self.original_image.size, (0, 0, 0, 0)),
-                            finger_data["mask"]
-                        )
-                        
-                        # Resize the masked overlay if the displayed image is scaled
-                        if hasattr(self, 'original_image') and self.image.size != self.original_image.size:
-                            masked_overlay = masked_overlay.resize(self.image.size, Image.LANCZOS)
+        if self.base_array_image is not self.image:
+            self.base_array = np.asarray(self.image.convert("RGB"))
+            self.base_array_image = self.image
+            self.display_array = None
+        self.refresh_dirty_layers()
+        
+        display_box = None
+        if region is not None and self.display_array is not None and self.photo is not None:
+            display_box = self.original_to_display_box(region, margin=3)
+            if display_box is None:
+                self.redraw_hand_bboxes()
+                return
+        if display_box is None:
+            display_box = (0, 0, self.image.width, self.image.height)
+            region = None
+        
+        x0, y0, x1, y1 = display_box
+        index = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        coverage = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        overlay_box = None
+        
+        with span("update_canvas.layers"):
+            # Add each finger layer for all persons and hands, rebuilding only dirty ones
+            for person_id in self.person_list:
+                for hand in ['left', 'right']:
+                    for finger_name in self.masks[person_id][hand]:
+                        key = (person_id, hand, finger_name)
+                        if key not in self.overlay_layers:
+                            self.overlay_layers[key] = self.build_overlay_layer(key)
                         
-                        # Composite onto overlay
-                        overlay = Image.alpha_composite(overlay, masked_overlay)
-        
-        # Composite overlay onto image
-        composite = Image.alpha_composite(composite, overlay)
-        
-        # Update display
-        self.photo = ImageTk.PhotoImage(composite)
-        self.canvas.delete("image")
-        self.canvas.create_image(0, 0, anchor=tk.NW, image=self.photo, tags="image")
+                        layer = self.overlay_layers[key]
+                        if layer is not None:
+                            paint_layer(index, coverage, PALETTE_INDEX[finger_name], *layer, origin=(x0, y0))
+                            overlay_box = union_box(overlay_box, layer[0])
+        
+        with span("update_canvas.composite"):
+            # Colorize through the palette and blend onto the image in one pass, limited to the covered area
+            patch = self.base_array[y0:y1, x0:x1].copy()
+            if overlay_box is not None:
+                bx0, by0 = max(overlay_box[0], x0) - x0, max(overlay_box[1], y0) - y0
+                bx1, by1 = min(overlay_box[2], x1) - x0, min(overlay_box[3], y1) - y0
+                if bx0 < bx1 and by0 < by1:
+                    patch[by0:by1, bx0:bx1] = render_overlay(
+                        patch[by0:by1, bx0:bx1], index[by0:by1, bx0:bx1], coverage[by0:by1, bx0:bx1], PALETTE_LUT
+                    )
         
-        # Draw bounding boxes for all hands
+        with span("update_canvas.photo"):
+            if region is None:
+                # Update display
+                self.display_array = patch
+                self.photo = ImageTk.PhotoImage(Image.fromarray(patch))
+                self.canvas.delete("image")
+                self.canvas.create_image(0, 0, anchor=tk.NW, image=self.photo, tags="image")
+                self.canvas.tag_lower("image")
+            else:
+                # Copy just the dirty rectangle into the PhotoImage already on the canvas
+                self.display_array[y0:y1, x0:x1] = patch
+                patch_photo = ImageTk.PhotoImage(Image.fromarray(patch))
+                self.canvas.tk.call(str(self.photo), "copy", str(patch_photo), "-to", x0, y0)
+        
+        self.redraw_hand_bboxes()
+    
+    @traced
+    def redraw_hand_bboxes(self):
+        """Redraw the dashed hand bounding boxes and their labels"""
         self.canvas.delete("hand_bbox")
         for person_id in self.person_list:
             for hand in ['left', 'right']:
@@ -775,6 +1499,7 @@ class HandSegmentationTool:
                             tags="hand_bbox"
                         )
     
+    @traced
     def export_coco(self):
         if not self.image or not self.image_path:
             self.status_var.set("No image loaded")
@@ -790,190 +1515,269 @@ class HandSegmentationTool:
         if not file_path:
             return
         
-        # Create COCO format data structure
-        coco_data = {
-            "info": {
-                "description": "Hand segmentation dataset",
-                "url": "",
-                "version": "1.0",
-                "year": datetime.now().year,
-                "contributor": "",
-                "date_created": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            },
-            "licenses": [
-                {
-                    "id": 1,
-                    "name": "Attribution-NonCommercial",
-                    "url": "http://creativecommons.org/licenses/by-nc/2.0/"
-                }
-            ],
-            "categories": [
-                {"id": cat["id"], "name": cat["name"], "supercategory": "hand"}
-                for cat in FINGER_CATEGORIES + HAND_CATEGORIES
-            ],
-            "images": [
-                {
-                    "id": 1,
-                    "license": 1,
-                    "file_name": os.path.basename(self.image_path),
-                    "height": self.image.height,
-                    "width": self.image.width,
-                    "date_captured": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                }
-            ],
-            "annotations": []
-        }
-        
-        # Add annotations for each person, hand, and finger
-        annotation_id = 1
-        for person_id in self.person_list:
-            for hand in ['left', 'right']:
-                for category in FINGER_CATEGORIES:
-                    finger_name = category["name"]
-                    category_id = category["id"]
-                    polygons = self.masks[person_id][hand][finger_name]["polygons"]
-                    # If no polygons but we have a mask, convert mask to polygons
-                    if not polygons and self.masks[person_id][hand][finger_name]["mask"]:
-                        mask_array = np.array(self.masks[person_id][hand][finger_name]["mask"])
-                        from skimage import measure
-                        contours = measure.find_contours(mask_array, 0.5)
-                        for contour in contours:
-                            if len(contour) > 100:
-                                step = len(contour) // 100 + 1
-                                contour = contour[::step]
-                            polygon = []
-                            for point in contour:
-                                y, x = point
-                                polygon.extend([float(x), float(y)])
-                            polygons.append(polygon)
-                    for polygon in polygons:
-                        xs = polygon[0::2]
-                        ys = polygon[1::2]
-                        x_min = min(xs)
-                        y_min = min(ys)
-                        width = max(xs) - x_min
-                        height = max(ys) - y_min
-                        area = width * height
-                        annotation = {
-                            "id": annotation_id,
-                            "image_id": 1,
-                            "category_id": category_id,
-                            "segmentation": [polygon],
-                            "area": float(area),
-                            "bbox": [float(x_min), float(y_min), float(width), float(height)],
-                            "iscrowd": 0,
-                            "person_id": int(person_id),
-                            "hand": hand
-                        }
-                        coco_data["annotations"].append(annotation)
-                        annotation_id += 1
-            
-            # Add hand bounding boxes to annotations
-            for hand_type in ['left', 'right']:
-                bbox = self.hand_bboxes.get(person_id, {}).get(hand_type)
-                if bbox:
-                    # Get the category ID for this hand type
-                    hand_category_id = None
-                    for cat in HAND_CATEGORIES:
-                        if cat["name"] == f"{hand_type}_hand":
-                            hand_category_id = cat["id"]
-                            break
-                    
-                    if hand_category_id:
-                        x1, y1, x2, y2 = bbox
-                        width = x2 - x1
-                        height = y2 - y1
-                        area = width * height
-                        
-                        # Add bounding box annotation
-                        annotation = {
-                            "id": annotation_id,
-                            "image_id": 1,
-                            "category_id": hand_category_id,
-                            "segmentation": [],  # No segmentation for bbox
-                            "area": float(area),
-                            "bbox": [float(x1), float(y1), float(width), float(height)],
-                            "iscrowd": 0,
-                            "person_id": int(person_id),
-                            "hand": hand_type
-                        }
-                        coco_data["annotations"].append(annotation)
-                        annotation_id += 1
-        
-        # Save to file
-        with open(file_path, 'w') as f:
-            json.dump(coco_data, f, indent=2)
+        self.model.export_coco(file_path, "rle" if self.export_rle.get() else "polygon")
         
         self.status_var.set(f"Exported COCO annotations to {os.path.basename(file_path)}")
 
+    @traced
     def on_canvas_resize(self, event):
-        # Only resize if we have an image loaded
-        if hasattr(self, 'original_image') and self.original_image:
-            # Get new canvas dimensions
-            canvas_width = event.width
-            canvas_height = event.height
-            
-            # Only proceed if dimensions are reasonable
-            if canvas_width > 50 and canvas_height > 50:
-                # Calculate scaling factor to fit image within canvas while maintaining aspect ratio
-                img_width, img_height = self.original_image.size
-                width_ratio = canvas_width / img_width
-                height_ratio = canvas_height / img_height
-                scale_factor = min(width_ratio, height_ratio)
-                
-                # Decide whether to scale or use scrollbars
-                if scale_factor < 1:  # Image is larger than canvas
-                    # Scale down the image to fit the canvas
-                    new_width = int(img_width * scale_factor)
-                    new_height = int(img_height * scale_factor)
-                    self.image = self.original_image.resize((new_width, new_height), Image.LANCZOS)
-                    
-                    # Configure canvas for the scaled image
-                    self.canvas.config(scrollregion=(0, 0, new_width, new_height))
-                else:  # Image is smaller than or equal to canvas
-                    self.image = self.original_image
+        """Coalesce window resizes: stretch the last frame while they keep coming, re-render once they stop"""
+        if not self.original_size or event.width <= 50 or event.height <= 50:
+            return
+        self.pending_canvas_size = (event.width, event.height)
+        if self.zoom is None:
+            size = fit_size(self.original_size, self.pending_canvas_size)
+            if size == self.image.size and self.display_array is not None and self.resize_job is None:
+                return
+            self.preview_display_size(size)
+        if self.resize_job is not None:
+            self.root.after_cancel(self.resize_job)
+        self.resize_job = self.root.after(RESIZE_SETTLE_MS, self.settle_resize)
+    
+    def preview_display_size(self, size):
+        """Show the current frame stretched to size with a cheap filter (a cached size is shown for real)"""
+        if size in self.display_cache:
+            self.show_display_size(size)
+            return
+        frame = self.display_array if self.display_array is not None else self.preview_frame
+        if frame is None:
+            frame = np.asarray(self.image.convert("RGB"))
+        with span("resize.preview"):
+            self.photo = ImageTk.PhotoImage(Image.fromarray(frame).resize(size, Image.NEAREST))
+            self.canvas.delete("image")
+            self.canvas.create_image(0, 0, anchor=tk.NW, image=self.photo, tags="image")
+            self.canvas.tag_lower("image")
+        self.canvas.config(scrollregion=(0, 0, size[0], size[1]))
+        # The canvas no longer shows the composite of self.image, the next redraw must be a full one.
+        # Until then input is mapped through the preview's scale and edits are composited by settle_resize
+        self.display_array = None
+        self.preview_size = size
+        self.preview_frame = frame
+        self.redraw_hand_bboxes()
+        self.redraw_drawing_previews()
+    
+    @traced
+    def settle_resize(self):
+        """Render at full quality once the window has stopped resizing
+
+        The LANCZOS-scaled image for a new size is made on a worker thread;
+        its overlay layers are then built once and cached with it.
+        """
+        self.resize_job = None
+        if self.zoom is not None:
+            # The zoomed viewport only depends on the canvas size
+            width, height = self.original_size
+            self.canvas.config(scrollregion=(0, 0, width * self.zoom, height * self.zoom))
+            self.update_canvas()
+            self.redraw_drawing_previews()
+            return
+        
+        size = fit_size(self.original_size, self.pending_canvas_size)
+        if size in self.display_cache:
+            self.show_display_size(size)
+            return
+        path = self.image_path
+        self.run_in_background(
+            scale_display_image, (path, self.full_image, size, self.pending_canvas_size),
+            lambda image: self.scaled_image_ready(path, size, image), None
+        )
+    
+    def scaled_image_ready(self, path, size, image):
+        if path != self.image_path or self.zoom is not None:
+            return  # Another image was opened or the view was zoomed meanwhile
+        if fit_size(self.original_size, self.pending_canvas_size) != size:
+            return  # The window was resized again; its own settle will render
+        self.show_display_size(size, image)
+    
+    def show_display_size(self, size, image=None):
+        """Render the fit-to-canvas display at size (see use_display_size)"""
+        self.use_display_size(size, image)
+        self.canvas.config(scrollregion=(0, 0, size[0], size[1]))
+        self.update_canvas()
+        self.redraw_drawing_previews()
+    
+    @traced
+    def set_zoom(self, zoom, anchor=None):
+        """Switch between fit-to-canvas (zoom None) and a fixed zoom rendered from the tile pyramid
+
+        anchor is the (x, y) widget position whose image point stays put on
+        screen; it defaults to the centre of the canvas.
+        """
+        if not self.image:
+            return
+        
+        fit_zoom = self.shown_size()[0] / self.original_size[0]
+        if zoom is not None and zoom <= fit_zoom:
+            zoom = None
+        elif zoom is not None:
+            zoom = min(zoom, MAX_ZOOM)
+        
+        if anchor is None:
+            anchor = (self.canvas.winfo_width() / 2, self.canvas.winfo_height() / 2)
+        anchor_x, anchor_y = self.canvas_to_original_coords(
+            self.canvas.canvasx(anchor[0]), self.canvas.canvasy(anchor[1])
+        )
+        
+        if zoom is not None and self.full_image is None:
+            # The tile pyramid needs full-resolution pixels; zoom in once they are decoded
+            self.with_full_image(lambda: self.set_zoom(zoom, anchor))
+            return
+        
+        self.zoom = zoom
+        # Either way the canvas is redrawn below from self.image, replacing any resize preview
+        self.preview_size = None
+        self.preview_frame = None
+        if zoom is None:
+            self.canvas.config(scrollregion=(0, 0, self.image.width, self.image.height))
+            self.canvas.xview_moveto(0)
+            self.canvas.yview_moveto(0)
+        else:
+            width = self.original_size[0] * zoom
+            height = self.original_size[1] * zoom
+            self.canvas.config(scrollregion=(0, 0, width, height))
+            self.canvas.xview_moveto(max(0.0, (anchor_x * zoom - anchor[0]) / width))
+            self.canvas.yview_moveto(max(0.0, (anchor_y * zoom - anchor[1]) / height))
+        
+        # The fit-mode composite is no longer what the canvas shows
+        self.display_array = None
+        self.update_canvas()
+        self.redraw_drawing_previews()
+        self.status_var.set("Zoom: fit to window" if zoom is None else f"Zoom: {zoom * 100:.0f}%")
+        if (zoom is None and self.pending_canvas_size is not None
+                and fit_size(self.original_size, self.pending_canvas_size) != self.image.size):
+            self.settle_resize()  # The window was resized while zoomed in
+    
+    def zoom_by(self, factor, anchor=None):
+        if not self.image:
+            return
+        current = self.zoom if self.zoom is not None else self.shown_size()[0] / self.original_size[0]
+        self.set_zoom(current * factor, anchor)
+    
+    @traced
+    def on_zoom_wheel(self, event):
+        if event.num == 4 or getattr(event, "delta", 0) > 0:
+            self.zoom_by(1.25, (event.x, event.y))
+        else:
+            self.zoom_by(0.8, (event.x, event.y))
+    
+    @traced
+    def start_pan(self, event):
+        self.canvas.scan_mark(event.x, event.y)
+    
+    @traced
+    def pan(self, event):
+        self.canvas.scan_dragto(event.x, event.y, gain=1)
+        self.schedule_viewport_redraw()
+    
+    @traced
+    def on_scroll_x(self, *args):
+        self.canvas.xview(*args)
+        self.schedule_viewport_redraw()
+    
+    @traced
+    def on_scroll_y(self, *args):
+        self.canvas.yview(*args)
+        self.schedule_viewport_redraw()
+    
+    def schedule_viewport_redraw(self):
+        """Coalesce scroll and pan events into one viewport render when Tk is idle"""
+        if self.zoom is not None and self.viewport_job is None:
+            self.viewport_job = self.root.after_idle(self.flush_viewport_redraw)
+    
+    def flush_viewport_redraw(self):
+        self.viewport_job = None
+        self.update_canvas()
+    
+    @traced
+    def render_viewport(self):
+        """Render only the visible part of the image at the current zoom
+
+        The base image comes from the tile pyramid and the overlay from the
+        mask regions under the viewport, so the cost depends on the canvas
+        size rather than the image size.
+        """
+        zoom = self.zoom
+        view_x = self.canvas.canvasx(0)
+        view_y = self.canvas.canvasy(0)
+        x0, y0 = max(0, int(view_x)), max(0, int(view_y))
+        x1 = min(int(self.original_size[0] * zoom), int(view_x) + self.canvas.winfo_width())
+        y1 = min(int(self.original_size[1] * zoom), int(view_y) + self.canvas.winfo_height())
+        if x0 >= x1 or y0 >= y1:
+            return
+        
+        box = (x0 / zoom, y0 / zoom, x1 / zoom, y1 / zoom)
+        with span("render_viewport.pyramid"):
+            base = np.asarray(self.pyramid.render(box, (x1 - x0, y1 - y0)).convert("RGB"))
+        source_box = (int(box[0]), int(box[1]), math.ceil(box[2]), math.ceil(box[3]))
+        resample = Image.NEAREST if zoom >= 1 else Image.BILINEAR
+        
+        index = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        coverage = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        for person_id in self.person_list:
+            for hand in ['left', 'right']:
+                for finger_name in self.masks[person_id][hand]:
+                    key = (person_id, hand, finger_name)
+                    bounds = self.mask_store.bounds(key)
+                    if bounds is None:
+                        continue
+                    sx0, sy0 = max(bounds[0], source_box[0]), max(bounds[1], source_box[1])
+                    sx1, sy1 = min(bounds[2], source_box[2]), min(bounds[3], source_box[3])
+                    if sx0 >= sx1 or sy0 >= sy1:
+                        continue
                     
-                    # Configure canvas for the original image
-                    self.canvas.config(scrollregion=(0, 0, img_width, img_height))
-                
-                # Update the display
-                self.update_canvas()
+                    # Resample the visible part of the mask onto the matching canvas pixels
+                    mask = self.mask_store.get_region(key, (sx0, sy0, sx1, sy1))
+                    dx0, dy0 = int(sx0 * zoom), int(sy0 * zoom)
+                    dx1, dy1 = max(dx0 + 1, math.ceil(sx1 * zoom)), max(dy0 + 1, math.ceil(sy1 * zoom))
+                    resized = Image.fromarray(mask).resize(
+                        (dx1 - dx0, dy1 - dy0), resample,
+                        box=(dx0 / zoom - sx0, dy0 / zoom - sy0, min(sx1, dx1 / zoom) - sx0, min(sy1, dy1 / zoom) - sy0)
+                    )
+                    paint_layer(index, coverage, PALETTE_INDEX[finger_name], (dx0, dy0, dx1, dy1),
+                                np.asarray(resized), origin=(x0, y0))
+        
+        with span("render_viewport.composite"):
+            composite = Image.fromarray(render_overlay(base, index, coverage, PALETTE_LUT))
+        with span("render_viewport.photo"):
+            self.photo = ImageTk.PhotoImage(composite)
+            self.canvas.delete("image")
+            self.canvas.create_image(x0, y0, anchor=tk.NW, image=self.photo, tags="image")
+            self.canvas.tag_lower("image")
+    
+    @traced
+    def redraw_drawing_previews(self):
+        """Recreate the in-progress polygon and curve previews and the selection after the view scale changed"""
+        self.canvas.delete("polygon_point")
+        self.canvas.delete("polygon_line")
+        self.polygon_line_id = None
+        for original_x, original_y in self.current_polygon_points:
+            canvas_x, canvas_y = self.original_to_canvas_coords(original_x, original_y)
+            self.canvas.create_oval(canvas_x - 3, canvas_y - 3, canvas_x + 3, canvas_y + 3,
+                                    fill="red", outline="white", tags="polygon_point")
+        self.update_polygon_display()
+        
+        self.canvas.delete("curve_point")
+        self.control_point_ids = []
+        for original_x, original_y in self.curve_tool.control_points:
+            canvas_x, canvas_y = self.original_to_canvas_coords(original_x, original_y)
+            self.control_point_ids.append(self.canvas.create_oval(
+                canvas_x - 4, canvas_y - 4, canvas_x + 4, canvas_y + 4,
+                fill="blue", outline="white", tags="curve_point"
+            ))
+        self.update_curve_display()
+        self.draw_selection()
     
+    @traced
     def add_person(self):
         """Add a new person instance"""
-        new_id = str(int(self.person_list[-1]) + 1) if self.person_list else '1'
-        self.person_list.append(new_id)
+        new_id = self.model.add_person()
         self.person_listbox.insert(tk.END, f'Person {new_id}')
         
-        # Initialize masks for the new person
-        self.masks[new_id] = {}
-        for hand in ['left', 'right']:
-            self.masks[new_id][hand] = {}
-            for category in FINGER_CATEGORIES:
-                # Initialize with empty image if original_image exists, otherwise None
-                mask = None
-                draw = None
-                if hasattr(self, 'original_image') and self.original_image:
-                    mask = Image.new('L', self.original_image.size, 0)
-                    draw = ImageDraw.Draw(mask)
-                
-                self.masks[new_id][hand][category["name"]] = {
-                    "mask": mask,
-                    "draw": draw,
-                    "polygons": [],
-                    "color": category["color"]
-                }
-        
-        # Initialize bounding boxes for the new person
-        self.hand_bboxes[new_id] = {
-            'left': None,
-            'right': None
-        }
-        
         self.person_listbox.selection_clear(0, tk.END)
         self.person_listbox.selection_set(tk.END)
         self.selected_person.set(new_id)
     
+    @traced
     def on_person_select(self, event):
         selection = self.person_listbox.curselection()
         if selection:
@@ -1025,24 +1829,16 @@ class HandSegmentationTool:
         if y1 > y2:
             y1, y2 = y2, y1
             
-        # Store the bounding box
-        self.hand_bboxes[current_person][current_hand] = [x1, y1, x2, y2]
-        
-        # Save action for undo
-        self.action_history.append({
-            "type": "bbox",
-            "person": current_person,
-            "hand": current_hand,
-            "bbox": [x1, y1, x2, y2]
-        })
+        # Store the bounding box (undoable)
+        self.model.set_hand_bbox(current_person, current_hand, [x1, y1, x2, y2])
         
         # Clear temporary drawing
         self.canvas.delete("bbox")
         self.current_bbox_start = None
         self.current_bbox_rect_id = None
         
-        # Update canvas to show the bounding box
-        self.update_canvas()
+        # Only the box outlines change, the image stays as is
+        self.redraw_hand_bboxes()
         self.status_var.set(f"Added bounding box for {current_hand} hand (person {current_person})")
     
     def cancel_bounding_box(self):
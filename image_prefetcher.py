@@ -0,0 +1,136 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from profiling import traced
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def fit_size(image_size, canvas_size):
+    """Display size of an image shown fit-to-canvas; images smaller than the canvas keep their size"""
+    width, height = image_size
+    scale = min(canvas_size[0] / width, canvas_size[1] / height)
+    if scale >= 1:
+        return width, height
+    return int(width * scale), int(height * scale)
+
+
+class LoadedImage:
+    """The display copy of an image, scaled for one canvas size, plus the size of the original"""
+
+    __slots__ = ("path", "original_size", "display", "canvas_size")
+
+    def __init__(self, path, original_size, display, canvas_size):
+        self.path = path
+        self.original_size = original_size
+        self.display = display
+        self.canvas_size = canvas_size
+
+
+@traced
+def load_display_image(path, canvas_size):
+    """Decode just enough of an image to show it fit-to-canvas
+
+    JPEGs are decoded at a reduced scale (1/2, 1/4 or 1/8, via PIL's draft
+    mode) that still covers the display size, then LANCZOS-scaled the rest
+    of the way; the full-resolution pixels are never decoded here.
+    """
+    image = Image.open(path)
+    original_size = image.size
+    size = fit_size(original_size, canvas_size)
+    if size != original_size:
+        image.draft('RGB', size)
+    image = image.convert('RGB')
+    display = image if image.size == size else image.resize(size, Image.LANCZOS)
+    return LoadedImage(path, original_size, display, canvas_size)
+
+
+@traced
+def scale_display_image(path, full_image, size, canvas_size):
+    """Display copy of an image at size: LANCZOS from the full image if it is decoded, else a reduced decode"""
+    if full_image is None:
+        return load_display_image(path, canvas_size).display
+    return full_image if full_image.size == size else full_image.resize(size, Image.LANCZOS)
+
+
+@traced
+def load_full_image(path):
+    """Decode an image at full resolution as RGB"""
+    return Image.open(path).convert('RGB')
+
+
+class ImagePrefetcher:
+    """Decode display copies of upcoming images on a thread pool into a bounded LRU cache
+
+    prefetch() queues images that are likely to be opened next; get()
+    returns a cached image at once, waits for one that is still loading,
+    or loads it on the calling thread. At most cache_size images are kept.
+    """
+
+    def __init__(self, max_workers=2, cache_size=4, loader=load_display_image):
+        self.cache_size = cache_size
+        self.loader = loader
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image_prefetch")
+        self.cache = OrderedDict()
+        self.pending = {}
+        # Re-entrant: cancelling a queued future runs _store, which takes the lock, on the calling thread
+        self.lock = threading.RLock()
+
+    def _store(self, path, future):
+        with self.lock:
+            if self.pending.get(path) is future:
+                del self.pending[path]
+            if future.cancelled() or future.exception() is not None:
+                return
+            self.cache[path] = future.result()
+            self.cache.move_to_end(path)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def prefetch(self, paths, canvas_size):
+        """Start loading paths (most wanted first); queued loads of other paths are cancelled"""
+        paths = list(paths)[:self.cache_size]
+        with self.lock:
+            stale = [future for path, future in self.pending.items() if path not in paths]
+        # Outside the lock: cancel() runs the done callback, which takes the lock to drop the future
+        for future in stale:
+            future.cancel()
+        with self.lock:
+            for path in paths:
+                cached = self.cache.get(path)
+                if path in self.pending or (cached is not None and cached.canvas_size == canvas_size):
+                    continue
+                future = self.executor.submit(self.loader, path, canvas_size)
+                self.pending[path] = future
+                future.add_done_callback(lambda done, path=path: self._store(path, done))
+
+    def peek(self, path, canvas_size):
+        """Cached LoadedImage for path and canvas_size, or None without loading anything"""
+        with self.lock:
+            loaded = self.cache.get(path)
+            if loaded is None or loaded.canvas_size != canvas_size:
+                return None
+            self.cache.move_to_end(path)
+            return loaded
+
+    def get(self, path, canvas_size):
+        """LoadedImage for path, scaled for canvas_size"""
+        with self.lock:
+            loaded = self.cache.get(path)
+            if loaded is not None:
+                self.cache.move_to_end(path)
+            future = self.pending.get(path)
+        if loaded is None and future is not None and not future.cancelled():
+            try:
+                loaded = future.result()
+            except Exception:
+                loaded = None
+        if loaded is None or loaded.canvas_size != canvas_size:
+            loaded = self.loader(path, canvas_size)
+        return loaded
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
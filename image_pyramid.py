@@ -0,0 +1,98 @@
+import math
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+
+def _nbytes(image):
+    return image.width * image.height * len(image.getbands())
+
+
+class ImagePyramid:
+    """Multi-resolution tile pyramid over a full-resolution image
+
+    Level 0 is the original image and every further level halves it. Levels
+    are only reduced when first needed (or ahead of time by build_levels on
+    a worker), and tiles are cut on demand and kept in an LRU cache bounded
+    in bytes, so rendering a viewport only touches the tiles it can see at
+    the level closest to the requested scale.
+    """
+
+    def __init__(self, image, tile_size=256, max_bytes=64 * 1024 * 1024):
+        self.tile_size = tile_size
+        self.max_bytes = max_bytes
+        self.tiles = OrderedDict()
+        self.tile_bytes = 0
+        self.levels = [image]
+        self.level_lock = threading.Lock()
+        # reduce(2) rounds up, so the level sizes are known before any is built
+        self.level_sizes = [image.size]
+        while max(self.level_sizes[-1]) > tile_size:
+            width, height = self.level_sizes[-1]
+            self.level_sizes.append(((width + 1) // 2, (height + 1) // 2))
+
+    @property
+    def size(self):
+        return self.level_sizes[0]
+
+    def level(self, index):
+        """The image of a level, reducing it (and the levels above it) from the original if needed"""
+        if index >= len(self.levels):
+            with self.level_lock:
+                while len(self.levels) <= index:
+                    self.levels.append(self.levels[-1].reduce(2))
+        return self.levels[index]
+
+    def build_levels(self):
+        """Reduce every level now; meant for a worker thread, so zooming out never has to wait for it"""
+        self.level(len(self.level_sizes) - 1)
+
+    def level_for_scale(self, scale):
+        """Index of the smallest level that still has at least scale x original resolution"""
+        for level in range(len(self.level_sizes) - 1, 0, -1):
+            if self.level_sizes[level][0] / self.size[0] >= scale:
+                return level
+        return 0
+
+    def get_tile(self, level, tile_x, tile_y):
+        key = (level, tile_x, tile_y)
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.tiles.move_to_end(key)
+            return tile
+        image = self.level(level)
+        x0, y0 = tile_x * self.tile_size, tile_y * self.tile_size
+        tile = image.crop((x0, y0, min(image.width, x0 + self.tile_size), min(image.height, y0 + self.tile_size)))
+        tile.load()
+        self.tiles[key] = tile
+        self.tile_bytes += _nbytes(tile)
+        while self.tile_bytes > self.max_bytes and len(self.tiles) > 1:
+            self.tile_bytes -= _nbytes(self.tiles.popitem(last=False)[1])
+        return tile
+
+    def render(self, box, size, resample=Image.BILINEAR):
+        """Render the original-image box (x0, y0, x1, y1), given as floats, at size (width, height)"""
+        scale = min(size[0] / (box[2] - box[0]), size[1] / (box[3] - box[1]))
+        level = self.level_for_scale(scale)
+        image = self.level(level)
+        factor_x = image.width / self.size[0]
+        factor_y = image.height / self.size[1]
+        lx0, ly0 = box[0] * factor_x, box[1] * factor_y
+        lx1 = min(image.width, box[2] * factor_x)
+        ly1 = min(image.height, box[3] * factor_y)
+
+        # Paste the covering tiles into one small mosaic, then resample it to the output size
+        tile_x0, tile_y0 = int(lx0) // self.tile_size, int(ly0) // self.tile_size
+        tile_x1 = (math.ceil(lx1) - 1) // self.tile_size
+        tile_y1 = (math.ceil(ly1) - 1) // self.tile_size
+        origin_x, origin_y = tile_x0 * self.tile_size, tile_y0 * self.tile_size
+        mosaic = Image.new(image.mode, (
+            min(image.width, (tile_x1 + 1) * self.tile_size) - origin_x,
+            min(image.height, (tile_y1 + 1) * self.tile_size) - origin_y,
+        ))
+        for tile_y in range(tile_y0, tile_y1 + 1):
+            for tile_x in range(tile_x0, tile_x1 + 1):
+                mosaic.paste(self.get_tile(level, tile_x, tile_y),
+                             (tile_x * self.tile_size - origin_x, tile_y * self.tile_size - origin_y))
+        return mosaic.resize(size, resample, box=(lx0 - origin_x, ly0 - origin_y, lx1 - origin_x, ly1 - origin_y))
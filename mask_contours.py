@@ -0,0 +1,167 @@
+import numpy as np
+
+# Default Douglas-Peucker tolerance, in pixels, for polygons traced from masks
+DEFAULT_POLYGON_TOLERANCE = 1.0
+
+# Unit step of each edge direction: right, down, left, up (image coordinates, y down)
+_STEPS = np.array([(1, 0), (0, 1), (-1, 0), (0, -1)], dtype=np.int64)
+
+
+def _boundary_edges(mask):
+    """Directed pixel-boundary edges of a padded mask, foreground on the right of each edge
+
+    Returns (start vertices, directions) with vertices as (x, y) pixel corners.
+    """
+    inside = mask[1:-1, 1:-1]
+    ys, xs = np.nonzero(inside & ~mask[:-2, 1:-1])
+    top = np.stack((xs, ys), axis=1), np.zeros(len(xs), dtype=np.int64)
+    ys, xs = np.nonzero(inside & ~mask[1:-1, 2:])
+    right = np.stack((xs + 1, ys), axis=1), np.ones(len(xs), dtype=np.int64)
+    ys, xs = np.nonzero(inside & ~mask[2:, 1:-1])
+    bottom = np.stack((xs + 1, ys + 1), axis=1), np.full(len(xs), 2, dtype=np.int64)
+    ys, xs = np.nonzero(inside & ~mask[1:-1, :-2])
+    left = np.stack((xs, ys + 1), axis=1), np.full(len(xs), 3, dtype=np.int64)
+    starts = np.concatenate([top[0], right[0], bottom[0], left[0]])
+    directions = np.concatenate([top[1], right[1], bottom[1], left[1]])
+    return starts, directions
+
+
+def _link_edges(starts, directions, width):
+    """Index of the edge that follows each edge around its boundary
+
+    Where two boundaries touch diagonally the right turn is taken, so
+    diagonal neighbours end up in separate loops (4-connected foreground).
+    """
+    ends = starts + _STEPS[directions]
+    start_ids = starts[:, 1] * width + starts[:, 0]
+    end_ids = ends[:, 1] * width + ends[:, 0]
+    order = np.argsort(start_ids, kind="stable")
+    sorted_ids = start_ids[order]
+    first = np.searchsorted(sorted_ids, end_ids, side="left")
+    last = np.searchsorted(sorted_ids, end_ids, side="right")
+    following = order[first]
+    # Saddle vertex: two candidate edges, keep the one that turns right
+    saddle = np.flatnonzero(last - first == 2)
+    if len(saddle):
+        other = order[first[saddle] + 1]
+        turns_right = directions[other] == (directions[saddle] + 1) % 4
+        following[saddle[turns_right]] = other[turns_right]
+    return following
+
+
+def _corner_loops(mask):
+    """Closed boundary loops of a boolean mask as (N, 2) arrays of corner vertices
+
+    Only vertices where the boundary changes direction are kept. Outer
+    boundaries run clockwise on screen, holes counter-clockwise.
+    """
+    padded = np.zeros((mask.shape[0] + 2, mask.shape[1] + 2), dtype=bool)
+    padded[1:-1, 1:-1] = mask
+    starts, directions = _boundary_edges(padded)
+    if not len(starts):
+        return []
+    following = _link_edges(starts, directions, mask.shape[1] + 1)
+    # An edge starts a corner when it turns away from the edge before it
+    corner = directions != directions[np.argsort(following)]
+    # Pointer doubling: every edge learns the first corner edge at or after it,
+    # so the loops are walked corner to corner without visiting straight runs
+    jump = np.where(corner, np.arange(len(starts)), following)
+    while not corner[jump].all():
+        jump = jump[jump]
+    next_corner = jump[following]
+
+    loops = []
+    visited = np.zeros(len(starts), dtype=bool)
+    for edge in np.flatnonzero(corner):
+        if visited[edge]:
+            continue
+        loop = []
+        while not visited[edge]:
+            visited[edge] = True
+            loop.append(edge)
+            edge = next_corner[edge]
+        loops.append(starts[loop])
+    return loops
+
+
+def _signed_area(points):
+    xs, ys = points[:, 0], points[:, 1]
+    return (np.dot(xs, np.roll(ys, -1)) - np.dot(ys, np.roll(xs, -1))) / 2
+
+
+def simplify_polyline(points, tolerance):
+    """Douglas-Peucker simplification of an (N, 2) polyline, returns the kept points
+
+    Every pending split interval is processed in the same vectorized pass,
+    so the Python loop runs once per recursion level rather than per point.
+    A closed loop (first point equal to the last) is measured by plain
+    distance to that point for its first split.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    count = len(points)
+    if count < 3:
+        return points
+    keep = np.zeros(count, dtype=bool)
+    keep[[0, -1]] = True
+    lo = np.array([0])
+    hi = np.array([count - 1])
+    while len(lo):
+        lengths = hi - lo - 1
+        lo, hi, lengths = lo[lengths > 0], hi[lengths > 0], lengths[lengths > 0]
+        if not len(lo):
+            break
+        group = np.repeat(np.arange(len(lo)), lengths)
+        offsets = np.cumsum(lengths) - lengths
+        index = lo[group] + 1 + np.arange(lengths.sum()) - offsets[group]
+
+        a, b = points[lo][group], points[hi][group]
+        chord = b - a
+        norm = np.hypot(chord[:, 0], chord[:, 1])
+        relative = points[index] - a
+        cross = np.abs(chord[:, 0] * relative[:, 1] - chord[:, 1] * relative[:, 0])
+        distance = np.where(norm > 0, cross / np.where(norm > 0, norm, 1), np.hypot(relative[:, 0], relative[:, 1]))
+
+        farthest = np.maximum.reduceat(distance, offsets)
+        is_max = distance == farthest[group]
+        groups, first = np.unique(group[is_max], return_index=True)
+        split = index[is_max][first]
+        far = farthest[groups] > tolerance
+        split = split[far]
+        keep[split] = True
+        lo, hi = np.concatenate((lo[far], split)), np.concatenate((split, hi[far]))
+    return points[keep]
+
+
+def trace_mask(crop, box, tolerance=DEFAULT_POLYGON_TOLERANCE):
+    """Outer boundaries of a bbox-cropped mask as COCO polygons, plus whether the mask has holes
+
+    Returns (polygons, has_holes); see mask_to_polygons. The holes are not
+    in the polygons, so a caller that needs them exact can fall back to
+    another encoding when has_holes is set.
+    """
+    polygons = []
+    has_holes = False
+    for loop in _corner_loops(np.asarray(crop) > 0):
+        if _signed_area(loop) <= 0:
+            has_holes = True
+            continue
+        closed = np.concatenate((loop, loop[:1]))
+        simplified = simplify_polyline(closed, tolerance)[:-1]
+        if len(simplified) < 3:
+            simplified = loop.astype(simplified.dtype)
+        simplified += (box[0], box[1])
+        polygons.append(simplified.ravel().tolist())
+    return polygons, has_holes
+
+
+def mask_to_polygons(crop, box, tolerance=DEFAULT_POLYGON_TOLERANCE):
+    """Trace the outer boundaries of a bbox-cropped mask as COCO polygons
+
+    crop is a boolean (or 0/255) array placed at box (x0, y0, ...). Returns a
+    list of flat [x0, y0, x1, y1, ...] polygons on pixel corners, simplified
+    with Douglas-Peucker at tolerance pixels. Holes are dropped, since a
+    COCO polygon cannot cut them out (trace_mask reports them). A contour
+    that simplification would collapse below 3 points (a thin line, a lone
+    pixel) is kept as traced.
+    """
+    return trace_mask(crop, box, tolerance)[0]
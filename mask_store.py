@@ -0,0 +1,521 @@
+import itertools
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+HANDS = ['left', 'right']
+
+# Side of the square tiles TileMaskStore allocates on first write
+TILE_SIZE = 256
+
+# Shared by every store, so a revision never repeats even across images
+_REVISIONS = itertools.count(1)
+
+
+def polygon_mask(points):
+    """Rasterize a polygon into a mask cropped to its bounding box, returns (mask, (x0, y0))"""
+    xs = [int(p[0]) for p in points]
+    ys = [int(p[1]) for p in points]
+    x0, y0 = min(xs), min(ys)
+    width = max(xs) - x0 + 1
+    height = max(ys) - y0 + 1
+    mask = Image.new('L', (width, height), 0)
+    ImageDraw.Draw(mask).polygon([(x - x0, y - y0) for x, y in zip(xs, ys)], fill=255, outline=255)
+    return mask, (x0, y0)
+
+
+def _clip_box(box, size):
+    x0, y0, x1, y1 = box
+    x0, y0 = max(0, x0), max(0, y0)
+    x1, y1 = min(size[0], x1), min(size[1], y1)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return x0, y0, x1, y1
+
+
+def union_box(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+
+def _trim(crop, box):
+    """Shrink a bool crop placed at box to its set pixels, returns (crop, box) or (None, None) if empty"""
+    if crop is None or not crop.any():
+        return None, None
+    ys = np.flatnonzero(crop.any(axis=1))
+    xs = np.flatnonzero(crop.any(axis=0))
+    crop = crop[ys[0]:ys[-1] + 1, xs[0]:xs[-1] + 1]
+    return crop, (box[0] + int(xs[0]), box[1] + int(ys[0]), box[0] + int(xs[-1]) + 1, box[1] + int(ys[-1]) + 1)
+
+
+class ImageMaskStore:
+    """One full-resolution "L" image per (person, hand, finger), the original layout
+
+    A finger's image is only created by its first write.
+    """
+
+    def __init__(self, size, finger_names):
+        self.size = size
+        self.finger_names = list(finger_names)
+        self.images = {}
+        self.boxes = {}
+        self.revisions = {}
+
+    def add_person(self, person_id):
+        """Nothing to allocate: a finger's image is created by its first write"""
+
+
+    def revision(self, key):
+        """Number that changes whenever a finger's mask is written, 0 if it never was"""
+        return self.revisions.get(key, 0)
+
+    def _touch(self, key):
+        self.revisions[key] = next(_REVISIONS)
+
+    def _image(self, key):
+        image = self.images.get(key)
+        if image is None:
+            image = self.images[key] = Image.new('L', self.size, 0)
+        return image
+
+    def draw_polygon(self, key, points):
+        self._touch(key)
+        ImageDraw.Draw(self._image(key)).polygon(points, fill=255, outline=255)
+        xs = [int(p[0]) for p in points]
+        ys = [int(p[1]) for p in points]
+        box = _clip_box((min(xs), min(ys), max(xs) + 1, max(ys) + 1), self.size)
+        self.boxes[key] = union_box(self.boxes.get(key), box)
+
+    def paint(self, key, mask, offset=(0, 0)):
+        """Set every pixel where mask is non-zero; mask may be cropped and placed at offset"""
+        box = (offset[0], offset[1], offset[0] + mask.width, offset[1] + mask.height)
+        self._touch(key)
+        self._image(key).paste(255, box, mask)
+        self.boxes[key] = union_box(self.boxes.get(key), _clip_box(box, self.size))
+
+    def clear(self, key):
+        self._touch(key)
+        self.images.pop(key, None)
+        self.boxes.pop(key, None)
+
+    def bounds(self, key):
+        """Cheap box that contains every set pixel of a finger (may be loose), or None"""
+        return self.boxes.get(key)
+
+    def getbbox(self, key):
+        box = self.boxes.get(key)
+        if box is None:
+            return None
+        inner = self.images[key].crop(box).getbbox()
+        if inner is None:
+            return None
+        return box[0] + inner[0], box[1] + inner[1], box[0] + inner[2], box[1] + inner[3]
+
+    def get_mask(self, key):
+        """Full-resolution "L" mask for a finger, or None if it is empty"""
+        if self.getbbox(key) is None:
+            return None
+        return self.images[key]
+
+    def get_array(self, key):
+        mask = self.get_mask(key)
+        return None if mask is None else np.array(mask)
+
+    def get_crop(self, key):
+        """Mask cropped to its bounding box as (box, uint8 array), or None if it is empty"""
+        box = self.getbbox(key)
+        if box is None:
+            return None
+        return box, np.array(self.images[key].crop(box))
+
+    def get_region(self, key, box):
+        """uint8 mask values inside box (x0, y0, x1, y1), zeros where the finger is empty"""
+        image = self.images.get(key)
+        if image is None:
+            return np.zeros((box[3] - box[1], box[2] - box[0]), dtype=np.uint8)
+        return np.array(image.crop(box))
+
+    def snapshot(self, key):
+        """Bbox-cropped copy of a finger mask as (box, bool crop), or None if it is empty"""
+        box = self.getbbox(key)
+        if box is None:
+            return None
+        return box, np.array(self.images[key].crop(box)) > 0
+
+    def restore(self, key, snapshot):
+        self.clear(key)
+        if snapshot is None:
+            return
+        box, crop = snapshot
+        self.paint(key, Image.fromarray(crop.astype(np.uint8) * 255, 'L'), (box[0], box[1]))
+
+    def snapshot_region(self, key, box):
+        """Exact copy of a finger mask inside box as (box, bool crop), or None if box is off-image"""
+        box = _clip_box(box, self.size)
+        if box is None:
+            return None
+        return box, self.get_region(key, box) > 0
+
+    def restore_region(self, key, snapshot):
+        """Overwrite the region saved by snapshot_region, clearing and setting pixels alike"""
+        if snapshot is None:
+            return
+        box, crop = snapshot
+        if key not in self.images and not crop.any():
+            return
+        self._touch(key)
+        self._image(key).paste(Image.fromarray(crop.astype(np.uint8) * 255, 'L'), (box[0], box[1]))
+        if crop.any():
+            self.boxes[key] = union_box(self.boxes.get(key), tuple(box))
+
+    @property
+    def nbytes(self):
+        return sum(image.width * image.height for image in self.images.values())
+
+
+class LabelMapMaskStore:
+    """All finger masks encoded as a small stack of uint16 label planes
+
+    Each (person, hand, finger) gets its own label. A pixel covered by several
+    masks stores one label per plane, so extra planes are only allocated where
+    masks actually overlap.
+    """
+
+    def __init__(self, size, finger_names):
+        self.size = size
+        self.finger_names = list(finger_names)
+        self.planes = [np.zeros((size[1], size[0]), dtype=np.uint16)]
+        self.labels = {}
+        self.bboxes = {}
+        self.revisions = {}
+
+    def add_person(self, person_id):
+        slot = len({key[0] for key in self.labels})
+        per_person = len(HANDS) * len(self.finger_names)
+        if (slot + 1) * per_person >= np.iinfo(np.uint16).max:
+            raise ValueError("Too many persons for a uint16 label map")
+        for hand_index, hand in enumerate(HANDS):
+            for finger_index, finger_name in enumerate(self.finger_names):
+                label = slot * per_person + hand_index * len(self.finger_names) + finger_index + 1
+                self.labels[(person_id, hand, finger_name)] = label
+
+
+    def revision(self, key):
+        """Number that changes whenever a finger's mask is written, 0 if it never was"""
+        return self.revisions.get(key, 0)
+
+    def _touch(self, key):
+        self.revisions[key] = next(_REVISIONS)
+
+    def draw_polygon(self, key, points):
+        mask, offset = polygon_mask(points)
+        self.paint(key, mask, offset)
+
+    def paint(self, key, mask, offset=(0, 0)):
+        """Set every pixel where mask is non-zero; mask may be cropped and placed at offset"""
+        box = _clip_box((offset[0], offset[1], offset[0] + mask.width, offset[1] + mask.height), self.size)
+        if box is None:
+            return
+        x0, y0, x1, y1 = box
+        pixels = np.asarray(mask)[y0 - offset[1]:y1 - offset[1], x0 - offset[0]:x1 - offset[0]] > 0
+        ys, xs = np.nonzero(pixels)
+        if len(ys) == 0:
+            return
+        label = self.labels[key]
+        self._touch(key)
+        ys = ys + y0
+        xs = xs + x0
+        self.bboxes[key] = union_box(self.bboxes.get(key), box)
+        for plane in self.planes:
+            pending = plane[ys, xs] != label
+            ys, xs = ys[pending], xs[pending]
+        for plane in self.planes:
+            if len(ys) == 0:
+                break
+            free = plane[ys, xs] == 0
+            plane[ys[free], xs[free]] = label
+            ys, xs = ys[~free], xs[~free]
+        if len(ys):
+            plane = np.zeros_like(self.planes[0])
+            plane[ys, xs] = label
+            self.planes.append(plane)
+
+    def clear(self, key):
+        self._touch(key)
+        box = self.bboxes.pop(key, None)
+        if box is None:
+            return
+        label = self.labels[key]
+        x0, y0, x1, y1 = box
+        for plane in self.planes:
+            region = plane[y0:y1, x0:x1]
+            region[region == label] = 0
+
+    def _crop(self, key):
+        box = self.bboxes.get(key)
+        if box is None:
+            return None, None
+        label = self.labels[key]
+        x0, y0, x1, y1 = box
+        crop = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+        for plane in self.planes:
+            crop |= plane[y0:y1, x0:x1] == label
+        return crop, box
+
+    def _trimmed_crop(self, key):
+        return _trim(*self._crop(key))
+
+    def getbbox(self, key):
+        return self._trimmed_crop(key)[1]
+
+    def bounds(self, key):
+        """Cheap box that contains every set pixel of a finger (may be loose), or None"""
+        return self.bboxes.get(key)
+
+    def get_array(self, key):
+        """Full-resolution uint8 mask (0/255) for a finger, or None if it is empty"""
+        crop, box = self._crop(key)
+        if crop is None or not crop.any():
+            return None
+        array = np.zeros((self.size[1], self.size[0]), dtype=np.uint8)
+        array[box[1]:box[3], box[0]:box[2]][crop] = 255
+        return array
+
+    def get_mask(self, key):
+        array = self.get_array(key)
+        return None if array is None else Image.fromarray(array, 'L')
+
+    def get_crop(self, key):
+        """Mask cropped to its bounding box as (box, uint8 array), or None if it is empty"""
+        crop, box = self._trimmed_crop(key)
+        if crop is None:
+            return None
+        return box, crop.astype(np.uint8) * 255
+
+    def get_region(self, key, box):
+        """uint8 mask values inside box (x0, y0, x1, y1), zeros where the finger is empty"""
+        x0, y0, x1, y1 = box
+        region = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        if self.bboxes.get(key) is None:
+            return region
+        label = self.labels[key]
+        for plane in self.planes:
+            region[plane[y0:y1, x0:x1] == label] = 255
+        return region
+
+    def snapshot(self, key):
+        """Bbox-cropped copy of a finger mask as (box, bool crop), or None if it is empty"""
+        crop, box = self._trimmed_crop(key)
+        if crop is None:
+            return None
+        return box, crop
+
+    def restore(self, key, snapshot):
+        self.clear(key)
+        if snapshot is None:
+            return
+        box, crop = snapshot
+        self.paint(key, Image.fromarray(crop.astype(np.uint8) * 255, 'L'), (box[0], box[1]))
+
+    def snapshot_region(self, key, box):
+        """Exact copy of a finger mask inside box as (box, bool crop), or None if box is off-image"""
+        box = _clip_box(box, self.size)
+        if box is None:
+            return None
+        return box, self.get_region(key, box) > 0
+
+    def restore_region(self, key, snapshot):
+        """Overwrite the region saved by snapshot_region, clearing and setting pixels alike"""
+        if snapshot is None:
+            return
+        box, crop = snapshot
+        x0, y0, x1, y1 = box
+        label = self.labels[key]
+        self._touch(key)
+        if key in self.bboxes:
+            for plane in self.planes:
+                region = plane[y0:y1, x0:x1]
+                region[region == label] = 0
+        self.paint(key, Image.fromarray(crop.astype(np.uint8) * 255, 'L'), (x0, y0))
+
+    @property
+    def nbytes(self):
+        return sum(plane.nbytes for plane in self.planes)
+
+
+class TileMaskStore:
+    """Finger masks as sparse TILE_SIZE square tiles, allocated on first write
+
+    Each (person, hand, finger) owns only the tiles it has pixels in, so an
+    empty finger costs no memory and every query on it returns at once;
+    adding a person allocates nothing. Tiles cleared back to empty (by undo)
+    are dropped again.
+    """
+
+    def __init__(self, size, finger_names, tile_size=TILE_SIZE):
+        self.size = size
+        self.finger_names = list(finger_names)
+        self.tile_size = tile_size
+        self.tiles = {}
+        self.bboxes = {}
+        self.revisions = {}
+
+    def add_person(self, person_id):
+        """Nothing to allocate: a finger's tiles are created by its first write"""
+
+
+    def revision(self, key):
+        """Number that changes whenever a finger's mask is written, 0 if it never was"""
+        return self.revisions.get(key, 0)
+
+    def _touch(self, key):
+        self.revisions[key] = next(_REVISIONS)
+
+    def _tile_box(self, index):
+        size = self.tile_size
+        x0, y0 = index[0] * size, index[1] * size
+        return x0, y0, min(x0 + size, self.size[0]), min(y0 + size, self.size[1])
+
+    def _write(self, key, box, pixels, overwrite):
+        """Or (or, with overwrite, copy) a bool array into the tiles covering box"""
+        x0, y0, x1, y1 = box
+        size = self.tile_size
+        self._touch(key)
+        tiles = self.tiles.get(key, {})
+        for ty in range(y0 // size, (y1 - 1) // size + 1):
+            for tx in range(x0 // size, (x1 - 1) // size + 1):
+                tx0, ty0, tx1, ty1 = self._tile_box((tx, ty))
+                ox0, oy0, ox1, oy1 = max(x0, tx0), max(y0, ty0), min(x1, tx1), min(y1, ty1)
+                patch = pixels[oy0 - y0:oy1 - y0, ox0 - x0:ox1 - x0]
+                tile = tiles.get((tx, ty))
+                if tile is None:
+                    if not patch.any():
+                        continue
+                    tile = tiles[(tx, ty)] = np.zeros((ty1 - ty0, tx1 - tx0), dtype=bool)
+                region = tile[oy0 - ty0:oy1 - ty0, ox0 - tx0:ox1 - tx0]
+                if not overwrite:
+                    region |= patch
+                    continue
+                region[...] = patch
+                if not patch.any() and not tile.any():
+                    del tiles[(tx, ty)]
+        if not tiles:
+            self.clear(key)
+            return
+        self.tiles[key] = tiles
+        if pixels.any():
+            self.bboxes[key] = union_box(self.bboxes.get(key), box)
+
+    def draw_polygon(self, key, points):
+        mask, offset = polygon_mask(points)
+        self.paint(key, mask, offset)
+
+    def paint(self, key, mask, offset=(0, 0)):
+        """Set every pixel where mask is non-zero; mask may be cropped and placed at offset"""
+        box = _clip_box((offset[0], offset[1], offset[0] + mask.width, offset[1] + mask.height), self.size)
+        if box is None:
+            return
+        x0, y0, x1, y1 = box
+        pixels = np.asarray(mask)[y0 - offset[1]:y1 - offset[1], x0 - offset[0]:x1 - offset[0]] > 0
+        self._write(key, box, pixels, overwrite=False)
+
+    def clear(self, key):
+        self._touch(key)
+        self.tiles.pop(key, None)
+        self.bboxes.pop(key, None)
+
+    def _crop(self, key, box):
+        x0, y0, x1, y1 = box
+        crop = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+        for index, tile in self.tiles.get(key, {}).items():
+            tx0, ty0, tx1, ty1 = self._tile_box(index)
+            ox0, oy0, ox1, oy1 = max(x0, tx0), max(y0, ty0), min(x1, tx1), min(y1, ty1)
+            if ox0 < ox1 and oy0 < oy1:
+                crop[oy0 - y0:oy1 - y0, ox0 - x0:ox1 - x0] = tile[oy0 - ty0:oy1 - ty0, ox0 - tx0:ox1 - tx0]
+        return crop
+
+    def _trimmed_crop(self, key):
+        box = self.bboxes.get(key)
+        if box is None:
+            return None, None
+        return _trim(self._crop(key, box), box)
+
+    def getbbox(self, key):
+        return self._trimmed_crop(key)[1]
+
+    def bounds(self, key):
+        """Cheap box that contains every set pixel of a finger (may be loose), or None"""
+        return self.bboxes.get(key)
+
+    def get_array(self, key):
+        """Full-resolution uint8 mask (0/255) for a finger, or None if it is empty"""
+        box = self.bboxes.get(key)
+        if box is None:
+            return None
+        array = np.zeros((self.size[1], self.size[0]), dtype=np.uint8)
+        array[box[1]:box[3], box[0]:box[2]][self._crop(key, box)] = 255
+        return array
+
+    def get_mask(self, key):
+        array = self.get_array(key)
+        return None if array is None else Image.fromarray(array, 'L')
+
+    def get_crop(self, key):
+        """Mask cropped to its bounding box as (box, uint8 array), or None if it is empty"""
+        crop, box = self._trimmed_crop(key)
+        if crop is None:
+            return None
+        return box, crop.astype(np.uint8) * 255
+
+    def get_region(self, key, box):
+        """uint8 mask values inside box (x0, y0, x1, y1), zeros where the finger is empty"""
+        return self._crop(key, box).view(np.uint8) * np.uint8(255)
+
+    def snapshot(self, key):
+        """Bbox-cropped copy of a finger mask as (box, bool crop), or None if it is empty"""
+        crop, box = self._trimmed_crop(key)
+        if crop is None:
+            return None
+        return box, crop
+
+    def restore(self, key, snapshot):
+        self.clear(key)
+        if snapshot is None:
+            return
+        box, crop = snapshot
+        self._write(key, tuple(box), np.asarray(crop, dtype=bool), overwrite=False)
+
+    def snapshot_region(self, key, box):
+        """Exact copy of a finger mask inside box as (box, bool crop), or None if box is off-image"""
+        box = _clip_box(box, self.size)
+        if box is None:
+            return None
+        return box, self._crop(key, box)
+
+    def restore_region(self, key, snapshot):
+        """Overwrite the region saved by snapshot_region, clearing and setting pixels alike"""
+        if snapshot is None:
+            return
+        box, crop = snapshot
+        self._write(key, tuple(box), np.asarray(crop, dtype=bool), overwrite=True)
+
+    @property
+    def nbytes(self):
+        return sum(tile.nbytes for tiles in self.tiles.values() for tile in tiles.values())
+
+
+MASK_STORES = {
+    "image": ImageMaskStore,
+    "label": LabelMapMaskStore,
+    "tile": TileMaskStore,
+}
+
+
+def create_mask_store(kind, size, finger_names):
+    """Create the mask store registered under kind ("image", "label" or "tile")"""
+    if kind not in MASK_STORES:
+        raise ValueError(f"Unknown mask store: {kind}")
+    return MASK_STORES[kind](size, finger_names)
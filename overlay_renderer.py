@@ -0,0 +1,71 @@
+import numpy as np
+
+
+def build_palette_lut(categories, alpha=128):
+    """Build an RGBA lookup table indexed by palette index; index 0 is transparent
+
+    Palette index i + 1 maps to categories[i]["color"] with the given alpha.
+    """
+    lut = np.zeros((len(categories) + 1, 4), dtype=np.uint8)
+    for i, category in enumerate(categories):
+        lut[i + 1, :3] = category["color"]
+        lut[i + 1, 3] = alpha
+    return lut
+
+
+_BLEND_TABLES = {}
+
+
+def _blend_tables(lut):
+    """Per-channel blend results for every (palette index, coverage, base value) triple
+
+    Cached on the LUT's bytes; each table is flat and indexed by
+    (index << 16) | (coverage << 8) | base value.
+    """
+    key = lut.tobytes()
+    tables = _BLEND_TABLES.get(key)
+    if tables is None:
+        coverage = np.arange(256, dtype=np.uint32)
+        alpha = (lut[:, 3:4].astype(np.uint32) * coverage // 255)[:, :, None]
+        base = np.arange(256, dtype=np.uint32)[None, None, :]
+        tables = []
+        for channel in range(3):
+            color = lut[:, channel].astype(np.uint32)[:, None, None]
+            blended = (base * (255 - alpha) + color * alpha + 127) // 255
+            tables.append(blended.astype(np.uint8).ravel())
+        _BLEND_TABLES[key] = tables
+    return tables
+
+
+def paint_layer(index, coverage, palette_index, box, layer_coverage, origin=(0, 0)):
+    """Write one layer's coverage crop into the index/coverage arrays (later layers win)
+
+    box is (x0, y0, x1, y1) of the layer crop; index/coverage cover the area
+    starting at origin, and only the overlapping part is written.
+    """
+    height, width = index.shape
+    x0, y0 = max(box[0], origin[0]), max(box[1], origin[1])
+    x1, y1 = min(box[2], origin[0] + width), min(box[3], origin[1] + height)
+    if x0 >= x1 or y0 >= y1:
+        return
+    layer_coverage = layer_coverage[y0 - box[1]:y1 - box[1], x0 - box[0]:x1 - box[0]]
+    covered = layer_coverage > 0
+    target = (slice(y0 - origin[1], y1 - origin[1]), slice(x0 - origin[0], x1 - origin[0]))
+    np.copyto(index[target], palette_index, where=covered)
+    np.copyto(coverage[target], layer_coverage, where=covered)
+
+
+def render_overlay(base, index, coverage, lut):
+    """Blend the palette-colored overlay onto an RGB base image in one pass
+
+    base is an (H, W, 3) uint8 array, index an (H, W) array of palette indices
+    and coverage an (H, W) uint8 array that scales each pixel's LUT alpha
+    (anti-aliased mask edges). The blend itself is a lookup into tables
+    precomputed from the LUT. Returns a new (H, W, 3) uint8 array.
+    """
+    tables = _blend_tables(lut)
+    key = (index.astype(np.uint32) << 16) | (coverage.astype(np.uint32) << 8)
+    result = np.empty(base.shape, dtype=np.uint8)
+    for channel in range(3):
+        result[..., channel] = np.take(tables[channel], key | base[..., channel])
+    return result
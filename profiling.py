@@ -0,0 +1,141 @@
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Set to 1 to record timing spans, or to a .json path to also choose where the trace is written
+PROFILE_ENV = "HAND_SEG_PROFILE"
+DEFAULT_TRACE_PATH = "hand_seg_trace.json"
+
+# Oldest spans are dropped beyond this many, so a long session cannot exhaust memory
+MAX_EVENTS = 200_000
+# Frames kept for the rolling frame-time statistics
+FRAME_WINDOW = 120
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "category", "start")
+
+    def __init__(self, profiler, name, category):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+
+    def __enter__(self):
+        self.profiler.local.depth = getattr(self.profiler.local, "depth", 0) + 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        end = time.perf_counter()
+        local = self.profiler.local
+        local.depth -= 1
+        self.profiler.add(self.name, self.category, self.start, end, top_level=local.depth == 0)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return None
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Profiler:
+    """Collects timing spans from any thread and writes them as a Chrome trace
+
+    A span that is not nested in another one on the Tk thread counts as a
+    frame: the time one event took before Tk could draw again.
+    frame_listener, if set, is called with (name, milliseconds) after each.
+    """
+
+    def __init__(self, max_events=MAX_EVENTS):
+        self.events = deque(maxlen=max_events)
+        self.frame_times = deque(maxlen=FRAME_WINDOW)
+        self.frame_listener = None
+        self.local = threading.local()
+        self.origin = time.perf_counter()
+        self.main_thread = threading.main_thread().ident
+        self.thread_names = {}
+
+    def span(self, name, category="app"):
+        return _Span(self, name, category)
+
+    def add(self, name, category, start, end, top_level=False):
+        thread = threading.get_ident()
+        if thread not in self.thread_names:
+            self.thread_names[thread] = threading.current_thread().name
+        self.events.append((name, category, start, end, thread))
+        if top_level and thread == self.main_thread:
+            milliseconds = (end - start) * 1000
+            self.frame_times.append(milliseconds)
+            if self.frame_listener is not None:
+                self.frame_listener(name, milliseconds)
+
+    def frame_stats(self):
+        """(average, maximum) frame time in ms over the last FRAME_WINDOW frames"""
+        if not self.frame_times:
+            return 0.0, 0.0
+        return sum(self.frame_times) / len(self.frame_times), max(self.frame_times)
+
+    def chrome_trace(self):
+        """The recorded spans as a Chrome trace-event dict (load it in chrome://tracing or Perfetto)"""
+        pid = os.getpid()
+        threads = {}
+        events = []
+        for name, category, start, end, thread in list(self.events):
+            events.append({
+                "name": name, "cat": category, "ph": "X", "pid": pid,
+                "tid": threads.setdefault(thread, len(threads)),
+                "ts": round((start - self.origin) * 1e6, 1), "dur": round((end - start) * 1e6, 1)
+            })
+        for thread, tid in threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                           "args": {"name": self.thread_names.get(thread, f"thread {tid}")}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, file_path):
+        with open(file_path, "w") as f:
+            json.dump(self.chrome_trace(), f, separators=(",", ":"))
+
+
+def trace_path():
+    """Where the trace is written on exit: the .json path given in PROFILE_ENV, else DEFAULT_TRACE_PATH"""
+    value = os.environ.get(PROFILE_ENV, "")
+    return value if value.endswith(".json") else DEFAULT_TRACE_PATH
+
+
+# The process-wide profiler, None unless PROFILE_ENV is set; with it unset the
+# helpers below cost a global lookup (span) or nothing at all (traced)
+PROFILER = Profiler() if os.environ.get(PROFILE_ENV, "0") not in ("", "0") else None
+
+if PROFILER is not None:
+    atexit.register(lambda: PROFILER.export_chrome_trace(trace_path()))
+
+
+def span(name, category="app"):
+    """Context manager timing a block; a shared no-op when profiling is off"""
+    if PROFILER is None:
+        return _NULL_SPAN
+    return PROFILER.span(name, category)
+
+
+def traced(function):
+    """Decorator timing every call of a function; returns it unchanged when profiling is off"""
+    if PROFILER is None:
+        return function
+    name = function.__qualname__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with PROFILER.span(name, "call"):
+            return function(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,242 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from annotation_core import encode_session
+
+# The journal of an image lives next to it as "<image name>_session.journal"
+JOURNAL_SUFFIX = "_session.journal"
+
+# Records appended after a checkpoint before the journal is compacted into a new one
+DEFAULT_CHECKPOINT_EVERY = 100
+# Records are flushed to the OS at once but fsynced at most this often (seconds) ...
+DEFAULT_SYNC_INTERVAL = 2.0
+# ... or after this many records, whichever comes first
+DEFAULT_SYNC_EVERY = 32
+
+# Journal op -> AnnotationModel method; each record holds that method's keyword arguments
+OPS = {
+    "person": "add_person",
+    "polygon": "add_polygon",
+    "curve": "add_curve",
+    "stroke": "paint_stroke",
+    "fill": "add_fill",
+    "edit_shape": "update_shape",
+    "delete_shape": "delete_shape",
+    "clear": "clear_finger",
+    "clear_all": "clear_all",
+    "bbox": "set_hand_bbox",
+    "undo": "undo",
+    "redo": "redo",
+}
+
+_ENCODER = json.JSONEncoder(separators=(",", ":"))
+
+
+def journal_path_for(image_path):
+    """Default journal file path next to an image"""
+    return os.path.splitext(image_path)[0] + JOURNAL_SUFFIX
+
+
+def apply_record(model, record):
+    """Re-run one journal record on a model"""
+    fields = dict(record)
+    getattr(model, OPS[fields.pop("op")])(**fields)
+
+
+class SessionJournal:
+    """Append-only, crash-safe log of the edits made to an AnnotationModel
+
+    The file is JSON lines: a checkpoint (a to_session() snapshot, whose
+    masks are packed bbox crops) followed by one record per edit holding
+    only its vector data (points, control points, boxes). Replaying the
+    records on the checkpoint rebuilds the annotations exactly, and the
+    undo history back to the checkpoint; like a saved session, the
+    checkpoint itself does not keep the history before it. Every
+    checkpoint_every records the file is rewritten as a single new
+    checkpoint, which bounds both its size and the resume time.
+
+    Automatic checkpoints only copy, on the calling thread, the masks
+    changed since the previous checkpoint (the others reuse its packed
+    crops); a worker packs and writes them while editing goes on, and the
+    records made meanwhile are appended to the new file before it replaces
+    the old one (at the next record, sync or close after it is written).
+
+    Records are flushed on every edit, so an application crash loses
+    nothing; fsync runs in batches (see sync_interval and sync_every). The
+    exception is a checkpoint forced by an undo or redo reaching back past
+    the previous one: until it is in place, a crash resumes without the
+    steps recorded since.
+
+        journal = SessionJournal.start(journal_path_for(image_path), model)
+        ...
+        model = AnnotationModel()
+        SessionJournal.resume(journal_path_for(image_path), model)
+    """
+
+    def __init__(self, path, model, checkpoint_every=DEFAULT_CHECKPOINT_EVERY,
+                 sync_interval=DEFAULT_SYNC_INTERVAL, sync_every=DEFAULT_SYNC_EVERY):
+        self.path = path
+        self.model = model
+        self.checkpoint_every = checkpoint_every
+        self.sync_interval = sync_interval
+        self.sync_every = sync_every
+        self.file = None
+        self.records = 0
+        # Undo/redo steps that can be replayed from the records after the checkpoint
+        self.undo_depth = 0
+        self.redo_depth = 0
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal")
+        # While a checkpoint is being written: its future, the lines recorded since its snapshot,
+        # and whether they also still replay correctly on the old file
+        self.checkpoint_future = None
+        self.pending = None
+        self.old_file_valid = True
+        # The masks packed by the last checkpoint, reused by the next one for fingers left untouched
+        self.packed_masks = {}
+
+    @classmethod
+    def start(cls, path, model, **kwargs):
+        """Begin a new journal from the model's current state and attach it to the model"""
+        journal = cls(path, model, **kwargs)
+        journal.checkpoint()
+        model.journal = journal
+        return journal
+
+    @classmethod
+    def resume(cls, path, model, **kwargs):
+        """Restore a model to the state recorded in a journal and keep appending to it
+
+        A record torn by a crash at the end of the file is dropped.
+        """
+        journal = cls(path, model, **kwargs)
+        model.journal = None
+        with open(path, "rb") as f:
+            checkpoint = json.loads(f.readline())
+            if checkpoint.get("op") != "checkpoint":
+                raise ValueError(f"Journal does not start with a checkpoint: {path}")
+            model.restore_session(checkpoint["session"])
+            end = f.tell()
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                record = json.loads(line)
+                apply_record(model, record)
+                journal._count(record["op"])
+                end += len(line)
+        os.truncate(path, end)
+        journal.file = open(path, "a")
+        model.journal = journal
+        return journal
+
+    def _count(self, op):
+        self.records += 1
+        if op == "undo":
+            self.undo_depth -= 1
+            self.redo_depth += 1
+        elif op == "redo":
+            self.redo_depth -= 1
+            self.undo_depth += 1
+        elif op != "person":
+            self.undo_depth += 1
+            self.redo_depth = 0
+
+    def record(self, op, **fields):
+        """Append an edit the model has just applied"""
+        self._finish_checkpoint()
+        reaches_back = (op == "undo" and not self.undo_depth) or (op == "redo" and not self.redo_depth)
+        fields["op"] = op
+        line = _ENCODER.encode(fields) + "\n"
+        if self.records >= self.checkpoint_every or reaches_back:
+            # The model has already applied the edit, so a checkpoint taken now replaces its record. The
+            # old file stays a valid journal until the new one is in place, unless the step reaches back
+            # before its checkpoint, where it cannot be replayed from it
+            if reaches_back:
+                line = None
+            self._begin_checkpoint()
+            self.old_file_valid = line is not None
+        else:
+            self._count(op)
+            if self.pending is not None:
+                self.pending.append(line)
+        if line is None or not self.old_file_valid:
+            return
+        self.file.write(line)
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def checkpoint(self):
+        """Replace the journal with a single checkpoint of the model's current state, waiting for it
+
+        The new file is written and fsynced beside the old one, then moved
+        over it, so a crash leaves one or the other intact.
+        """
+        self._begin_checkpoint()
+        self._finish_checkpoint(wait=True)
+
+    def _begin_checkpoint(self):
+        """Snapshot the model and start writing it as a new journal on the worker"""
+        # At most one checkpoint is in flight; a second one is only needed after many quick edits
+        self._finish_checkpoint(wait=True)
+        snapshot = self.model.session_snapshot(self.packed_masks)
+        self.pending = []
+        self.old_file_valid = True
+        self.records = 0
+        self.undo_depth = 0
+        self.redo_depth = 0
+        self.checkpoint_future = self.executor.submit(self._write_checkpoint, snapshot)
+
+    def _write_checkpoint(self, snapshot):
+        packed = {}
+        with open(self.path + ".tmp", "w") as f:
+            f.write(_ENCODER.encode({"op": "checkpoint", "session": encode_session(snapshot, packed)}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return packed
+
+    def _finish_checkpoint(self, wait=False):
+        """Move a written checkpoint, plus the records made since its snapshot, over the journal"""
+        future = self.checkpoint_future
+        if future is None or not (wait or future.done()):
+            return
+        self.checkpoint_future = None
+        pending, self.pending = self.pending, None
+        self.old_file_valid = True
+        self.packed_masks = future.result()
+        temp_path = self.path + ".tmp"
+        if pending:
+            with open(temp_path, "a") as f:
+                f.writelines(pending)
+                f.flush()
+                os.fsync(f.fileno())
+        if self.file is not None:
+            self.file.close()
+        os.replace(temp_path, self.path)
+        self.file = open(self.path, "a")
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def sync(self):
+        """fsync the records written since the last sync (and put a written checkpoint in place)"""
+        self._finish_checkpoint()
+        if self.unsynced and self.file is not None:
+            os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        """Sync and close the file, and detach the journal from its model"""
+        if self.file is None:
+            return
+        self._finish_checkpoint(wait=True)
+        self.executor.shutdown()
+        self.sync()
+        self.file.close()
+        self.file = None
+        if self.model.journal is self:
+            self.model.journal = None
@@ -0,0 +1,110 @@
+import numpy as np
+
+# Side of the square grid cells shapes are bucketed into, in original image pixels
+GRID_CELL = 128
+
+
+def point_in_polygon(points, x, y):
+    """Whether (x, y) is inside the polygon through an (n, 2) array of points (even-odd rule)"""
+    xs, ys = points[:, 0], points[:, 1]
+    next_xs, next_ys = np.roll(xs, -1), np.roll(ys, -1)
+    crosses = (ys > y) != (next_ys > y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        edge_x = xs + (y - ys) * (next_xs - xs) / (next_ys - ys)
+    return bool(np.count_nonzero(crosses & (x < edge_x)) % 2)
+
+
+def distance_to_polyline(points, x, y, closed=False):
+    """Shortest distance from (x, y) to the segments through an (n, 2) array of points"""
+    if closed:
+        points = np.concatenate([points, points[:1]])
+    if len(points) == 1:
+        return float(np.hypot(points[0, 0] - x, points[0, 1] - y))
+    starts, deltas = points[:-1], np.diff(points, axis=0)
+    lengths = (deltas ** 2).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.clip(((x - starts[:, 0]) * deltas[:, 0] + (y - starts[:, 1]) * deltas[:, 1]) / lengths, 0, 1)
+    t = np.where(lengths > 0, t, 0)
+    nearest = starts + deltas * t[:, None]
+    return float(np.hypot(nearest[:, 0] - x, nearest[:, 1] - y).min())
+
+
+def geometry_hit(geometry, x, y, tolerance=0):
+    """Exact test of a point against a ("polygon" | "polyline" | "box", ...) geometry tuple
+
+    Polygons are hit inside or within tolerance of their outline,
+    polylines within half their width plus tolerance of the line.
+    """
+    kind = geometry[0]
+    if kind == "box":
+        x0, y0, x1, y1 = geometry[1]
+        return x0 - tolerance <= x <= x1 + tolerance and y0 - tolerance <= y <= y1 + tolerance
+    points = geometry[1]
+    if kind == "polygon":
+        return point_in_polygon(points, x, y) or (
+            tolerance > 0 and distance_to_polyline(points, x, y, closed=True) <= tolerance)
+    return distance_to_polyline(points, x, y) <= geometry[2] / 2 + tolerance
+
+
+class ShapeIndex:
+    """Uniform grid over the bounding boxes of shapes, for hit tests that cost O(shapes nearby)
+
+    Every entry belongs to an owner (any hashable, e.g. a finger key) and
+    carries a target returned by hits, a bounding box (x0, y0, x1, y1) and
+    a geometry tuple for the exact test (see geometry_hit). Entries are
+    removed by owner, so a change re-indexes only the shapes of one owner.
+    """
+
+    def __init__(self, cell=GRID_CELL):
+        self.cell = cell
+        self.cells = {}
+        self.entries = {}
+        self.owners = {}
+        self.next_id = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _cells(self, box):
+        cell = self.cell
+        for cy in range(int(box[1]) // cell, int(box[3]) // cell + 1):
+            for cx in range(int(box[0]) // cell, int(box[2]) // cell + 1):
+                yield cx, cy
+
+    def add(self, owner, target, box, geometry):
+        entry_id = self.next_id
+        self.next_id += 1
+        self.entries[entry_id] = (target, box, geometry)
+        self.owners.setdefault(owner, []).append(entry_id)
+        for cell in self._cells(box):
+            self.cells.setdefault(cell, set()).add(entry_id)
+
+    def remove(self, owner):
+        """Drop every entry of owner"""
+        for entry_id in self.owners.pop(owner, ()):
+            _, box, _ = self.entries.pop(entry_id)
+            for cell in self._cells(box):
+                bucket = self.cells[cell]
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self.cells[cell]
+
+    def clear(self):
+        self.cells.clear()
+        self.entries.clear()
+        self.owners.clear()
+
+    def hits(self, x, y, tolerance=0):
+        """Targets of the entries under (x, y), smallest bounding box first, then most recently added"""
+        candidates = set()
+        for cell in self._cells((x - tolerance, y - tolerance, x + tolerance, y + tolerance)):
+            candidates |= self.cells.get(cell, set())
+        found = []
+        for entry_id in candidates:
+            target, (x0, y0, x1, y1), geometry = self.entries[entry_id]
+            if not (x0 - tolerance <= x <= x1 + tolerance and y0 - tolerance <= y <= y1 + tolerance):
+                continue
+            if geometry_hit(geometry, x, y, tolerance):
+                found.append(((x1 - x0) * (y1 - y0), -entry_id, target))
+        found.sort(key=lambda hit: hit[:2])
+        return [target for _, _, target in found]
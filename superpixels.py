@@ -0,0 +1,266 @@
+import hashlib
+import os
+from collections import deque
+
+import numpy as np
+from PIL import Image
+
+from image_prefetcher import load_display_image
+from profiling import traced
+
+# Superpixels are computed on a reduced copy of the image with at most this many pixels (the
+# work_pixels default). Fill edges follow that copy, so on a 24 MP image they step in ~5 px
+# blocks; SLIC time grows about linearly with it (~4 s at 1 MP, ~15 s at 4 MP for 24 MP)
+WORK_PIXELS = 1_000_000
+DEFAULT_SEGMENTS = 2500
+# SLIC compactness: higher values give rounder, more grid-like superpixels
+DEFAULT_COMPACTNESS = 10.0
+SLIC_ITERATIONS = 6
+# Rows assigned per pass, which bounds the temporary arrays of an iteration
+SLIC_CHUNK_ROWS = 128
+
+# Computed label maps are kept here as "<hash>.npz", the hash covering the image bytes and the parameters
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "hand_segmentation", "superpixels")
+CACHE_VERSION = 1
+# Least recently used label maps are deleted once the cache grows past this
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+_SRGB_TO_XYZ = np.array([
+    [0.412453, 0.357580, 0.180423],
+    [0.212671, 0.715160, 0.072169],
+    [0.019334, 0.119193, 0.950227],
+], dtype=np.float32)
+_D65_WHITE = np.array([0.950456, 1.0, 1.088754], dtype=np.float32)
+
+
+def rgb_to_lab(rgb):
+    """CIE L*a*b* (D65) of a uint8 RGB array, as float32"""
+    linear = rgb.astype(np.float32) / 255
+    linear = np.where(linear > 0.04045, ((linear + 0.055) / 1.055) ** 2.4, linear / 12.92)
+    xyz = linear @ _SRGB_TO_XYZ.T / _D65_WHITE
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16 / 116)
+    return np.stack([116 * f[..., 1] - 16, 500 * (f[..., 0] - f[..., 1]), 200 * (f[..., 1] - f[..., 2])], axis=-1)
+
+
+@traced
+def slic(lab, n_segments=DEFAULT_SEGMENTS, compactness=DEFAULT_COMPACTNESS, iterations=SLIC_ITERATIONS):
+    """SLIC superpixels of a Lab image, returns an int32 label map numbered from 0 without gaps
+
+    Centres start on a regular grid; every pixel is compared with the
+    centres of the 3x3 grid cells around its own, so an iteration is a few
+    vectorized passes over the image.
+    """
+    height, width = lab.shape[:2]
+    step = max(2, int(round(np.sqrt(height * width / n_segments))))
+    rows, cols = max(1, height // step), max(1, width // step)
+    grid_y = (np.arange(rows) * step + step // 2).clip(0, height - 1)
+    grid_x = (np.arange(cols) * step + step // 2).clip(0, width - 1)
+    center_y = np.repeat(grid_y, cols).astype(np.float32)
+    center_x = np.tile(grid_x, rows).astype(np.float32)
+    center_lab = lab[center_y.astype(int), center_x.astype(int)]
+    cell_y = np.minimum(np.arange(height) // step, rows - 1)
+    cell_x = np.minimum(np.arange(width) // step, cols - 1)
+    xs = np.arange(width, dtype=np.float32)
+    weight = np.float32((compactness / step) ** 2)
+    labels = np.empty((height, width), dtype=np.int32)
+    all_ys, all_xs = np.divmod(np.arange(height * width), width)
+
+    for _ in range(iterations):
+        for y0 in range(0, height, SLIC_CHUNK_ROWS):
+            y1 = min(height, y0 + SLIC_CHUNK_ROWS)
+            pixels = lab[y0:y1]
+            ys = np.arange(y0, y1, dtype=np.float32)[:, None]
+            best = np.full((y1 - y0, width), np.inf, dtype=np.float32)
+            best_label = labels[y0:y1]
+            for dy in (-1, 0, 1):
+                candidate_rows = np.clip(cell_y[y0:y1] + dy, 0, rows - 1) * cols
+                for dx in (-1, 0, 1):
+                    candidate = candidate_rows[:, None] + np.clip(cell_x + dx, 0, cols - 1)[None, :]
+                    distance = ((pixels - center_lab[candidate]) ** 2).sum(axis=-1)
+                    distance += weight * ((xs - center_x[candidate]) ** 2 + (ys - center_y[candidate]) ** 2)
+                    better = distance < best
+                    best[better] = distance[better]
+                    best_label[better] = candidate[better]
+        flat = labels.ravel()
+        counts = np.bincount(flat, minlength=rows * cols)
+        filled = counts > 0
+        for channel in range(3):
+            sums = np.bincount(flat, weights=lab[..., channel].ravel(), minlength=rows * cols)
+            center_lab[filled, channel] = sums[filled] / counts[filled]
+        center_y[filled] = (np.bincount(flat, weights=all_ys, minlength=rows * cols)[filled] / counts[filled])
+        center_x[filled] = (np.bincount(flat, weights=all_xs, minlength=rows * cols)[filled] / counts[filled])
+
+    # Renumber without the labels no pixel ended up in
+    _, labels = np.unique(labels, return_inverse=True)
+    return labels.reshape(height, width).astype(np.int32)
+
+
+class SuperpixelIndex:
+    """Superpixel label map of an image with per-region pixel lists, for O(region) lookups
+
+    The labels are computed on a reduced copy of the image; region_mask()
+    scales a selection back to original image pixels. The pixel lists are
+    stored CSR-style: the flat pixel indices of region r are
+    order[offsets[r]:offsets[r + 1]]. Regions also know their mean Lab
+    colour and their neighbours, so similar adjacent regions can be grown
+    without touching any pixels.
+    """
+
+    def __init__(self, labels, colors, original_size):
+        self.labels = labels
+        self.colors = colors
+        # Plain ints, so the boxes built from it can be written to JSON
+        self.original_size = tuple(int(v) for v in original_size)
+        height, width = labels.shape
+        self.scale = (original_size[0] / width, original_size[1] / height)
+        flat = labels.ravel()
+        count = int(flat.max()) + 1
+        self.order = np.argsort(flat, kind="stable").astype(np.int32)
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(flat, minlength=count))])
+        # Region boxes (x0, y0, x1, y1) in label map pixels
+        ys, xs = np.divmod(self.order, width)
+        starts = self.offsets[:-1]
+        self.boxes = np.stack([
+            np.minimum.reduceat(xs, starts), np.minimum.reduceat(ys, starts),
+            np.maximum.reduceat(xs, starts) + 1, np.maximum.reduceat(ys, starts) + 1
+        ], axis=1)
+        # Region adjacency, CSR-style like the pixel lists
+        pairs = np.concatenate([
+            np.stack([labels[:, :-1].ravel(), labels[:, 1:].ravel()], axis=1),
+            np.stack([labels[:-1].ravel(), labels[1:].ravel()], axis=1),
+        ])
+        pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+        pairs = np.unique(np.concatenate([pairs, pairs[:, ::-1]]), axis=0)
+        self.neighbors = pairs[:, 1]
+        self.neighbor_offsets = np.concatenate([[0], np.cumsum(np.bincount(pairs[:, 0], minlength=count))])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def region_at(self, x, y):
+        """Label of the superpixel under original image pixel (x, y), or None outside the image"""
+        if not (0 <= x < self.original_size[0] and 0 <= y < self.original_size[1]):
+            return None
+        height, width = self.labels.shape
+        return int(self.labels[min(int(y / self.scale[1]), height - 1), min(int(x / self.scale[0]), width - 1)])
+
+    def similar_regions(self, label, tolerance=0.0):
+        """label plus the connected neighbours whose mean colour is within tolerance (Lab units) of it"""
+        if tolerance <= 0:
+            return [label]
+        seed = self.colors[label]
+        selected = {label}
+        queue = deque([label])
+        while queue:
+            region = queue.popleft()
+            for neighbor in self.neighbors[self.neighbor_offsets[region]:self.neighbor_offsets[region + 1]]:
+                neighbor = int(neighbor)
+                if neighbor not in selected and np.linalg.norm(self.colors[neighbor] - seed) <= tolerance:
+                    selected.add(neighbor)
+                    queue.append(neighbor)
+        return sorted(selected)
+
+    def region_mask(self, regions):
+        """Union of regions in original image pixels as ((x0, y0, x1, y1), bool crop)
+
+        Only the listed regions' pixels are read; an original pixel belongs
+        to the label map pixel it falls in, as in region_at().
+        """
+        width = self.labels.shape[1]
+        boxes = self.boxes[regions]
+        x0, y0 = int(boxes[:, 0].min()), int(boxes[:, 1].min())
+        x1, y1 = int(boxes[:, 2].max()), int(boxes[:, 3].max())
+        pixels = np.concatenate([self.order[self.offsets[r]:self.offsets[r + 1]] for r in regions])
+        ys, xs = np.divmod(pixels, width)
+        crop = np.zeros((y1 - y0, x1 - x0), dtype=bool)
+        crop[ys - y0, xs - x0] = True
+        scale_x, scale_y = self.scale
+        box = (int(np.ceil(x0 * scale_x)), int(np.ceil(y0 * scale_y)),
+               int(min(self.original_size[0], np.ceil(x1 * scale_x))),
+               int(min(self.original_size[1], np.ceil(y1 * scale_y))))
+        rows = np.minimum((np.arange(box[1], box[3]) / scale_y).astype(int), self.labels.shape[0] - 1) - y0
+        cols = np.minimum((np.arange(box[0], box[2]) / scale_x).astype(int), width - 1) - x0
+        return box, crop[rows[:, None], cols[None, :]]
+
+
+def image_hash(path, *parameters):
+    """Hex digest of an image file's bytes plus the parameters it is processed with"""
+    digest = hashlib.sha1(repr((CACHE_VERSION,) + parameters).encode())
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@traced
+def compute_superpixels(path, n_segments=DEFAULT_SEGMENTS, compactness=DEFAULT_COMPACTNESS, work_pixels=WORK_PIXELS):
+    """(labels, mean Lab colours, original size) of an image's superpixels, found on at most work_pixels"""
+    with Image.open(path) as image:
+        width, height = image.size
+    scale = min(1.0, np.sqrt(work_pixels / (width * height)))
+    loaded = load_display_image(path, (max(1, int(width * scale)), max(1, int(height * scale))))
+    lab = rgb_to_lab(np.asarray(loaded.display))
+    labels = slic(lab, n_segments, compactness)
+    counts = np.bincount(labels.ravel())
+    colors = np.stack([
+        np.bincount(labels.ravel(), weights=lab[..., channel].ravel()) / counts for channel in range(3)
+    ], axis=1).astype(np.float32)
+    return labels, colors, loaded.original_size
+
+
+def prune_cache(cache_dir, max_bytes=CACHE_MAX_BYTES):
+    """Delete the least recently used label maps of a cache directory until it fits in max_bytes"""
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".npz") or name.endswith(".tmp.npz"):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+@traced
+def load_superpixels(path, n_segments=DEFAULT_SEGMENTS, compactness=DEFAULT_COMPACTNESS, cache_dir=CACHE_DIR,
+                     work_pixels=WORK_PIXELS, max_cache_bytes=CACHE_MAX_BYTES):
+    """SuperpixelIndex of an image, from the disk cache or computed (and cached) if missing
+
+    Meant to run on a worker thread: computing takes seconds, a cache hit
+    a fraction of that. A hit marks the entry as recently used, a write
+    prunes the cache to max_cache_bytes. A cache that cannot be written is
+    skipped.
+    """
+    cache_path = os.path.join(cache_dir, image_hash(path, n_segments, compactness, work_pixels) + ".npz")
+    try:
+        with np.load(cache_path) as cached:
+            index = SuperpixelIndex(cached["labels"].astype(np.int32), cached["colors"], tuple(int(v) for v in cached["size"]))
+    except (OSError, KeyError, ValueError):
+        index = None
+    if index is not None:
+        try:
+            os.utime(cache_path)
+        except OSError:
+            pass
+        return index
+    labels, colors, original_size = compute_superpixels(path, n_segments, compactness, work_pixels)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_path = cache_path + ".tmp.npz"
+        dtype = np.uint16 if labels.max() < np.iinfo(np.uint16).max else np.int32
+        np.savez_compressed(temp_path, labels=labels.astype(dtype), colors=colors, size=np.array(original_size))
+        os.replace(temp_path, cache_path)
+        prune_cache(cache_dir, max_cache_bytes)
+    except OSError:
+        pass
+    return SuperpixelIndex(labels, colors, original_size)
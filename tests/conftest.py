@@ -0,0 +1,31 @@
+import os
+import sys
+
+import numpy as np
+
+# The modules under test live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# A finger and two overlapping squares with an eraser path through their overlap,
+# for tests that depend on the order shapes were drawn in
+KEY = ("1", "left", "thumb")
+SQUARE_A = [(20, 20), (120, 20), (120, 120), (20, 120)]
+SQUARE_B = [(60, 60), (160, 60), (160, 160), (60, 160)]
+ERASE_PATH = [(40, 90), (140, 90)]
+
+
+def finger_mask(model, key=KEY):
+    """Full-image bool mask of one finger of an AnnotationModel"""
+    snapshot = model.mask_store.snapshot(key)
+    full = np.zeros(model.image_size[::-1], dtype=bool)
+    if snapshot is not None:
+        (x0, y0, x1, y1), crop = snapshot
+        full[y0:y1, x0:x1] = crop
+    return full
+
+
+def draw_erase_then_draw(model):
+    """Draw SQUARE_A, erase along ERASE_PATH, then draw SQUARE_B over the cut"""
+    model.add_polygon(*KEY, SQUARE_A)
+    model.paint_stroke(*KEY, ERASE_PATH, radius=6, erase=True)
+    model.add_polygon(*KEY, SQUARE_B)
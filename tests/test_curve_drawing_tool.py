@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from curve_drawing_tool import CurveDrawingTool
+
+
+def reference_curve(control_points, tension, steps):
+    """The original one-point-at-a-time Catmull-Rom evaluation the tool must reproduce exactly"""
+    curve_points = []
+    if len(control_points) < 2:
+        return list(control_points)
+    for i in range(len(control_points) - 1):
+        p0 = control_points[i]
+        p1 = control_points[i + 1]
+        if i > 0:
+            p_prev = control_points[i - 1]
+        else:
+            p_prev = (p0[0] - (p1[0] - p0[0]), p0[1] - (p1[1] - p0[1]))
+        if i < len(control_points) - 2:
+            p_next = control_points[i + 2]
+        else:
+            p_next = (p1[0] + (p1[0] - p0[0]), p1[1] + (p1[1] - p0[1]))
+        t0 = (p1[0] - p_prev[0], p1[1] - p_prev[1])
+        t1 = (p_next[0] - p0[0], p_next[1] - p0[1])
+        t0 = (t0[0] * tension, t0[1] * tension)
+        t1 = (t1[0] * tension, t1[1] * tension)
+        for step in range(steps + 1):
+            t = step / steps
+            h1 = 2*t**3 - 3*t**2 + 1
+            h2 = -2*t**3 + 3*t**2
+            h3 = t**3 - 2*t**2 + t
+            h4 = t**3 - t**2
+            x = h1 * p0[0] + h2 * p1[0] + h3 * t0[0] + h4 * t1[0]
+            y = h1 * p0[1] + h2 * p1[1] + h3 * t0[1] + h4 * t1[1]
+            curve_points.append((int(x), int(y)))
+    return curve_points
+
+
+def test_matches_the_reference_where_vectorized_powers_round_differently():
+    # Evaluating t**3 with NumPy put one point of this curve 1px off the reference
+    control_points = [(898, 3797), (2978, 172), (3906, 3391)]
+    tool = CurveDrawingTool()
+    for point in control_points:
+        tool.add_control_point(point)
+    assert tool.curve_points == reference_curve(control_points, tool.tension, tool.steps)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_incremental_edits_match_a_full_recompute_and_the_reference(seed):
+    rng = np.random.default_rng(seed)
+    tool = CurveDrawingTool()
+    tool.steps = int(rng.integers(5, 60))
+    tool.tension = float(rng.random())
+
+    def random_point():
+        return tuple(int(v) for v in rng.integers(-50, 6000, 2))
+
+    for _ in range(int(rng.integers(2, 12))):
+        tool.add_control_point(random_point())
+    for _ in range(40):
+        edit = rng.integers(0, 3)
+        index = int(rng.integers(0, len(tool.control_points)))
+        if edit == 0:
+            tool.add_control_point(random_point())
+        elif edit == 1:
+            tool.update_control_point(index, random_point())
+        elif len(tool.control_points) > 2:
+            tool.remove_control_point(index)
+
+        incremental = tool.curve_points
+        full = CurveDrawingTool()
+        full.steps, full.tension = tool.steps, tool.tension
+        full.control_points = list(tool.control_points)
+        full._update_curve()
+        assert incremental == full.curve_points
+        assert incremental == reference_curve(tool.control_points, tool.tension, tool.steps)
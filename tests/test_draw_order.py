@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from annotation_core import AnnotationModel
+from conftest import KEY, draw_erase_then_draw, finger_mask
+from mask_store import MASK_STORES
+
+
+@pytest.mark.parametrize("store", sorted(MASK_STORES))
+def test_rasterize_replays_erase_then_draw_in_order(store):
+    model = AnnotationModel(mask_store=store)
+    model.set_image("synthetic.jpg", (200, 200))
+    draw_erase_then_draw(model)
+    drawn = finger_mask(model)
+    # The eraser cut A, B was drawn over the cut afterwards
+    assert not drawn[90, 40] and drawn[90, 100]
+
+    model.rasterize()
+    assert np.array_equal(finger_mask(model), drawn)
+
+    restored = AnnotationModel(mask_store=store)
+    restored.restore_session(model.to_session(), rasterize=True)
+    assert np.array_equal(finger_mask(restored), drawn)
+
+
+def test_undo_and_redo_keep_the_draw_order():
+    model = AnnotationModel()
+    model.set_image("synthetic.jpg", (200, 200))
+    draw_erase_then_draw(model)
+    drawn = finger_mask(model)
+    model.undo()
+    model.undo()
+    model.redo()
+    model.redo()
+    assert model.masks["1"]["left"]["thumb"]["order"] == [["polygon", 0], ["stroke", 0], ["polygon", 1]]
+    model.rasterize()
+    assert np.array_equal(finger_mask(model), drawn)
+
+
+def test_session_without_order_replays_strokes_last():
+    model = AnnotationModel()
+    model.set_image("synthetic.jpg", (200, 200))
+    draw_erase_then_draw(model)
+    session = model.to_session()
+    del session["masks"]["1"]["left"]["thumb"]["order"]
+    restored = AnnotationModel()
+    restored.restore_session(session, rasterize=True)
+    assert restored.masks["1"]["left"]["thumb"]["order"] == [["polygon", 0], ["polygon", 1], ["stroke", 0]]
+    assert not finger_mask(restored)[90, 100]
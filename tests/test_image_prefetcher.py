@@ -0,0 +1,28 @@
+import threading
+
+from image_prefetcher import ImagePrefetcher, LoadedImage
+
+
+def test_cancelling_queued_prefetches_does_not_deadlock():
+    release = threading.Event()
+
+    def loader(path, canvas_size):
+        release.wait(5)
+        return LoadedImage(path, (1, 1), None, canvas_size)
+
+    prefetcher = ImagePrefetcher(max_workers=1, cache_size=4, loader=loader)
+    # "a" occupies the only worker, so "b" and "c" stay queued and are cancelled by the next prefetch
+    prefetcher.prefetch(["a", "b", "c"], (800, 600))
+    done = threading.Event()
+
+    def page_on():
+        prefetcher.prefetch(["d"], (800, 600))
+        done.set()
+
+    thread = threading.Thread(target=page_on, daemon=True)
+    thread.start()
+    assert done.wait(2), "prefetch() deadlocked while cancelling queued loads"
+    release.set()
+    assert prefetcher.get("d", (800, 600)).path == "d"
+    assert "b" not in prefetcher.pending and "c" not in prefetcher.pending
+    prefetcher.shutdown()
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from image_pyramid import ImagePyramid
+
+
+@pytest.mark.parametrize("size", [(6001, 3999), (257, 100), (100, 50)])
+def test_lazy_levels_match_the_precomputed_sizes(size):
+    pyramid = ImagePyramid(Image.new("RGB", size))
+    assert len(pyramid.levels) == 1
+    pyramid.build_levels()
+    assert [level.size for level in pyramid.levels] == pyramid.level_sizes
+
+
+def test_render_only_reduces_the_levels_it_needs():
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 256, (1000, 1500, 3), dtype=np.uint8))
+    pyramid = ImagePyramid(image)
+    rendered = pyramid.render((0, 0, 600, 400), (300, 200))
+    assert len(pyramid.levels) == 2
+    assert rendered.size == (300, 200)
+    assert np.array_equal(np.asarray(pyramid.get_tile(1, 0, 0)), np.asarray(image.reduce(2).crop((0, 0, 256, 256))))
+
+
+def test_tile_cache_is_bounded_in_bytes():
+    pyramid = ImagePyramid(Image.new("RGB", (2048, 2048)), max_bytes=4 * 256 * 256 * 3)
+    for tile_y in range(8):
+        for tile_x in range(8):
+            pyramid.get_tile(0, tile_x, tile_y)
+    assert len(pyramid.tiles) == 4
+    assert pyramid.tile_bytes == 4 * 256 * 256 * 3
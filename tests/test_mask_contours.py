@@ -0,0 +1,43 @@
+import numpy as np
+
+from annotation_core import AnnotationModel
+from mask_contours import mask_to_polygons, trace_mask
+
+
+def test_thin_line_and_single_pixel_keep_a_polygon():
+    line = np.zeros((5, 60), dtype=bool)
+    line[2, 5:55] = True
+    assert mask_to_polygons(line, (10, 20)) == [[15.0, 22.0, 65.0, 22.0, 65.0, 23.0, 15.0, 23.0]]
+
+    pixel = np.zeros((3, 3), dtype=bool)
+    pixel[1, 1] = True
+    assert mask_to_polygons(pixel, (0, 0)) == [[1.0, 1.0, 2.0, 1.0, 2.0, 2.0, 1.0, 2.0]]
+
+
+def test_square_is_simplified_to_its_corners():
+    square = np.zeros((30, 30), dtype=bool)
+    square[5:25, 5:25] = True
+    assert mask_to_polygons(square, (0, 0)) == [[5.0, 5.0, 25.0, 5.0, 25.0, 25.0, 5.0, 25.0]]
+
+
+def test_trace_mask_reports_holes():
+    ring = np.zeros((30, 30), dtype=bool)
+    ring[5:25, 5:25] = True
+    assert trace_mask(ring, (0, 0)) == ([[5.0, 5.0, 25.0, 5.0, 25.0, 25.0, 5.0, 25.0]], False)
+    ring[10:20, 10:20] = False
+    polygons, has_holes = trace_mask(ring, (0, 0))
+    assert has_holes and polygons == [[5.0, 5.0, 25.0, 5.0, 25.0, 25.0, 5.0, 25.0]]
+
+
+def test_finger_with_an_erased_interior_is_exported_as_rle():
+    model = AnnotationModel()
+    model.set_image("synthetic.jpg", (200, 200))
+    model.add_polygon("1", "left", "thumb", [(20, 20), (120, 20), (120, 120), (20, 120)])
+    model.paint_stroke("1", "left", "thumb", [(60, 70)], radius=10, erase=True)
+    model.add_polygon("1", "left", "index", [(140, 140), (190, 140), (190, 190)])
+    model.paint_stroke("1", "left", "index", [(180, 150)], radius=3)
+
+    thumb, index = list(model.iter_annotations("polygon"))
+    assert isinstance(thumb["segmentation"], dict)
+    assert thumb["area"] == float(np.count_nonzero(model.mask_store.get_crop(("1", "left", "thumb"))[1]))
+    assert isinstance(index["segmentation"], list)
@@ -0,0 +1,37 @@
+import numpy as np
+
+from annotation_core import AnnotationModel
+from conftest import KEY, draw_erase_then_draw, finger_mask
+
+
+def erase_between_two_squares():
+    model = AnnotationModel()
+    model.set_image("synthetic.jpg", (200, 200))
+    draw_erase_then_draw(model)
+    return model
+
+
+def test_unchanged_edit_keeps_pixels_drawn_after_an_erase():
+    model = erase_between_two_squares()
+    drawn = finger_mask(model)
+    polygon = model.masks["1"]["left"]["thumb"]["polygons"][0]
+    model.update_shape(*KEY, "polygon", 0, list(polygon))
+    assert np.array_equal(finger_mask(model), drawn)
+
+
+def test_delete_then_undo_and_redo():
+    model = erase_between_two_squares()
+    drawn = finger_mask(model)
+    model.delete_shape(*KEY, "polygon", 0)
+    deleted = finger_mask(model)
+    # B and its pixels over the erased band survive, A's own corner is gone
+    assert deleted[90, 100] and not deleted[30, 30]
+    assert model.masks["1"]["left"]["thumb"]["order"] == [["stroke", 0], ["polygon", 0]]
+
+    model.undo()
+    assert np.array_equal(finger_mask(model), drawn)
+    assert model.masks["1"]["left"]["thumb"]["order"] == [["polygon", 0], ["stroke", 0], ["polygon", 1]]
+    model.redo()
+    assert np.array_equal(finger_mask(model), deleted)
+    model.rasterize()
+    assert np.array_equal(finger_mask(model), deleted)
@@ -0,0 +1,62 @@
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+from annotation_core import AnnotationModel, encode_mask
+from superpixels import DEFAULT_COMPACTNESS, WORK_PIXELS, image_hash, load_superpixels
+
+
+def test_cached_index_gives_json_ready_fills(tmp_path):
+    rng = np.random.default_rng(0)
+    path = str(tmp_path / "image.png")
+    Image.fromarray((rng.random((48, 64, 3)) * 255).astype(np.uint8)).save(path)
+    cache_dir = str(tmp_path / "cache")
+
+    computed = load_superpixels(path, n_segments=20, cache_dir=cache_dir)
+    cached = load_superpixels(path, n_segments=20, cache_dir=cache_dir)
+    assert cached.original_size == (64, 48)
+    assert all(type(v) is int for v in cached.original_size)
+
+    regions = cached.similar_regions(cached.region_at(63, 47))
+    box, crop = cached.region_mask(regions)
+    assert all(type(v) is int for v in box)
+    assert box == computed.region_mask(regions)[0]
+
+    model = AnnotationModel()
+    model.set_image(path, cached.original_size)
+    model.add_fill("1", "left", "palm", encode_mask(box, crop))
+    json.dumps(model.to_session())
+
+
+def test_work_pixels_sets_the_label_map_size(tmp_path):
+    path = str(tmp_path / "image.png")
+    Image.new("RGB", (400, 300), (90, 120, 200)).save(path)
+    cache_dir = str(tmp_path / "cache")
+
+    coarse = load_superpixels(path, n_segments=20, cache_dir=cache_dir, work_pixels=3_000)
+    fine = load_superpixels(path, n_segments=20, cache_dir=cache_dir, work_pixels=30_000)
+    assert coarse.labels.size <= 3_000 < fine.labels.size <= 30_000
+    assert coarse.original_size == fine.original_size == (400, 300)
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_cache_drops_the_least_recently_used_entries(tmp_path):
+    rng = np.random.default_rng(0)
+    cache_dir = str(tmp_path / "cache")
+    paths, entries = [], []
+    for i in range(3):
+        paths.append(str(tmp_path / f"image{i}.png"))
+        Image.fromarray((rng.random((48, 64, 3)) * 255).astype(np.uint8)).save(paths[-1])
+        entries.append(os.path.join(cache_dir, image_hash(paths[-1], 20, DEFAULT_COMPACTNESS, WORK_PIXELS) + ".npz"))
+
+    load_superpixels(paths[0], n_segments=20, cache_dir=cache_dir)
+    load_superpixels(paths[1], n_segments=20, cache_dir=cache_dir)
+    cap = int(os.path.getsize(entries[0]) * 2.5)
+    os.utime(entries[0], (0, 0))
+    os.utime(entries[1], (1, 1))
+    # A hit makes the first image the most recently used, so the second one is dropped for the third
+    load_superpixels(paths[0], n_segments=20, cache_dir=cache_dir, max_cache_bytes=cap)
+    load_superpixels(paths[2], n_segments=20, cache_dir=cache_dir, max_cache_bytes=cap)
+    assert [os.path.exists(entry) for entry in entries] == [True, False, True]
@@ -0,0 +1,145 @@
+import hashlib
+import time
+
+import numpy as np
+import pytest
+
+from annotation_core import FINGER_NAMES, AnnotationModel
+from mask_store import MASK_STORES, create_mask_store
+import undo_history
+from undo_history import UndoHistory, pack_snapshot
+
+ACTIONS = 500
+# Every single undo must finish within this many seconds, however long the history is
+UNDO_LATENCY_BOUND = 0.05
+IMAGE_SIZE = (1600, 1200)
+KEY = ("1", "left", "thumb")
+
+
+def digest(store):
+    snapshot = store.snapshot(KEY)
+    return None if snapshot is None else (tuple(snapshot[0]), hashlib.sha1(snapshot[1].tobytes()).digest())
+
+
+def draw(store, history, points):
+    """Draw a polygon the way the tool commits one: keep what its region held before"""
+    xs = [point[0] for point in points]
+    ys = [point[1] for point in points]
+    region = (min(xs), min(ys), max(xs) + 1, max(ys) + 1)
+    before = pack_snapshot(store.snapshot_region(KEY, region))
+    store.draw_polygon(KEY, points)
+    history.append({"type": "polygon", "region": region, "before": before})
+
+
+def undo(store, history):
+    action = history.pop()
+    action["after"] = pack_snapshot(store.snapshot_region(KEY, action["region"]))
+    store.restore_region(KEY, history.unpack(action["before"]))
+    history.push_redo(action)
+
+
+def redo(store, history):
+    action = history.pop_redo()
+    store.restore_region(KEY, history.take(action, "after"))
+    history.push(action)
+
+
+@pytest.mark.parametrize("memory_budget", [64 * 1024 * 1024, 16 * 1024], ids=["in-memory", "spilled"])
+@pytest.mark.parametrize("kind", sorted(MASK_STORES))
+def test_500_region_undos_stay_fast_and_restore_the_mask(kind, memory_budget):
+    rng = np.random.default_rng(0)
+    store = create_mask_store(kind, IMAGE_SIZE, ["thumb"])
+    store.add_person("1")
+    history = UndoHistory(memory_budget)
+    states = [digest(store)]
+    for _ in range(ACTIONS):
+        x, y = int(rng.integers(0, 1450)), int(rng.integers(0, 1050))
+        triangle = [(x, y), (x + int(rng.integers(20, 150)), y + 10), (x + 40, y + int(rng.integers(20, 150))), (x, y)]
+        draw(store, history, triangle)
+        states.append(digest(store))
+
+    for expected in reversed(states[:-1]):
+        start = time.perf_counter()
+        undo(store, history)
+        assert time.perf_counter() - start < UNDO_LATENCY_BOUND
+        assert digest(store) == expected
+    assert len(history) == 0
+
+    while history.can_redo:
+        redo(store, history)
+    assert digest(store) == states[-1]
+
+
+def snapshots(model):
+    """Box and pixel digest of every finger mask, for comparing states"""
+    state = {}
+    for hand in ("left", "right"):
+        for finger in FINGER_NAMES:
+            snapshot = model.mask_store.snapshot(("1", hand, finger))
+            state[hand, finger] = None if snapshot is None else (
+                tuple(snapshot[0]), hashlib.sha1(snapshot[1].tobytes()).digest())
+    return state
+
+
+@pytest.mark.parametrize("memory_budget", [64 * 1024 * 1024, 16 * 1024], ids=["in-memory", "spilled"])
+def test_500_undos_stay_fast_and_restore_the_masks(memory_budget):
+    rng = np.random.default_rng(0)
+    model = AnnotationModel(undo_memory_budget=memory_budget)
+    model.set_image("synthetic.jpg", IMAGE_SIZE)
+    states = [snapshots(model)]
+    for index in range(ACTIONS):
+        x, y = int(rng.integers(0, 1450)), int(rng.integers(0, 1050))
+        triangle = [(x, y), (x + int(rng.integers(20, 150)), y + 10), (x + 40, y + int(rng.integers(20, 150)))]
+        model.add_polygon("1", ("left", "right")[index % 2], FINGER_NAMES[index % len(FINGER_NAMES)], triangle)
+        states.append(snapshots(model))
+
+    for expected in reversed(states[:-1]):
+        start = time.perf_counter()
+        assert model.undo() is not None
+        assert time.perf_counter() - start < UNDO_LATENCY_BOUND
+        assert snapshots(model) == expected
+
+    assert model.undo() is None
+    for hand in ("left", "right"):
+        for finger in FINGER_NAMES:
+            assert model.masks["1"][hand][finger]["polygons"] == []
+
+
+def test_spill_file_is_truncated_once_unreferenced():
+    model = AnnotationModel(undo_memory_budget=4096)
+    model.set_image("synthetic.jpg", IMAGE_SIZE)
+    for index in range(100):
+        model.add_polygon("1", "left", "thumb", [(index * 12, 0), (index * 12 + 300, 50), (index * 12, 300)])
+    history = model.action_history
+    assert history.spilled_bytes > 0
+    while model.undo() is not None:
+        pass
+    model.add_polygon("1", "left", "thumb", [(0, 0), (50, 0), (0, 50)])
+    history.spill_file.seek(0, 2)
+    assert history.spill_file.tell() == 0
+
+
+def test_spill_file_is_compacted_when_mostly_dead(monkeypatch):
+    monkeypatch.setattr(undo_history, "SPILL_COMPACT_MIN", 0)
+    rng = np.random.default_rng(1)
+    model = AnnotationModel(undo_memory_budget=16 * 1024)
+    model.set_image("synthetic.jpg", IMAGE_SIZE)
+    history = model.action_history
+    states = [snapshots(model)]
+    for _ in range(30):
+        # Draw a burst, then abandon most of it: the undone actions' spilled data dies
+        for index in range(20):
+            x, y = int(rng.integers(0, 1300)), int(rng.integers(0, 900))
+            model.add_polygon("1", ("left", "right")[index % 2], FINGER_NAMES[index % len(FINGER_NAMES)],
+                              [(x, y), (x + 250, y + 20), (x + 60, y + 250)])
+            states.append(snapshots(model))
+        for _ in range(15):
+            model.undo()
+            states.pop()
+        history.spill_file.seek(0, 2)
+        assert history.spill_file.tell() <= 2 * history.spilled_bytes
+
+    # The moved data still restores every state
+    for expected in reversed(states[:-1]):
+        model.undo()
+        assert snapshots(model) == expected
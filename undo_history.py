@@ -0,0 +1,217 @@
+import tempfile
+import zlib
+
+import numpy as np
+
+# Default memory allowed for mask snapshots held in the undo history
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024
+
+# The spill file is rewritten with only its live data once this share of it (and at least
+# SPILL_COMPACT_MIN bytes) is no longer referenced
+SPILL_COMPACT_FRACTION = 0.5
+SPILL_COMPACT_MIN = 1024 * 1024
+
+
+class PackedMask:
+    """A bbox-cropped binary mask, bit-packed and deflated, either in memory or spilled to disk"""
+
+    __slots__ = ("box", "data", "spill_offset", "spill_length")
+
+    def __init__(self, box, data):
+        self.box = box
+        self.data = data
+        self.spill_offset = None
+        self.spill_length = None
+
+    @property
+    def nbytes(self):
+        return len(self.data) if self.data is not None else 0
+
+
+def pack_snapshot(snapshot):
+    """Compress a mask store snapshot (box, bool crop) into a PackedMask; None stays None"""
+    if snapshot is None:
+        return None
+    box, crop = snapshot
+    return PackedMask(tuple(box), zlib.compress(np.packbits(crop).tobytes(), 1))
+
+
+def _unpack_bytes(box, data):
+    width, height = box[2] - box[0], box[3] - box[1]
+    bits = np.unpackbits(np.frombuffer(zlib.decompress(data), dtype=np.uint8), count=width * height)
+    return box, bits.reshape(height, width).astype(bool)
+
+
+def _iter_packed(value):
+    if isinstance(value, PackedMask):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from _iter_packed(item)
+
+
+class UndoHistory:
+    """Action history whose mask snapshots are stored as compressed deltas
+
+    Actions are plain dicts like before; any PackedMask inside them counts
+    against memory_budget. When the budget is exceeded, the oldest snapshots
+    are spilled to a temporary file and read back only if undo reaches them.
+    Undone actions wait on a redo stack until a new action is appended.
+
+    Spilling resumes from the oldest action that still holds snapshots in
+    memory, so staying over budget does not rescan the history. The spill
+    file is truncated once none of the data in it is referenced any more,
+    and compacted when mostly dead, so it stays proportional to the live data.
+    """
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.memory_used = 0
+        self.actions = []
+        self.redo_actions = []
+        self.spill_file = None
+        # actions[:spill_cursor] hold no snapshots in memory
+        self.spill_cursor = 0
+        # Bytes in the spill file still referenced by an action, and the file's length
+        self.spilled_bytes = 0
+        self.spill_size = 0
+
+    def __len__(self):
+        return len(self.actions)
+
+    def __iter__(self):
+        return iter(self.actions)
+
+    def __getitem__(self, index):
+        return self.actions[index]
+
+    def append(self, action):
+        """Record a new action; this discards anything that could have been redone"""
+        for undone in self.redo_actions:
+            self._release(undone)
+            self._discard_spilled(undone)
+        self.redo_actions = []
+        self.push(action)
+
+    def push(self, action):
+        """Put an action on the undo stack without touching the redo stack"""
+        self.actions.append(action)
+        self._account(action)
+
+    def pop(self):
+        action = self.actions.pop()
+        self.spill_cursor = min(self.spill_cursor, len(self.actions))
+        self._release(action)
+        return action
+
+    def push_redo(self, action):
+        self.redo_actions.append(action)
+        self._account(action)
+
+    def pop_redo(self):
+        action = self.redo_actions.pop()
+        self._release(action)
+        return action
+
+    @property
+    def can_redo(self):
+        return bool(self.redo_actions)
+
+    def clear(self):
+        self.actions = []
+        self.redo_actions = []
+        self.memory_used = 0
+        self.spill_cursor = 0
+        self.spilled_bytes = 0
+        self.spill_size = 0
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+    def unpack(self, packed):
+        """Decompress a PackedMask back into a mask store snapshot, reading spilled data if needed"""
+        if packed is None:
+            return None
+        data = packed.data
+        if data is None:
+            self.spill_file.seek(packed.spill_offset)
+            data = self.spill_file.read(packed.spill_length)
+        return _unpack_bytes(packed.box, data)
+
+    def take(self, action, key):
+        """Remove a snapshot from an action and unpack it; its spilled data is no longer needed"""
+        packed = action.pop(key)
+        snapshot = self.unpack(packed)
+        if packed is not None and packed.data is None:
+            self._discard_spilled({key: packed})
+        return snapshot
+
+    def _account(self, action):
+        for packed in _iter_packed(action):
+            self.memory_used += packed.nbytes
+        self._enforce_budget()
+
+    def _release(self, action):
+        for packed in _iter_packed(action):
+            self.memory_used -= packed.nbytes
+
+    def _discard_spilled(self, action):
+        """Forget the spilled data of a dropped action, truncating or compacting the file as it dies"""
+        for packed in _iter_packed(action):
+            if packed.data is None and packed.spill_length is not None:
+                self.spilled_bytes -= packed.spill_length
+        if self.spill_file is None:
+            return
+        if self.spilled_bytes == 0:
+            self.spill_file.truncate(0)
+            self.spill_size = 0
+        elif self.spill_size - self.spilled_bytes > max(SPILL_COMPACT_MIN, self.spill_size * SPILL_COMPACT_FRACTION):
+            self._compact()
+
+    def _compact(self):
+        """Copy the spilled data still referenced into a fresh file, dropping the dead regions"""
+        compacted = tempfile.TemporaryFile(prefix="hand_seg_undo_")
+        for action in self.actions + self.redo_actions:
+            for packed in _iter_packed(action):
+                if packed.data is not None:
+                    continue
+                self.spill_file.seek(packed.spill_offset)
+                data = self.spill_file.read(packed.spill_length)
+                packed.spill_offset = compacted.tell()
+                compacted.write(data)
+        self.spill_file.close()
+        self.spill_file = compacted
+        self.spill_size = compacted.tell()
+
+    def _spill_action(self, action):
+        """Spill an action's snapshots until the budget is met, returns whether it was"""
+        for packed in _iter_packed(action):
+            if packed.data is None:
+                continue
+            self._spill(packed)
+            if self.memory_used <= self.memory_budget:
+                return True
+        return False
+
+    def _enforce_budget(self):
+        if self.memory_used <= self.memory_budget:
+            return
+        while self.spill_cursor < len(self.actions):
+            if self._spill_action(self.actions[self.spill_cursor]):
+                return
+            self.spill_cursor += 1
+        for action in self.redo_actions[::-1]:
+            if self._spill_action(action):
+                return
+
+    def _spill(self, packed):
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(prefix="hand_seg_undo_")
+        self.spill_file.seek(0, 2)
+        packed.spill_offset = self.spill_file.tell()
+        packed.spill_length = len(packed.data)
+        self.spill_file.write(packed.data)
+        self.spill_size = packed.spill_offset + packed.spill_length
+        self.spilled_bytes += len(packed.data)
+        self.memory_used -= len(packed.data)
+        packed.data = None